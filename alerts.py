@@ -0,0 +1,288 @@
+import queue
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from constants import ALERTS_DB_PATH, ALERTS_PER_CHAT, ALERT_MAX_MOVE_WINDOW
+
+ALERT_ABOVE = "above"  # Fires when the price rises to or through `value` (USD)
+ALERT_BELOW = "below"  # Fires when the price falls to or through `value` (USD)
+ALERT_MOVE = "move"    # Fires when the price moved by `value` percent (either way) within `window` seconds
+
+Alert = namedtuple("Alert", ["id", "chat_id", "symbol", "kind", "value", "window"])
+
+ALERT_COMMAND_PATTERN = re.compile(
+    r"^(?P<symbol>[A-Z0-9]{2,10})\s+(?:"
+    r"(?P<direction>>|<|ABOVE|BELOW)\s*\$?(?P<price>\d*\.?\d+)(?:\s*USD)?"
+    r"|[±+-]?(?P<percent>\d*\.?\d+)\s*%\s*(?:IN\s+)?(?P<window>\d+)\s*(?P<unit>M|MIN|H|D))$"
+)
+WINDOW_UNITS = {"M": 60, "MIN": 60, "H": 3600, "D": 86400}
+
+
+class _ThresholdIndex:
+    """Thresholds of one symbol and alert kind, sorted ascending, with their alert ids alongside."""
+
+    __slots__ = ("values", "ids")
+
+    def __init__(self):
+        self.values = []
+        self.ids = []
+
+    def add(self, value, alert_id):
+        index = bisect_right(self.values, value)
+        self.values.insert(index, value)
+        self.ids.insert(index, alert_id)
+
+    def remove(self, value, alert_id):
+        index = bisect_left(self.values, value)
+        while index < len(self.values) and self.values[index] == value:
+            if self.ids[index] == alert_id:
+                del self.values[index], self.ids[index]
+                return
+            index += 1
+
+
+class AlertEngine:
+    """
+    Price alerts evaluated against every published PriceSnapshot.
+
+    Alerts live in sorted per-symbol threshold indexes, so a new price only
+    touches the alerts it crosses: a rise from `old` to `new` fires the "above"
+    thresholds in (old, new], found with two bisects, and a fall fires the
+    "below" thresholds in [new, old). The first price of a symbol (e.g. after a
+    restart, or for alerts set before any price was known) fires every threshold
+    it is already at or through. Percent-move alerts are grouped by symbol and
+    window; the move is computed once per group from the price history and every
+    alert with a percentage at or below it fires. Alerts are one-shot.
+
+    Subscriptions are stored in SQLite and reloaded on start. Fired alerts are
+    handed to a notifier thread, which deletes them from disk and hands one
+    message per chat to `notify`, which must not block (e.g. the Telegram outbox).
+    `clock` returns unix time, for the move windows and creation times.
+    """
+
+    def __init__(self, history, notify, path=ALERTS_DB_PATH, per_chat_limit=ALERTS_PER_CHAT, clock=time.time):
+        self.history = history
+        self.notify = notify
+        self.path = path
+        self.per_chat_limit = per_chat_limit
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._alerts = {}
+        self._chat_alerts = {}
+        self._thresholds = {}    # (symbol, kind) -> _ThresholdIndex
+        self._move_indexes = {}  # symbol -> {window: _ThresholdIndex}
+        self._last_prices = {}
+
+        self._fired = queue.Queue()
+        self._thread = None
+        self._connection = None
+        self._db_lock = threading.Lock()
+
+    def load(self):
+        """Opens the database and indexes every stored subscription."""
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db_lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS alerts ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, symbol TEXT NOT NULL,"
+                " kind TEXT NOT NULL, value REAL NOT NULL, window_seconds REAL, created_at REAL NOT NULL)"
+            )
+            rows = self._connection.execute("SELECT id, chat_id, symbol, kind, value, window_seconds FROM alerts").fetchall()
+        with self._lock:
+            for row in rows:
+                self._index(Alert(*row))
+        return len(rows)
+
+    def start(self):
+        """Starts the notifier thread (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="alert-notifier", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Lets the notifier finish the queued notifications and stops it."""
+        self._fired.put(None)
+        if self._thread:
+            self._thread.join(timeout)
+
+    def subscribe(self, chat_id, symbol, kind, value, window=None):
+        """
+        Adds and persists an alert.
+
+        The checks, the insert and the indexing happen under one lock, so concurrent
+        subscriptions cannot exceed the chat's limit and no snapshot is evaluated
+        in between.
+
+        Raises:
+            ValueError: If the chat already has per_chat_limit alerts, or the last
+                evaluated price is already at or through the threshold.
+
+        Returns:
+            Alert: The new alert, with its id.
+        """
+        with self._lock:
+            if len(self._chat_alerts.get(chat_id, ())) >= self.per_chat_limit:
+                raise ValueError(f"A chat can have at most {self.per_chat_limit} alerts.")
+            price = self._last_prices.get(symbol)
+            if price is not None and ((kind == ALERT_ABOVE and price >= value) or (kind == ALERT_BELOW and price <= value)):
+                raise ValueError(f"{symbol} is already at *${price:.6g}*.")
+            with self._db_lock, self._connection:
+                cursor = self._connection.execute(
+                    "INSERT INTO alerts (chat_id, symbol, kind, value, window_seconds, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (chat_id, symbol, kind, value, window, self.clock())
+                )
+            alert = Alert(cursor.lastrowid, chat_id, symbol, kind, value, window)
+            self._index(alert)
+        return alert
+
+    def unsubscribe(self, chat_id, alert_id):
+        """Removes one of the chat's alerts; returns False if it has no such alert."""
+        with self._lock:
+            alert = self._alerts.get(alert_id)
+            if alert is None or alert.chat_id != chat_id:
+                return False
+            self._unindex(alert)
+        self._delete([alert_id])
+        return True
+
+    def chat_alerts(self, chat_id):
+        """Returns the chat's alerts, oldest first."""
+        with self._lock:
+            return sorted((self._alerts[alert_id] for alert_id in self._chat_alerts.get(chat_id, ())),
+                          key=lambda alert: alert.id)
+
+    def last_price(self, symbol):
+        """Returns the last price the engine evaluated for a symbol, or None."""
+        return self._last_prices.get(symbol)
+
+    def on_snapshot(self, snapshot):
+        """
+        PriceRefresher listener: fires the alerts crossed since the previous snapshot.
+
+        Only finds and unindexes the fired alerts; deleting them and notifying
+        happens on the notifier thread, so the refresher is never held up.
+        """
+        now = self.clock()
+        fired = []
+        with self._lock:
+            for symbol, price_data in snapshot.prices.items():
+                price = price_data.get("price") if price_data else None
+                if price is None:
+                    continue
+                old_price = self._last_prices.get(symbol)
+                self._last_prices[symbol] = price
+
+                if old_price is None or price > old_price:
+                    index = self._thresholds.get((symbol, ALERT_ABOVE))
+                    if index is not None:
+                        start = bisect_right(index.values, old_price) if old_price is not None else 0
+                        fired += [(alert_id, price) for alert_id in index.ids[start:bisect_right(index.values, price)]]
+                if old_price is None or price < old_price:
+                    index = self._thresholds.get((symbol, ALERT_BELOW))
+                    if index is not None:
+                        end = bisect_left(index.values, old_price) if old_price is not None else len(index.values)
+                        fired += [(alert_id, price) for alert_id in index.ids[bisect_left(index.values, price):end]]
+
+                for window, index in self._move_indexes.get(symbol, {}).items():
+                    if not index.values:
+                        continue
+                    change = self.history.change_since(symbol, now - window)
+                    if change is not None:
+                        fired += [(alert_id, price) for alert_id in index.ids[:bisect_right(index.values, abs(change))]]
+
+            fired = [(self._alerts[alert_id], price) for alert_id, price in fired]
+            for alert, _ in fired:
+                self._unindex(alert)
+        if fired:
+            self._fired.put(fired)
+        return [alert for alert, _ in fired]
+
+    def _index(self, alert):
+        """Adds an alert to the lookup structures (lock held)."""
+        self._alerts[alert.id] = alert
+        self._chat_alerts.setdefault(alert.chat_id, set()).add(alert.id)
+        if alert.kind == ALERT_MOVE:
+            index = self._move_indexes.setdefault(alert.symbol, {}).setdefault(alert.window, _ThresholdIndex())
+        else:
+            index = self._thresholds.setdefault((alert.symbol, alert.kind), _ThresholdIndex())
+        index.add(alert.value, alert.id)
+
+    def _unindex(self, alert):
+        """Removes an alert from the lookup structures (lock held)."""
+        del self._alerts[alert.id]
+        chat_alert_ids = self._chat_alerts[alert.chat_id]
+        chat_alert_ids.discard(alert.id)
+        if not chat_alert_ids:
+            del self._chat_alerts[alert.chat_id]
+        if alert.kind == ALERT_MOVE:
+            self._move_indexes[alert.symbol][alert.window].remove(alert.value, alert.id)
+        else:
+            self._thresholds[(alert.symbol, alert.kind)].remove(alert.value, alert.id)
+
+    def _delete(self, alert_ids):
+        with self._db_lock, self._connection:
+            self._connection.executemany("DELETE FROM alerts WHERE id = ?", [(alert_id,) for alert_id in alert_ids])
+
+    def _run(self):
+        while True:
+            fired = self._fired.get()
+            if fired is None:
+                return
+            try:
+                self._delete([alert.id for alert, _ in fired])
+            except sqlite3.Error as e:
+                print(f"Error deleting fired alerts: {e}")
+
+            by_chat = {}
+            for alert, price in fired:
+                by_chat.setdefault(alert.chat_id, []).append(format_fired_alert(alert, price))
+            for chat_id, lines in by_chat.items():
+                try:
+                    self.notify(chat_id, "🔔 *Price alert*\n\n" + "\n".join(lines))
+                except Exception as e:
+                    print(f"Error sending alerts to chat {chat_id}: {e}")
+
+
+def parse_alert_command(text):
+    """
+    Parses the arguments of /alert: "TON > 7", "TON below 5 USD" or "BTC 5% 1h".
+
+    Returns:
+        tuple: (symbol, kind, value, window) with window None for price thresholds,
+        or None if the text is not a valid alert.
+    """
+    match = ALERT_COMMAND_PATTERN.match(text.strip().upper())
+    if not match:
+        return None
+    symbol = match.group("symbol")
+    if match.group("direction"):
+        kind = ALERT_ABOVE if match.group("direction") in (">", "ABOVE") else ALERT_BELOW
+        return symbol, kind, float(match.group("price")), None
+    window = int(match.group("window")) * WINDOW_UNITS[match.group("unit")]
+    percent = float(match.group("percent"))
+    if not 0 < window <= ALERT_MAX_MOVE_WINDOW or percent <= 0:
+        return None
+    return symbol, ALERT_MOVE, percent, window
+
+def format_window(seconds):
+    """Formats a move window as e.g. "1h", "30m" or "1d"."""
+    for unit, length in (("d", 86400), ("h", 3600)):
+        if seconds % length == 0:
+            return f"{seconds // length:.0f}{unit}"
+    return f"{seconds // 60:.0f}m"
+
+def format_alert(alert):
+    """Describes an alert for /alerts, e.g. "TON above $7"."""
+    if alert.kind == ALERT_MOVE:
+        return f"{alert.symbol} moves ±{alert.value:g}% within {format_window(alert.window)}"
+    return f"{alert.symbol} {alert.kind} ${alert.value:g}"
+
+def format_fired_alert(alert, price):
+    """Describes a fired alert with the price that triggered it."""
+    return f"• {format_alert(alert)} — now *${price:.6g}*"
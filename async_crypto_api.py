@@ -0,0 +1,411 @@
+import asyncio
+import inspect
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+
+import crypto_api
+import metrics
+from circuit_breaker import CIRCUIT_CLOSED
+from constants import (
+    CMC_API_KEYS, CMC_QUOTES_URL, EXCHANGE_RATE_PAIR_URL, EXCHANGE_RATE_LATEST_URL,
+    DEXSCREENER_API_URL, DEXSCREENER_TOKENS_API_URL, DEXSCREENER_FALLBACK_TOKENS, FIAT_CURRENCY_SET, CMC_HEDGE_DELAY,
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_MAXSIZE, API_KEY_MAX_QUEUE_WAIT
+)
+from request_steps import Reply, Send, Sleep
+
+# Async counterparts of the fetchers in crypto_api. The request policies (key
+# rotation, retries, shared-state leases) are crypto_api's step generators, run
+# here with aiohttp and asyncio.sleep so a retry never holds up other updates;
+# blocking steps (SQLite) go to a worker thread. The price cache, its in-flight
+# fetches and the background refreshes are shared with the threaded fetchers.
+
+_session = None
+
+# In-flight FX, /pair and DexScreener requests, so concurrent coroutines share a single request
+_inflight_requests = {}
+
+# Strong references to the background refresh tasks
+_background_tasks = set()
+
+async def get_session():
+    """Returns the shared aiohttp session, creating it inside the running loop on first use."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit_per_host=HTTP_POOL_MAXSIZE),
+        )
+    return _session
+
+async def close_session():
+    """Closes the shared aiohttp session (used on shutdown)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+async def _single_flight(key, fetch, default=None):
+    """
+    Runs `fetch()` unless a request for `key` is already in flight, in which case its result is awaited.
+
+    If the leading request raises, waiters receive `default` and the leader re-raises.
+    """
+    future = _inflight_requests.get(key)
+    if future is not None:
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight_requests[key] = future
+    try:
+        result = await fetch()
+        future.set_result(result)
+        return result
+    finally:
+        del _inflight_requests[key]
+        if not future.done():
+            future.set_result(default)
+
+async def run_steps(steps):
+    """
+    Drives a step generator (see request_steps) without blocking the event loop.
+
+    Returns:
+        The generator's return value.
+    """
+    result, error = None, None
+    try:
+        while True:
+            try:
+                step = steps.throw(error) if error is not None else steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                if isinstance(step, Send):
+                    result = await _send(step)
+                elif isinstance(step, Sleep):
+                    await asyncio.sleep(step.seconds)
+                elif step.blocking:
+                    result = await asyncio.to_thread(step.function, *step.args)
+                else:
+                    result = step.function(*step.args)
+                    if inspect.isawaitable(result):
+                        result = await result
+            except Exception as e:
+                error = e
+    finally:
+        # On cancellation this lets the policy give back its key or leases
+        steps.close()
+
+async def _send(step):
+    session = await get_session()
+    try:
+        async with session.get(step.url, params=step.params, headers=step.headers) as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = {}
+            return Reply(response.status, response.headers, body if isinstance(body, dict) else {}, None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return Reply("error", {}, {}, e)
+
+async def _store(function, *args):
+    """
+    Calls one of crypto_api's cache writers, in a worker thread when it publishes
+    to the shared state (a SQLite write) so the event loop never waits on disk.
+    """
+    if crypto_api.shared_state is None:
+        return function(*args)
+    return await asyncio.to_thread(function, *args)
+
+def _revalidate_in_background(keys, refresh):
+    """
+    Async counterpart of crypto_api._revalidate_in_background: refresh(keys) runs as
+    a task, for the keys no thread or task is already refreshing.
+    """
+    keys = crypto_api.claim_revalidation(keys)
+    if not keys:
+        return
+
+    async def run():
+        try:
+            await refresh(keys)
+        except Exception as e:
+            print(f"Error refreshing stale cache entries {keys}: {e}")
+        finally:
+            crypto_api.release_revalidation(keys)
+
+    task = asyncio.get_running_loop().create_task(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def get_crypto_prices(symbols, use_cache=True):
+    """
+    Fetches the latest cryptocurrency prices from CoinMarketCap, using cache if available.
+
+    Stale-while-revalidate rules are the same as crypto_api.get_crypto_prices, and
+    in-flight fetches are shared with it.
+
+    Args:
+        symbols (list): List of cryptocurrency symbols to fetch prices for.
+        use_cache (bool): If False, always fetch from the API (the cache is still updated).
+
+    Returns:
+        dict: A dictionary containing the prices and other details for the requested symbols.
+    """
+    lookup = crypto_api.begin_price_lookup(symbols, use_cache)
+    if lookup.stale_symbols:
+        _revalidate_in_background([("crypto", symbol) for symbol in lookup.stale_symbols],
+                                  lambda keys: get_crypto_prices([symbol for _, symbol in keys], use_cache=False))
+
+    if lookup.to_fetch:
+        fetched = {}
+        try:
+            fetched, shared = await run_steps(crypto_api.shared_fetch_steps(
+                "crypto_price", lookup.to_fetch, crypto_api.price_fetch_max_age(use_cache), _fetch_crypto_prices))
+            fetched.update(crypto_api.adopt_shared_crypto_prices(shared))
+        finally:
+            crypto_api.finish_price_fetch(lookup, fetched)
+
+    for fetch in set(lookup.pending.values()):
+        await _wait_for_fetch(fetch)
+    return crypto_api.collect_price_lookup(lookup)
+
+async def _wait_for_fetch(fetch):
+    """Awaits a price fetch led by another task or thread (a crypto_api._InflightFetch)."""
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+
+    def resolve():
+        if not finished.done():
+            finished.set_result(None)
+
+    fetch.add_done_callback(lambda: loop.call_soon_threadsafe(resolve))
+    await finished
+
+async def _fetch_crypto_prices(symbols_to_fetch):
+    """
+    Fetches prices for the given symbols from CoinMarketCap, bypassing the cache.
+
+    Requests are chunked by crypto_api.quote_chunks (by ID where the index knows
+    the symbol) and the chunks are awaited concurrently. Symbols CMC could not
+    price fall back to DexScreener, as in crypto_api._fetch_crypto_prices.
+    """
+    results = {}
+    chunks = crypto_api.quote_chunks(symbols_to_fetch)
+    for chunk_results in await asyncio.gather(*(_fetch_quote_chunk(*chunk) for chunk in chunks)):
+        results.update(chunk_results)
+
+    unpriced = [symbol for symbol in symbols_to_fetch if results.get(symbol) is None and symbol in DEXSCREENER_FALLBACK_TOKENS]
+    if unpriced:
+        results.update(await _fetch_dexscreener_prices(unpriced))
+    return results
+
+async def _fetch_quote_chunk(symbols, ids):
+    if CMC_HEDGE_DELAY is not None and len(CMC_API_KEYS) > 1:
+        body = await _request_cmc_hedged(CMC_QUOTES_URL, crypto_api.quote_params(symbols, ids))
+    else:
+        body = await _request_cmc(CMC_QUOTES_URL, crypto_api.quote_params(symbols, ids))
+    if body is None:
+        return {}
+    return await _store(crypto_api.store_quote_chunk, symbols, ids, body.get("data", {}))
+
+async def _request_cmc_hedged(url, params):
+    """Async counterpart of crypto_api._request_cmc_hedged; the slower request is cancelled."""
+    primary = asyncio.ensure_future(_request_cmc(url, params))
+    done, _ = await asyncio.wait({primary}, timeout=CMC_HEDGE_DELAY)
+    if done or crypto_api.cmc_breaker.state != CIRCUIT_CLOSED or not crypto_api.cmc_key_pool.has_idle_key():
+        return await primary
+
+    metrics.UPSTREAM_HEDGES.inc("cmc")
+    hedge = asyncio.ensure_future(run_steps(crypto_api.cmc_request_steps(url, params, idle_only=True)))
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                body = task.result()
+                if body is not None:
+                    return body
+        return None
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def _request_cmc(url, params):
+    """Sends a CoinMarketCap request (crypto_api.cmc_request_steps), queueing up to API_KEY_MAX_QUEUE_WAIT for a key."""
+    return await run_steps(crypto_api.cmc_request_steps(url, params, API_KEY_MAX_QUEUE_WAIT))
+
+async def get_currency_rate(from_currency, to_currency):
+    """
+    Returns the conversion rate between two fiat currencies, using cache if available.
+
+    Pairs within FIAT_CURRENCIES are a lookup in the shared cross-rate matrix; any
+    other pair falls back to ExchangeRate-API's /pair endpoint.
+
+    Args:
+        from_currency (str): The source currency code.
+        to_currency (str): The target currency code.
+
+    Returns:
+        float: The conversion rate, or None if an error occurs or rate not found.
+    """
+    if from_currency in FIAT_CURRENCY_SET and to_currency in FIAT_CURRENCY_SET:
+        return crypto_api.lookup_fx_rate(await get_fx_table(), from_currency, to_currency)
+
+    cache_key = (from_currency, to_currency)
+    state = None
+    cached = crypto_api.exchange_rate_cache.get(cache_key)
+    if cached is not None:
+        rate, timestamp = cached
+        state = crypto_api.cache_state(datetime.now(timezone.utc) - timestamp, crypto_api.EXCHANGE_RATE_CACHE_DURATION,
+                                       crypto_api.EXCHANGE_RATE_CACHE_GRACE, crypto_api.EXCHANGE_RATE_CACHE_MAX_STALENESS)
+    metrics.CACHE_LOOKUPS.inc("exchange_rate", crypto_api.cache_lookup_result(state))
+    if state == crypto_api.CACHE_FRESH:
+        return rate
+    if state == crypto_api.CACHE_STALE:
+        _revalidate_in_background([("pair", cache_key)], lambda keys: _refresh_currency_rate(from_currency, to_currency))
+        return rate
+
+    fetched_rate = await _refresh_currency_rate(from_currency, to_currency)
+    if fetched_rate is None and state == crypto_api.CACHE_EXPIRED:
+        return rate
+    return fetched_rate
+
+async def _refresh_currency_rate(from_currency, to_currency):
+    return await _single_flight(("rate", (from_currency, to_currency)), lambda: _fetch_currency_rate(from_currency, to_currency))
+
+async def get_fx_table():
+    """
+    Returns the shared fiat cross-rate table, refreshing it from /latest when expired.
+
+    A table within the grace window is returned at once and refreshed in the background.
+    """
+    table = crypto_api.fx_rate_table
+    state = crypto_api.fx_table_state(table)
+    metrics.CACHE_LOOKUPS.inc("fx_table", crypto_api.cache_lookup_result(state))
+    if state == crypto_api.CACHE_FRESH:
+        return table
+    if state == crypto_api.CACHE_STALE:
+        _revalidate_in_background(["fx_table"], lambda keys: _single_flight("fx_table", _fetch_fx_table))
+        return table
+
+    refreshed = await _single_flight("fx_table", _fetch_fx_table)
+    if refreshed is None and state == crypto_api.CACHE_EXPIRED:
+        return table
+    return refreshed
+
+async def _fetch_fx_table():
+    """Fetches the base-currency rate table (or reuses another process's fresh one) and publishes it."""
+    base_currency = crypto_api.FX_TABLE_BASE_CURRENCY
+    fetched, shared = await run_steps(crypto_api.shared_fetch_steps(
+        "fx_table", [base_currency], crypto_api.EXCHANGE_RATE_CACHE_DURATION.total_seconds(),
+        lambda keys: _request_fx_table(base_currency)))
+    if base_currency in shared:
+        return crypto_api.adopt_shared_fx_table(*shared[base_currency])
+    return fetched.get(base_currency)
+
+async def _request_fx_table(base_currency):
+    """Fetches and publishes the FX table, keyed by base currency for shared_fetch_steps."""
+    data = await _request_exchange_rate_api(EXCHANGE_RATE_LATEST_URL, base_currency=base_currency)
+    if data is None or not data.get("conversion_rates"):
+        return {}
+    table = crypto_api.build_fx_table(data["conversion_rates"], datetime.now(timezone.utc))
+    return {base_currency: await _store(crypto_api.store_fx_table, table)}
+
+async def _fetch_currency_rate(from_currency, to_currency):
+    """Fetches a single conversion rate (or reuses another process's fresh one), bypassing the local cache."""
+    pair = f"{from_currency}/{to_currency}"
+    fetched, shared = await run_steps(crypto_api.shared_fetch_steps(
+        "exchange_rate", [pair], crypto_api.EXCHANGE_RATE_CACHE_DURATION.total_seconds(),
+        lambda pairs: _request_currency_rate(from_currency, to_currency)))
+    if pair in shared:
+        return crypto_api.adopt_shared_pair_rate((from_currency, to_currency), *shared[pair])
+    return fetched.get(pair)
+
+async def _request_currency_rate(from_currency, to_currency):
+    """Requests a single pair rate and caches it, keyed as "FROM/TO" for shared_fetch_steps."""
+    data = await _request_exchange_rate_api(EXCHANGE_RATE_PAIR_URL, from_currency=from_currency, to_currency=to_currency)
+    if data is None:
+        return {}
+    rate = data.get('conversion_rate')
+    if rate is None:
+        print(f"Error: 'conversion_rate' not found in ExchangeRate-API response for {from_currency}/{to_currency}. Response: {data}")
+        return {}
+    rate = await _store(crypto_api._store_pair_rate, (from_currency, to_currency), float(rate), datetime.now(timezone.utc))
+    return {f"{from_currency}/{to_currency}": rate}
+
+async def _request_exchange_rate_api(url_template, **url_fields):
+    """
+    Sends an ExchangeRate-API request (crypto_api.exchange_rate_request_steps),
+    queueing up to API_KEY_MAX_QUEUE_WAIT for a key.
+
+    Returns:
+        dict: The successful JSON response, or None if the request failed.
+    """
+    return await run_steps(crypto_api.exchange_rate_request_steps(url_template, url_fields, API_KEY_MAX_QUEUE_WAIT))
+
+async def get_ton_token_info(address):
+    """Fetches TON token information from DexScreener using a contract address, using cache if available."""
+    cached_result = crypto_api._get_cached_token_info(address)
+    if cached_result:
+        return cached_result
+    return await _single_flight(("ton", address), lambda: _fetch_ton_token_info(address),
+                                default=(None, "⚠️ An unexpected error occurred while processing the address."))
+
+async def _request_dexscreener(url):
+    """
+    Async counterpart of crypto_api._request_dexscreener.
+
+    Raises:
+        aiohttp.ClientError, asyncio.TimeoutError: On transport errors and error statuses.
+
+    Returns:
+        dict: The decoded JSON body, or None without a request while the circuit is open.
+    """
+    breaker = crypto_api.dexscreener_breaker
+    if not breaker.allow():
+        return None
+    status = "error"
+    started = time.perf_counter()
+    try:
+        session = await get_session()
+        async with session.get(url) as response:
+            status = response.status
+            metrics.observe_upstream("dexscreener", status, None, started)
+            response.raise_for_status()
+            data = await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        if status == "error":
+            metrics.observe_upstream("dexscreener", status, None, started)
+        if status == "error" or status >= 500:
+            breaker.record_failure()
+        raise
+    breaker.record_success()
+    return data
+
+async def _fetch_dexscreener_prices(symbols):
+    """Async counterpart of crypto_api._fetch_dexscreener_prices."""
+    addresses = {DEXSCREENER_FALLBACK_TOKENS[symbol]: symbol for symbol in symbols}
+    try:
+        data = await _request_dexscreener(DEXSCREENER_TOKENS_API_URL.format(addresses=",".join(addresses)))
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        print(f"Error fetching fallback prices from DexScreener: {e}")
+        return {}
+    return await _store(crypto_api.store_dexscreener_prices, addresses, (data or {}).get("pairs") or [])
+
+async def _fetch_ton_token_info(address):
+    try:
+        data = await _request_dexscreener(DEXSCREENER_API_URL.format(address=address))
+        if data is None:
+            return None, crypto_api.DEXSCREENER_UNAVAILABLE
+        return await _store(crypto_api._store_token_info, address, crypto_api.build_ton_token_response(address, data))
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error fetching data from DexScreener for {address}: {e}")
+        return None, "⚠️ Error fetching token data from DexScreener. Please try again later."
+    except Exception as e:
+        print(f"An unexpected error occurred while processing address {address}: {e}")
+        return None, "⚠️ An unexpected error occurred while processing the address."
@@ -0,0 +1,372 @@
+"""
+Offline throughput benchmark for the threaded bot (cryptoTeller.py).
+
+Starts one local stub server that stands in for CoinMarketCap, ExchangeRate-API,
+DexScreener and the Telegram Bot API, points the bot at it, and replays Telegram
+updates through the real handlers. Reports updates per second, p50/p99 handler
+latency per update kind and upstream calls per update.
+
+Usage:
+    python benchmark.py                                   # 2000 synthetic updates
+    python benchmark.py --updates 5000 --concurrency 16 --latency 0.08
+    python benchmark.py --rate-limit-ratio 0.05 --error-ratio 0.02
+    python benchmark.py --replay recorded_updates.jsonl   # one Update JSON per line
+"""
+import argparse
+import json
+import os
+import random
+import string
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from constants import CRYPTO_SYMBOLS, CURRENCY_PAGES, FIAT_CURRENCIES, SUPPORTED_CURRENCIES
+
+# cryptoTeller creates its TeleBot at import time, so it needs a well-formed token
+os.environ.setdefault("MAIN_KEY", "123456:BENCHMARK")
+
+import async_crypto_api  # noqa: E402
+import bot_core  # noqa: E402
+import crypto_api  # noqa: E402
+import cryptoTeller  # noqa: E402
+from telebot import apihelper, types  # noqa: E402
+
+
+# CoinMarketCap IDs served by the stub's /cryptocurrency/map
+STUB_CMC_IDS = {symbol: cmc_id for cmc_id, symbol in enumerate(
+    dict.fromkeys(CRYPTO_SYMBOLS + [symbol for page in CURRENCY_PAGES for symbol in page]), start=1)}
+
+
+class UpstreamStub:
+    """
+    Local HTTP server mimicking the upstream APIs and the Telegram Bot API.
+
+    Upstream requests sleep for `latency` seconds and fail with a 429 or 503 at the
+    configured ratios; Telegram calls only sleep for `telegram_latency`. `calls`
+    counts requests per upstream ("cmc", "exchange_rate", "dexscreener", "telegram").
+    """
+
+    def __init__(self, latency=0.05, rate_limit_ratio=0.0, error_ratio=0.0, telegram_latency=0.0, seed=0):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.telegram_latency = telegram_latency
+        self.calls = Counter()
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_message_id = 1
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        stub = self
+
+        class Handler(_StubRequestHandler):
+            pass
+        Handler.stub = stub
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="upstream-stub", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def fault(self):
+        """Picks the injected failure for one upstream request: 429, 503 or None."""
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.rate_limit_ratio:
+            return 429
+        if roll < self.rate_limit_ratio + self.error_ratio:
+            return 503
+        return None
+
+    def count(self, upstream):
+        with self._lock:
+            self.calls[upstream] += 1
+
+    def message_id(self):
+        with self._lock:
+            self._next_message_id += 1
+            return self._next_message_id
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real upstreams
+    disable_nagle_algorithm = True  # Otherwise headers and body wait on delayed ACKs (~40ms)
+    stub = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if parts[0].startswith("bot"):
+            self._telegram(parts[-1], query)
+        elif url.path == "/v1/cryptocurrency/quotes/latest":
+            self._upstream("cmc", lambda: self._cmc_quotes(query.get("symbol", ""), query.get("id", "")))
+        elif url.path == "/v1/cryptocurrency/map":
+            self._upstream("cmc", lambda: {"status": {"error_code": 0, "credit_count": 1}, "data": [
+                {"id": cmc_id, "symbol": symbol, "rank": cmc_id, "is_active": 1} for symbol, cmc_id in STUB_CMC_IDS.items()]})
+        elif parts[0] == "v6":
+            self._upstream("exchange_rate", lambda: self._exchange_rate(parts))
+        elif url.path == "/latest/dex/search":
+            self._upstream("dexscreener", lambda: {"pairs": _token_pairs(query.get("q", ""))})
+        elif url.path.startswith("/latest/dex/tokens/"):
+            addresses = parts[-1].split(",")
+            self._upstream("dexscreener", lambda: {"pairs": [pair for address in addresses for pair in _token_pairs(address)]})
+        else:
+            self._send(404, {"error": "not found"})
+
+    do_POST = do_GET
+
+    def _upstream(self, upstream, build_body):
+        self.stub.count(upstream)
+        time.sleep(self.stub.latency)
+        fault = self.stub.fault()
+        if fault == 429:
+            body = {"status": {"error_code": 1008, "error_message": "rate limited"}, "result": "error",
+                    "error-type": "rate-limit-reached"}
+            self._send(429, body, {"Retry-After": "1"})
+        elif fault == 503:
+            self._send(503, {"result": "error", "error-type": "server-error"})
+        else:
+            self._send(200, build_body())
+
+    def _telegram(self, method_name, query):
+        self.stub.count("telegram")
+        if self.stub.telegram_latency:
+            time.sleep(self.stub.telegram_latency)
+        if method_name in ("sendMessage", "editMessageText"):
+            chat_id = int(query.get("chat_id", 0))
+            result = {"message_id": self.stub.message_id(), "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "supergroup"}, "text": query.get("text", "")}
+        else:
+            result = True
+        self._send(200, {"ok": True, "result": result})
+
+    def _cmc_quotes(self, symbols, ids):
+        # Responses are keyed the way the request asked: by symbol or by ID
+        symbol_by_id = {str(cmc_id): symbol for symbol, cmc_id in STUB_CMC_IDS.items()}
+        keys = [(symbol, symbol) for symbol in filter(None, symbols.split(","))]
+        keys += [(cmc_id, symbol_by_id[cmc_id]) for cmc_id in filter(None, ids.split(",")) if cmc_id in symbol_by_id]
+        data = {}
+        for key, symbol in keys:
+            price = _stable_number(symbol, 0.001, 70000)
+            data[key] = {"symbol": symbol, "quote": {"USD": {
+                "price": price, "percent_change_24h": _stable_number(symbol + "24h", -10, 10),
+                "market_cap": price * 1e8, "volume_24h": price * 1e6,
+            }}}
+        return {"status": {"error_code": 0, "credit_count": 1}, "data": data}
+
+    def _exchange_rate(self, parts):
+        rates = {currency: _stable_number(currency, 0.5, 500) for currency in FIAT_CURRENCIES}
+        rates["USD"] = 1.0
+        if "latest" in parts:
+            base_rate = rates.get(parts[-1], 1.0)
+            return {"result": "success", "conversion_rates": {c: rate / base_rate for c, rate in rates.items()}}
+        from_currency, to_currency = parts[-2], parts[-1]
+        return {"result": "success", "conversion_rate": rates.get(to_currency, 1.0) / rates.get(from_currency, 1.0)}
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _stable_number(key, low, high):
+    """A pseudo-random number in [low, high) that is the same for a key on every run."""
+    return low + (high - low) * random.Random(key).random()
+
+def _token_pairs(address):
+    # Roughly one in ten addresses has no pairs, exercising the negative cache
+    if not address or random.Random(address).random() < 0.1:
+        return []
+    return [{
+        "chainId": "ton", "url": f"https://dexscreener.com/ton/{address.lower()}",
+        "baseToken": {"address": address, "name": f"Token {address[-4:]}", "symbol": address[-4:].upper()},
+        "priceUsd": f"{_stable_number(address, 0.0001, 5):.6f}",
+        "priceChange": {"h1": _stable_number(address + "h1", -5, 5), "h24": _stable_number(address + "h24", -20, 20)},
+        "volume": {"h24": _stable_number(address + "vol", 1e3, 1e7)},
+        "liquidity": {"usd": _stable_number(address + "liq", 1e3, 1e7)},
+        "fdv": _stable_number(address + "fdv", 1e5, 1e9),
+        "pairCreatedAt": int((time.time() - _stable_number(address + "age", 3600, 86400 * 90)) * 1000),
+    }]
+
+def point_bot_at(base_url):
+    """Redirects every upstream URL and the Telegram Bot API to the stub server."""
+    apihelper.API_URL = base_url + "/bot{0}/{1}"
+    crypto_api.CMC_MAP_URL = base_url + "/v1/cryptocurrency/map"
+    for module in (crypto_api, async_crypto_api):
+        module.CMC_QUOTES_URL = base_url + "/v1/cryptocurrency/quotes/latest"
+        module.EXCHANGE_RATE_PAIR_URL = base_url + "/v6/{api_key}/pair/{from_currency}/{to_currency}"
+        module.EXCHANGE_RATE_LATEST_URL = base_url + "/v6/{api_key}/latest/{base_currency}"
+        module.DEXSCREENER_API_URL = base_url + "/latest/dex/search?q={address}"
+        module.DEXSCREENER_TOKENS_API_URL = base_url + "/latest/dex/tokens/{addresses}"
+
+
+def synthetic_updates(count, seed=0, users=200, chats=30, addresses=100):
+    """
+    Generates a realistic mix of Telegram updates as Update JSON dicts.
+
+    Inline queries are typed one keystroke at a time, so most of them are
+    superseded by the user's next keystroke, as with real clients.
+    """
+    rng = random.Random(seed)
+    token_addresses = ["EQ" + "".join(rng.choice(string.ascii_letters + string.digits) for _ in range(46))
+                       for _ in range(addresses)]
+    updates = []
+
+    def user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def message(chat_id, user_id, text, reply_markup=None):
+        message = {"message_id": rng.randrange(1, 10**6), "date": int(time.time()), "text": text,
+                   "chat": {"id": chat_id, "type": "supergroup", "title": "Benchmark"}, "from": user(user_id)}
+        if reply_markup is not None:
+            message["reply_markup"] = reply_markup
+        return message
+
+    while len(updates) < count:
+        user_id = rng.randrange(1, users + 1)
+        chat_id = -1000000000000 - rng.randrange(chats)
+        kind = rng.choices(("inline", "address", "crypto", "pagination"), weights=(60, 15, 10, 15))[0]
+
+        if kind == "inline":
+            amount = rng.choice(("", "1 ", "10 ", "100 ", "2.5 "))
+            from_currency = rng.choice(SUPPORTED_CURRENCIES)
+            target = rng.choice(SUPPORTED_CURRENCIES + [None])
+            text = f"{amount}{from_currency}" + (f" {target}" if target else "")
+            for length in range(1, len(text) + 1):
+                updates.append({"update_id": len(updates) + 1, "inline_query": {
+                    "id": str(rng.getrandbits(48)), "from": user(user_id), "query": text[:length], "offset": ""}})
+        elif kind == "address":
+            text = f"what about {rng.choice(token_addresses)}?"
+            updates.append({"update_id": len(updates) + 1, "message": message(chat_id, user_id, text)})
+        elif kind == "crypto":
+            updates.append({"update_id": len(updates) + 1, "message": message(chat_id, user_id, "/crypto")})
+        else:
+            # Press the left or right arrow of a shown page, so the data is exactly what the
+            # keyboard sends (0-based pages, clamped at the first and last page)
+            shown_page = rng.randrange(len(CURRENCY_PAGES))
+            markup = bot_core.create_pagination_keyboard(shown_page, 1).to_dict()
+            pressed = rng.choice((markup["inline_keyboard"][0][0], markup["inline_keyboard"][0][2]))
+            updates.append({"update_id": len(updates) + 1, "callback_query": {
+                "id": str(rng.getrandbits(48)), "from": user(user_id), "chat_instance": str(chat_id),
+                "data": pressed["callback_data"],
+                "message": message(chat_id, user_id, "Current cryptocurrency prices:", markup)}})
+    return updates[:count]
+
+def update_kind(update):
+    """Classifies an Update JSON dict for the per-kind report."""
+    if "inline_query" in update:
+        return "inline"
+    if "callback_query" in update:
+        return "pagination"
+    text = update.get("message", {}).get("text", "")
+    return "crypto" if text.startswith("/crypto") else "message"
+
+def replay(updates, concurrency):
+    """
+    Feeds updates through the bot's real handlers on `concurrency` worker threads.
+
+    Returns:
+        tuple: (latencies in seconds by kind, error count, wall-clock duration).
+    """
+    bot = cryptoTeller.bot
+    bot.threaded = False  # Run handlers on the calling worker so their latency can be measured
+    latencies = {}
+    errors = Counter()
+
+    def run(update_json):
+        update = types.Update.de_json(update_json)
+        started = time.perf_counter()
+        try:
+            bot.process_new_updates([update])
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        return update_kind(update_json), time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for kind, latency in pool.map(run, updates):
+            latencies.setdefault(kind, []).append(latency)
+    return latencies, errors, time.perf_counter() - started
+
+def print_report(latencies, errors, duration, calls, concurrency):
+    total = sum(len(values) for values in latencies.values())
+    print(f"Replayed {total} updates in {duration:.2f}s on {concurrency} workers: "
+          f"{total / duration:,.1f} updates/s, {sum(errors.values())} errors {dict(errors) or ''}")
+    print(f"\n{'kind':<12}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    all_latencies = []
+    for kind, values in sorted(latencies.items()):
+        all_latencies.extend(values)
+        p50, p99 = np.percentile(values, [50, 99]) * 1000
+        print(f"{kind:<12}{len(values):>8}{p50:>10.1f}{p99:>10.1f}")
+    p50, p99 = np.percentile(all_latencies, [50, 99]) * 1000
+    print(f"{'all':<12}{total:>8}{p50:>10.1f}{p99:>10.1f}")
+
+    print("\nUpstream calls per update:")
+    for upstream in ("cmc", "exchange_rate", "dexscreener", "telegram"):
+        print(f"  {upstream:<14}{calls[upstream] / total:.4f}  ({calls[upstream]} total)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Telegram updates through the bot against local upstream stubs.")
+    parser.add_argument("--updates", type=int, default=2000, help="number of synthetic updates (default: 2000)")
+    parser.add_argument("--replay", metavar="FILE", help="replay Update JSON lines from FILE instead")
+    parser.add_argument("--concurrency", type=int, default=8, help="worker threads feeding updates (default: 8)")
+    parser.add_argument("--latency", type=float, default=0.05, help="upstream response latency in seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Telegram Bot API latency in seconds")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of upstream requests answered with 429")
+    parser.add_argument("--error-ratio", type=float, default=0.0, help="share of upstream requests answered with 503")
+    parser.add_argument("--with-refresher", action="store_true", help="run the background price refresher")
+    parser.add_argument("--flood-limits", action="store_true",
+                        help="pace outgoing messages at Telegram's real flood limits (the outbox may take minutes to drain)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stub = UpstreamStub(args.latency, args.rate_limit_ratio, args.error_ratio, args.telegram_latency, args.seed).start()
+    point_bot_at(stub.base_url)
+
+    if args.replay:
+        with open(args.replay, encoding="utf-8") as file:
+            updates = [json.loads(line) for line in file if line.strip()]
+    else:
+        updates = synthetic_updates(args.updates, args.seed)
+
+    outbox = cryptoTeller.outbox
+    if not args.flood_limits:
+        outbox.global_rate = outbox.chat_rate = outbox.group_rate = outbox.chat_burst = 1e9
+    outbox.start()
+    if args.with_refresher:
+        cryptoTeller.price_refresher.start()
+    try:
+        latencies, errors, duration = replay(updates, args.concurrency)
+    finally:
+        cryptoTeller.price_refresher.stop(timeout=5)
+        outbox.stop(timeout=30)  # Handlers only queue their messages; wait for them to go out
+        stub.stop()
+    print_report(latencies, errors, duration, stub.calls, args.concurrency)
+
+if __name__ == "__main__":
+    main()
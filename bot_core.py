@@ -0,0 +1,392 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from telebot import types
+from constants import (
+    CURRENCY_PAGES, PERSISTENT_CACHE_PATH, METRICS_HOST, METRICS_PORT, PRICE_SPARKLINE_WINDOW, STARTUP_WARM_TOKENS,
+    RENDERED_PAGES_TTL
+)
+import crypto_api
+import metrics
+import bounded_cache
+from alerts import AlertEngine, format_alert, parse_alert_command
+from crypto_api import cmc_key_pool, get_fx_table
+from chat_state import ChatStateStore
+from persistent_cache import PersistentCache
+from shared_state import SharedState
+from startup import StartupPipeline
+from price_refresher import PriceRefresher
+from conversion import stale_price_note
+from inline_engine import InlineQueryEngine
+from telegram_outbox import TelegramOutbox
+
+# State, rendering and startup shared by both execution modes (cryptoTeller.py on
+# TeleBot, cryptoTellerAsync.py on AsyncTeleBot). Importing this module creates no
+# bot: each entry point creates its own and attaches it to the outbox.
+
+# Load environment variables
+load_dotenv()
+
+# Handlers queue their messages here instead of waiting on Telegram; see TelegramOutbox.
+# The entry point sets outbox.bot before start_bot().
+outbox = TelegramOutbox(None)
+
+# Telegram user IDs allowed to use developer commands such as /metrics (comma-separated)
+DEV_USER_IDS = {int(user_id) for user_id in os.getenv("DEV_USER_IDS", "").split(",") if user_id.strip()}
+
+# Per-chat /crypto cooldowns and last sent messages, bounded in size
+chat_states = ChatStateStore()
+
+# Pre-rendered /crypto pages keyed by snapshot version, oldest first, as (rendered_at, pages)
+PAGE_CALLBACK_PREFIX = "crypto_page:"
+EXPIRED_BUTTONS_NOTICE = "These buttons have expired, please run /crypto again."
+rendered_pages = OrderedDict()
+_rendered_pages_lock = threading.Lock()
+
+# Keeps /crypto prices warm in the background so handlers only render from memory
+ALL_CURRENCIES = [symbol for page in CURRENCY_PAGES for symbol in page]
+price_refresher = PriceRefresher(ALL_CURRENCIES)
+
+# Price alerts, checked against every refreshed snapshot
+alert_engine = AlertEngine(
+    crypto_api.price_history,
+    notify=lambda chat_id, text: outbox.send_message(chat_id, text, parse_mode='Markdown')
+)
+price_refresher.add_listener(alert_engine.on_snapshot)
+
+# Drops superseded inline queries and memoizes answers per data version
+inline_engine = InlineQueryEngine(price_refresher)
+
+def create_help_markup():
+    """Creates the help menu pagination keyboard."""
+    markup = types.InlineKeyboardMarkup()
+    buttons = [
+        types.InlineKeyboardButton(f"{i}️⃣", callback_data=f"help_page_{i}")
+        for i in range(1, 4)
+    ]
+    return markup.row(*buttons)
+
+def send_crypto_message(chat_id, text, markup):
+    """
+    Queues a /crypto message; the chat's previous one is deleted once it is sent.
+
+    A /crypto message still queued for the chat is replaced rather than sent and deleted.
+    """
+    def replace_previous(sent_message):
+        previous_message_id = chat_states.replace_crypto_message(chat_id, sent_message.message_id)
+        if previous_message_id is not None:
+            outbox.delete_message(chat_id, previous_message_id)
+
+    outbox.send_message(chat_id, text, replace_key="crypto", on_sent=replace_previous,
+                        parse_mode='Markdown', disable_web_page_preview=True, reply_markup=markup)
+
+def get_current_page_data(page, data):
+    """Retrieves data for the specified page."""
+    return {k: data.get(k) for k in CURRENCY_PAGES[page] if k in data}
+
+def format_price_message(data):
+    """
+    Formats the cryptocurrency price message, with a sparkline from the local price history.
+
+    Prices that came from the DexScreener fallback are marked with a dagger, and
+    the age of stale ones is noted below the list.
+    """
+    message_lines = []
+    sparkline_since = time.time() - PRICE_SPARKLINE_WINDOW
+    fallback_used = False
+    for symbol, values in data.items():
+        try:
+            price = values["price"]
+            change_24h = values["percent_change_24h"]
+            sparkline = crypto_api.price_history.sparkline(symbol, sparkline_since)
+            marker = "†" if values.get("source") == "dexscreener" else ""
+            fallback_used = fallback_used or bool(marker)
+            message_lines.append(f"• *${symbol}*{marker}:  {price:.6f}_$_ *({change_24h:.2f}%)* {sparkline}".rstrip())
+        except (TypeError, KeyError) as e:
+            # If there's a formatting issue or missing data, skip or provide a fallback
+            message_lines.append(f"• *${symbol}*:  Data not available")
+            print(f"Skipping formatting issue for {symbol}: {e}")
+
+    sources = "*CoinMarketCap* († *DexScreener*)" if fallback_used else "*CoinMarketCap*"
+    # Prices the refresher could not renew carry their age; say how old the oldest is
+    stale_note = stale_price_note(data)
+    message_text = (
+        "Current cryptocurrency prices:\n\n"
+        + "\n".join(message_lines) +
+        f"\n\n  ∟  Prices from: {sources}\n    🤍 Sponsor: None"
+        + (f"\n\n{stale_note}" if stale_note else "")
+    )
+    return message_text
+
+def create_pagination_keyboard(page, version):
+    """
+    Creates a pagination keyboard for navigating between pages.
+
+    Every button carries its target page (0-based, like `page`) and the snapshot
+    version, so a press resolves to a pre-rendered page without parsing the
+    keyboard text. Only the middle button's label counts from 1.
+    """
+    prev_page = max(0, page - 1)
+    next_page = min(len(CURRENCY_PAGES) - 1, page + 1)
+
+    markup = types.InlineKeyboardMarkup()
+    left_button = types.InlineKeyboardButton("⬅️", callback_data=f"{PAGE_CALLBACK_PREFIX}{prev_page}:{version}")
+    page_button = types.InlineKeyboardButton(f"{page + 1}️⃣", callback_data=f"{PAGE_CALLBACK_PREFIX}{page}:{version}")
+    right_button = types.InlineKeyboardButton("➡️", callback_data=f"{PAGE_CALLBACK_PREFIX}{next_page}:{version}")
+    markup.row(left_button, page_button, right_button)
+    return markup
+
+def render_snapshot_pages(snapshot):
+    """
+    Returns (text, markup) for every /crypto page of a snapshot, rendering them once per version.
+
+    Versions are kept for RENDERED_PAGES_TTL seconds, so a press on an old
+    message shows the prices that message was sent with.
+
+    Args:
+        snapshot (PriceSnapshot): The snapshot to render.
+
+    Returns:
+        list: One (message_text, markup) tuple per page in CURRENCY_PAGES.
+    """
+    with _rendered_pages_lock:
+        rendered = rendered_pages.get(snapshot.version)
+        if rendered is not None:
+            return rendered[1]
+
+    pages = [
+        (format_price_message(get_current_page_data(page, snapshot.prices)),
+         create_pagination_keyboard(page, snapshot.version))
+        for page in range(len(CURRENCY_PAGES))
+    ]
+    now = time.monotonic()
+    with _rendered_pages_lock:
+        rendered_pages.setdefault(snapshot.version, (now, pages))
+        while now - next(iter(rendered_pages.values()))[0] > RENDERED_PAGES_TTL:
+            rendered_pages.popitem(last=False)
+        return rendered_pages[snapshot.version][1]
+
+def rendered_snapshot_pages(version):
+    """Returns the pages rendered for a snapshot version, or None if it was never rendered or has expired."""
+    with _rendered_pages_lock:
+        rendered = rendered_pages.get(version)
+    return rendered[1] if rendered is not None else None
+
+def parse_page_callback(callback_data):
+    """
+    Parses pagination callback data.
+
+    Returns:
+        tuple: (page, version), or None if the data is not a pagination callback.
+    """
+    if not callback_data or not callback_data.startswith(PAGE_CALLBACK_PREFIX):
+        return None
+    page, _, version = callback_data[len(PAGE_CALLBACK_PREFIX):].partition(":")
+    try:
+        page, version = int(page), int(version)
+    except ValueError:
+        return None
+    if not 0 <= page < len(CURRENCY_PAGES):
+        return None
+    return page, version
+
+def resolve_pagination(call):
+    """
+    Resolves a pagination press to the page it should show.
+
+    Pages come from the snapshot version the message was rendered with; if that
+    version has expired (see render_snapshot_pages), the latest snapshot is used instead.
+
+    Returns:
+        tuple: (page, message_text, markup, unchanged) where unchanged is True if
+        the message already shows exactly this text, or None for invalid data.
+    """
+    target = parse_page_callback(call.data)
+    if target is None:
+        return None
+    page, version = target
+
+    pages = rendered_snapshot_pages(version)
+    if pages is None:
+        pages = render_snapshot_pages(price_refresher.snapshot())
+    message_text, markup = pages[page]
+
+    # The middle button of the current keyboard records what the message shows now
+    unchanged = False
+    current = parse_page_callback(call.message.reply_markup.keyboard[0][1].callback_data)
+    if current is not None and current[0] == page:
+        shown_pages = rendered_snapshot_pages(current[1])
+        unchanged = shown_pages is not None and shown_pages[page][0] == message_text
+    return page, message_text, markup, unchanged
+
+def format_api_key_status():
+    """Formats the live state of the CoinMarketCap key pool for /api."""
+    key_names = ["ALPHA", "BRAVO", "CHARLIE", "DELTA", "ECHO", "FOXTROT", "GOLF"]
+
+    def key_name(index):
+        return key_names[index] if index < len(key_names) else f"KEY {index + 1}"
+
+    current_index = cmc_key_pool.last_used_index
+    lines = [f"*Current API Key:* {key_name(current_index)} (#{current_index + 1})", ""]
+    for key in cmc_key_pool.status():
+        if key["cooldown_remaining"]:
+            state = f"cooling down {key['cooldown_remaining']:.0f}s ({key['cooldown_reason']})"
+        else:
+            state = f"ready, {key['tokens']:.0f} calls available"
+        lines.append(f"• {key_name(key['index'])}: {state} | {key['credits_today']} credits today")
+    return "\n".join(lines)
+
+def subscribe_alert(chat_id, text):
+    """
+    Handles the arguments of /alert for a chat.
+
+    Returns:
+        str: The reply, confirming the alert or explaining why it was refused.
+    """
+    parsed = parse_alert_command(text)
+    if parsed is None:
+        return "Usage: `/alert TON > 7`, `/alert TON below 5` or `/alert BTC 5% 1h`"
+    symbol, kind, value, window = parsed
+    if symbol not in price_refresher.symbols:
+        return f"Alerts are available for: {', '.join(price_refresher.symbols)}"
+
+    try:
+        alert = alert_engine.subscribe(chat_id, symbol, kind, value, window)
+    except ValueError as e:
+        return str(e)
+    return f"🔔 Alert #{alert.id} set: {format_alert(alert)}. Remove it with `/unalert {alert.id}`."
+
+def format_chat_alerts(chat_id):
+    """Lists the chat's alerts for /alerts."""
+    alerts = alert_engine.chat_alerts(chat_id)
+    if not alerts:
+        return "No alerts set. Add one with `/alert TON > 7`."
+    return "🔔 *Alerts*\n\n" + "\n".join(f"• #{alert.id} {format_alert(alert)}" for alert in alerts)
+
+def unsubscribe_alert(chat_id, text):
+    """Handles the arguments of /unalert for a chat and returns the reply."""
+    alert_id = text.strip().lstrip("#")
+    if not alert_id.isdigit():
+        return "Usage: `/unalert <id>`; see `/alerts` for the ids."
+    if not alert_engine.unsubscribe(chat_id, int(alert_id)):
+        return f"No alert #{alert_id} in this chat."
+    return f"Alert #{alert_id} removed."
+
+def command_arguments(message):
+    """Returns the text after the command, e.g. "TON > 7" for "/alert TON > 7"."""
+    parts = message.text.split(maxsplit=1)
+    return parts[1] if len(parts) > 1 else ""
+
+def env_port(name, default):
+    """
+    Reads a TCP port from .env, so several bot processes on one host can each get their own.
+
+    Returns:
+        int: The port, `default` if the variable is unset, or None if it is "off".
+    """
+    value = os.getenv(name, "").strip()
+    if not value:
+        return default
+    if value.lower() in ("off", "none"):
+        return None
+    return int(value)
+
+def start_metrics_server():
+    """
+    Starts the local Prometheus endpoint on METRICS_PORT (overridable in .env) unless it is disabled.
+
+    If the port is taken, e.g. by another bot process on the host, the bot runs
+    without the endpoint instead of failing to start.
+    """
+    port = env_port("METRICS_PORT", METRICS_PORT)
+    if port is None:
+        return None
+    try:
+        server = metrics.start_http_server(port, METRICS_HOST)
+    except OSError as e:
+        print(f"Could not serve metrics on {METRICS_HOST}:{port} ({e}); set a free METRICS_PORT in .env.")
+        return None
+    print(f"Serving metrics on http://{METRICS_HOST}:{port}/metrics")
+    return server
+
+def load_persistent_cache(path=PERSISTENT_CACHE_PATH):
+    """
+    Warm-starts the caches from disk and enables write-through for later updates.
+
+    Returns:
+        PersistentCache: The started store; close() it on shutdown to flush pending writes.
+    """
+    store = PersistentCache(path)
+    crypto_api.enable_persistence(store)
+    price_refresher.restore(dict(crypto_api.crypto_price_cache.items()))
+    store.start()
+    return store
+
+def load_shared_state():
+    """
+    Shares caches and API key buckets with other bot processes if SHARED_STATE_PATH is set in .env.
+
+    Returns:
+        SharedState: The enabled store, or None when running standalone.
+    """
+    path = os.getenv("SHARED_STATE_PATH")
+    if not path:
+        return None
+    state = SharedState(path)
+    crypto_api.enable_shared_state(state)
+    print(f"Sharing caches and API key state through {path}")
+    return state
+
+def start_alerts():
+    """
+    Loads the stored price alerts and starts sending notifications.
+
+    Call after load_persistent_cache() so the restored prices become the baseline
+    the first refresh is compared against.
+    """
+    count = alert_engine.load()
+    alert_engine.on_snapshot(price_refresher.snapshot())
+    alert_engine.start()
+    print(f"Loaded {count} price alerts")
+
+def warm_up_tasks():
+    """
+    Returns the cache warm-up run in parallel at startup.
+
+    Prices and token info restored from disk are only refetched if they are
+    missing or expired, so a quick restart costs few upstream calls.
+    """
+    def warm_prices():
+        due = [symbol for symbol in ALL_CURRENCIES if crypto_api.cached_price_state(symbol) in (None, crypto_api.CACHE_EXPIRED)]
+        if due:
+            price_refresher.refresh_now(due)
+
+    return {
+        "crypto_prices": warm_prices,
+        "fx_table": get_fx_table,
+        "ton_tokens": lambda: crypto_api.get_ton_tokens_info(crypto_api.recent_token_addresses(STARTUP_WARM_TOKENS)),
+    }
+
+def start_bot():
+    """
+    Runs the startup pipeline; start consuming updates once it returns.
+
+    Returns:
+        PersistentCache: The started store; close() it on shutdown to flush pending writes.
+    """
+    startup = StartupPipeline()
+    with startup.phase("persistent_cache"):
+        persistent_store = load_persistent_cache()
+    with startup.phase("shared_state"):
+        load_shared_state()
+    with startup.phase("alerts"):
+        start_alerts()
+    outbox.start()
+    bounded_cache.start_expiry_sweeps()
+    start_metrics_server()
+    startup.warm_up(warm_up_tasks())
+    price_refresher.start()
+    startup.mark_ready()
+    return persistent_store
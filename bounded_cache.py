@@ -0,0 +1,182 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import metrics
+from constants import CACHE_SWEEP_INTERVAL
+
+ENTRY_OVERHEAD = 200  # Approximate bytes per entry for the OrderedDict node and the entry tuple
+
+_caches = []  # Every BoundedCache, for the expiry sweeps and the size gauges
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def utc_now():
+    """The default clock of BoundedCache: the current time as an aware UTC datetime."""
+    return datetime.now(timezone.utc)
+
+def estimate_size(value, depth=3):
+    """Approximates the bytes held by a value, following dicts, lists and tuples `depth` levels down."""
+    size = sys.getsizeof(value)
+    if depth > 0:
+        if isinstance(value, dict):
+            size += sum(estimate_size(key, depth - 1) + estimate_size(item, depth - 1) for key, item in value.items())
+        elif isinstance(value, (list, tuple)):
+            size += sum(estimate_size(item, depth - 1) for item in value)
+    return size
+
+
+class BoundedCache:
+    """
+    A thread-safe cache of (value, stored_at) entries for one class of data, bounded in memory.
+
+    `ttl` is how long an entry is fresh; readers classify entries by age themselves
+    (see crypto_api.cache_state), so one cache can serve them fresh, stale or as a
+    fallback. Entries older than `retention` are of no use at all: get() drops
+    them and the expiry sweeps (start_expiry_sweeps) remove the ones nobody asks
+    for again. Entries are kept in least-recently-used order and the least
+    recently used are evicted to stay within `max_entries` and `max_bytes`; sizes
+    are estimated once, when an entry is stored. `clock` returns the current time
+    as an aware UTC datetime (tests pass their own).
+    """
+
+    def __init__(self, name, ttl, retention=None, max_entries=None, max_bytes=None, clock=utc_now):
+        self.name = name
+        self.ttl = ttl
+        self.retention = retention if retention is not None else ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+
+        self._entries = OrderedDict()  # key -> (value, stored_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        _caches.append(self)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """
+        Looks up an entry and marks it recently used.
+
+        Returns:
+            tuple: (value, stored_at), or None if absent or past retention.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[1] >= self.retention:
+                self._remove(key, "expired")
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def peek(self, key):
+        """Like get(), but leaves the LRU order, the counts and expired entries (for the sweeps) alone."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or self.clock() - entry[1] >= self.retention:
+            return None
+        return entry[0], entry[1]
+
+    def put(self, key, value, stored_at):
+        """Stores an entry as the most recently used, evicting least recently used ones beyond the budgets."""
+        size = estimate_size(key) + estimate_size(value) + ENTRY_OVERHEAD
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[key] = (value, stored_at, size)
+            self._bytes += size
+
+            evicted = 0
+            while len(self._entries) > 1 and (
+                    (self.max_entries is not None and len(self._entries) > self.max_entries)
+                    or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, (_, _, oldest_size) = self._entries.popitem(last=False)
+                self._bytes -= oldest_size
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            metrics.CACHE_EVICTIONS.inc(self.name, "lru", amount=evicted)
+
+    def items(self):
+        """Returns a snapshot of (key, (value, stored_at)) pairs, least recently used first."""
+        with self._lock:
+            return [(key, (value, stored_at)) for key, (value, stored_at, _) in self._entries.items()]
+
+    def sweep(self):
+        """Removes the entries past retention; returns how many."""
+        cutoff = self.clock() - self.retention
+        with self._lock:
+            expired = [key for key, (_, stored_at, _) in self._entries.items() if stored_at <= cutoff]
+            for key in expired:
+                self._remove(key, "expired")
+        return len(expired)
+
+    def size_bytes(self):
+        """Returns the estimated bytes held by the entries."""
+        with self._lock:
+            return self._bytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Returns the entry count, estimated bytes, and hit, miss, eviction and expiration counts."""
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expirations": self.expirations}
+
+    def _remove(self, key, reason):
+        """Drops an entry and counts it (lock held)."""
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        self.expirations += 1
+        metrics.CACHE_EVICTIONS.inc(self.name, reason)
+
+
+def cache_stats():
+    """Returns stats() of every cache, keyed by name."""
+    return {cache.name: cache.stats() for cache in _caches}
+
+def sweep_all():
+    """Sweeps every cache; returns the number of entries removed."""
+    return sum(cache.sweep() for cache in _caches)
+
+def start_expiry_sweeps(interval=CACHE_SWEEP_INTERVAL):
+    """Sweeps every cache each `interval` seconds on a daemon thread (idempotent)."""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is not None and _sweeper.is_alive():
+            return
+        _sweeper = threading.Thread(target=_run_sweeps, args=(interval,), name="cache-sweeper", daemon=True)
+        _sweeper.start()
+
+def _run_sweeps(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            sweep_all()
+        except Exception as e:
+            print(f"Error sweeping caches: {e}")
+
+
+metrics.CACHE_ENTRIES.set_function(lambda: {(cache.name,): len(cache) for cache in _caches})
+metrics.CACHE_BYTES.set_function(lambda: {(cache.name,): cache.size_bytes() for cache in _caches})
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+from constants import CHAT_STATE_MAX_CHATS, CHAT_STATE_IDLE_TTL, TON_ADDRESS_DEDUP_WINDOW, TON_ADDRESS_DEDUP_PER_CHAT
+
+
+class ChatRecord:
+    """What the bot remembers about one chat; __slots__ keeps it at a few dozen bytes."""
+
+    __slots__ = ("crypto_used_at", "crypto_message_id", "ton_addresses", "touched_at")
+
+    def __init__(self, now):
+        self.crypto_used_at = None
+        self.crypto_message_id = None
+        self.ton_addresses = None  # {address: claimed_at} in claim order, created on the first claim
+        self.touched_at = now
+
+
+class ChatStateStore:
+    """
+    Per-chat state with LRU and idle-TTL eviction, bounded to `max_chats` records.
+
+    Records are kept in least-recently-used order, so eviction only ever looks at
+    the front: chats idle for longer than `idle_ttl` are dropped as others are
+    touched, and the least recently used chat goes once the store is full. Losing
+    a record only forgets a cooldown, which /crypto message to replace or the TON
+    addresses recently looked up. Price data is never stored per chat; messages reference
+    pre-rendered snapshot pages by version. `clock` returns unix time.
+    """
+
+    def __init__(self, max_chats=CHAT_STATE_MAX_CHATS, idle_ttl=CHAT_STATE_IDLE_TTL, clock=time.time):
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def _touch(self, chat_id, now):
+        """Returns the chat's record, creating it and evicting idle or excess records (lock held)."""
+        record = self._records.get(chat_id)
+        if record is None or now - record.touched_at >= self.idle_ttl:
+            record = self._records[chat_id] = ChatRecord(now)
+        record.touched_at = now
+        self._records.move_to_end(chat_id)
+
+        while self._records:
+            oldest_id, oldest = next(iter(self._records.items()))
+            if len(self._records) <= self.max_chats and now - oldest.touched_at < self.idle_ttl:
+                break
+            del self._records[oldest_id]
+        return record
+
+    def start_crypto(self, chat_id, cooldown):
+        """
+        Starts a /crypto command in the chat unless it is on cooldown.
+
+        Returns:
+            float: 0 if the command may run (the cooldown starts now), otherwise the
+            seconds left on the cooldown.
+        """
+        now = self.clock()
+        with self._lock:
+            record = self._touch(chat_id, now)
+            if record.crypto_used_at is not None and now - record.crypto_used_at < cooldown:
+                return cooldown - (now - record.crypto_used_at)
+            record.crypto_used_at = now
+            return 0
+
+    def cancel_crypto(self, chat_id):
+        """Lifts the cooldown started by start_crypto, e.g. when there were no prices to show."""
+        with self._lock:
+            record = self._records.get(chat_id)
+            if record is not None:
+                record.crypto_used_at = None
+
+    def replace_crypto_message(self, chat_id, message_id):
+        """
+        Records the chat's newest /crypto message.
+
+        Returns:
+            int: The id of the previous /crypto message to delete, or None.
+        """
+        with self._lock:
+            record = self._touch(chat_id, self.clock())
+            previous_id, record.crypto_message_id = record.crypto_message_id, message_id
+            return previous_id
+
+    def claim_ton_address(self, chat_id, address, window=TON_ADDRESS_DEDUP_WINDOW,
+                          max_addresses=TON_ADDRESS_DEDUP_PER_CHAT):
+        """
+        Claims the lookup of a TON address posted in the chat.
+
+        Every address claimed within the last `window` seconds is remembered (up to
+        `max_addresses` per chat), so alternating between addresses does not get
+        each of them looked up again.
+
+        Returns:
+            bool: False if the same address was already looked up in the chat within
+            the last `window` seconds, so the repeat should be ignored.
+        """
+        now = self.clock()
+        with self._lock:
+            record = self._touch(chat_id, now)
+            claims = record.ton_addresses
+            if claims is None:
+                claims = record.ton_addresses = {}
+            # Claims are in time order, so expired ones are at the front
+            while claims:
+                oldest, claimed_at = next(iter(claims.items()))
+                if now - claimed_at < window:
+                    break
+                del claims[oldest]
+            if address in claims:
+                return False
+            claims[address] = now
+            if len(claims) > max_addresses:
+                del claims[next(iter(claims))]
+            return True
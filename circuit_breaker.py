@@ -0,0 +1,84 @@
+import threading
+import time
+
+import metrics
+from constants import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+
+CIRCUIT_CLOSED = "closed"        # Requests flow normally
+CIRCUIT_OPEN = "open"            # The upstream is failing: requests are refused without being sent
+CIRCUIT_HALF_OPEN = "half_open"  # One probe request is let through to test recovery
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing, and probes it until it recovers.
+
+    After `failure_threshold` consecutive failures (transport errors and 5xx
+    responses; key rejections are the key pool's business) the circuit opens and
+    allow() refuses every request, so callers fail fast or fall back instead of
+    queueing on timeouts and retries. Every `reset_timeout` seconds one caller is
+    let through as a probe: a success closes the circuit, a failure keeps it open
+    for another `reset_timeout`. `clock` is the monotonic time source (tests pass
+    their own).
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0  # Monotonic time the circuit opened or the last probe started
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        """
+        Returns True if a request may be sent now.
+
+        When the reset timeout has passed on an open circuit, the caller that gets
+        True is the probe; everyone else keeps being refused until it reports back
+        or another reset_timeout passes.
+        """
+        with self._lock:
+            if self._state == CIRCUIT_CLOSED:
+                return True
+            now = self.clock()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            self._opened_at = now
+            self._transition(CIRCUIT_HALF_OPEN)
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state != CIRCUIT_CLOSED:
+                self._transition(CIRCUIT_CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == CIRCUIT_HALF_OPEN or (self._state == CIRCUIT_CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = self.clock()
+                self._transition(CIRCUIT_OPEN)
+
+    def retry_in(self):
+        """Returns the seconds until the next probe is allowed (0 if requests flow now)."""
+        with self._lock:
+            if self._state == CIRCUIT_CLOSED:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - self.clock())
+
+    def _transition(self, state):
+        """Changes the state and records it (lock held)."""
+        if state != self._state:
+            self._state = state
+            metrics.CIRCUIT_TRANSITIONS.inc(self.name, state)
+            print(f"{self.name} circuit {state.replace('_', '-')}.")
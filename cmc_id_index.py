@@ -0,0 +1,88 @@
+import threading
+import time
+
+from constants import CMC_ID_INDEX_REFRESH_INTERVAL, CMC_ID_INDEX_RETRY_INTERVAL, CMC_ID_OVERRIDES
+
+
+class CmcIdIndex:
+    """
+    Resolves ticker symbols to CoinMarketCap IDs.
+
+    Tickers are not unique on CMC (dozens of tokens call themselves "NOT" or
+    "GRAM"), so quotes requested by symbol can silently pick the wrong asset.
+    The index is built from /cryptocurrency/map, keeping the best-ranked active
+    asset for each symbol; CMC_ID_OVERRIDES pins symbols where that guess is
+    wrong. It is small (one int per symbol), persisted with the other caches and
+    only rebuilt every CMC_ID_INDEX_REFRESH_INTERVAL seconds. `clock` returns unix time.
+    """
+
+    def __init__(self, overrides=CMC_ID_OVERRIDES, refresh_interval=CMC_ID_INDEX_REFRESH_INTERVAL,
+                 retry_interval=CMC_ID_INDEX_RETRY_INTERVAL, clock=time.time):
+        self.overrides = dict(overrides)
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.built_at = None  # Unix timestamp of the /map response, None until loaded
+        self.attempted_at = None  # When a rebuild was last started
+
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def needs_refresh(self):
+        """
+        Returns True if the index was never built or is older than refresh_interval,
+        and no rebuild was started within the last retry_interval seconds.
+        """
+        now = self.clock()
+        if self.attempted_at is not None and now - self.attempted_at < self.retry_interval:
+            return False
+        return self.built_at is None or now - self.built_at >= self.refresh_interval
+
+    def resolve(self, symbols):
+        """
+        Splits symbols into those with a known ID and those without.
+
+        Returns:
+            tuple: ({symbol: cmc_id}, [unresolved symbols]), both in request order.
+        """
+        ids, unresolved = {}, []
+        with self._lock:
+            for symbol in symbols:
+                cmc_id = self.overrides.get(symbol) or self._ids.get(symbol)
+                if cmc_id is None:
+                    unresolved.append(symbol)
+                else:
+                    ids[symbol] = cmc_id
+        return ids, unresolved
+
+    def build(self, map_entries, built_at):
+        """
+        Rebuilds the index from /cryptocurrency/map entries.
+
+        Args:
+            map_entries (list): The "data" list of the /map response.
+            built_at (float): Unix timestamp of the response.
+
+        Returns:
+            dict: The new symbol -> ID mapping (e.g. to persist it).
+        """
+        best = {}
+        for entry in map_entries:
+            symbol, cmc_id = entry.get("symbol"), entry.get("id")
+            if not symbol or cmc_id is None or entry.get("is_active", 1) != 1:
+                continue
+            rank = entry.get("rank") or float("inf")
+            if symbol not in best or rank < best[symbol][0]:
+                best[symbol] = (rank, cmc_id)
+        ids = {symbol: cmc_id for symbol, (_, cmc_id) in best.items()}
+        self.load(ids, built_at)
+        return ids
+
+    def load(self, ids, built_at):
+        """Replaces the index with a stored symbol -> ID mapping."""
+        with self._lock:
+            self._ids = dict(ids)
+            self.built_at = built_at
@@ -12,6 +12,13 @@ EXCHANGE_RATE_API_KEYS = [
     # Add more keys as needed
 ]
 
+# API key pool scheduling (see key_pool.py)
+CMC_KEY_CALLS_PER_MINUTE = 30            # Per-key request rate (CMC Basic plan limit)
+EXCHANGE_RATE_KEY_CALLS_PER_MINUTE = 60  # Per-key request rate for ExchangeRate-API
+API_KEY_RATE_LIMIT_COOLDOWN = 60         # Seconds a key rests after a 429 without Retry-After
+API_KEY_REJECTED_COOLDOWN = 3600         # Seconds a key rests after being rejected as invalid/unpaid
+API_KEY_MAX_QUEUE_WAIT = 2               # Async callers wait at most this long for a free key (seconds)
+
 # Sponsors and donators (replace with your own sponsors/donators)
 SPONSORS_AND_DONATORS = (
     "[Sponsor Name](https://example.com)",  # Example sponsor
@@ -34,12 +41,133 @@ SUPPORTED_CURRENCIES = [
 # Cryptocurrency symbols
 CRYPTO_SYMBOLS = ["TON", "BTC", "ETH", "DOGE", "DOGS", "NOT", "SOL", "STON", "GRAM", "SUI"]
 
+# Fiat currencies, served from a single cross-rate matrix
+FIAT_CURRENCIES = [currency for currency in SUPPORTED_CURRENCIES if currency not in CRYPTO_SYMBOLS]
+
+# Set views of the lists above for O(1) membership checks on hot paths
+SUPPORTED_CURRENCY_SET = frozenset(SUPPORTED_CURRENCIES)
+CRYPTO_SYMBOL_SET = frozenset(CRYPTO_SYMBOLS)
+FIAT_CURRENCY_SET = frozenset(FIAT_CURRENCIES)
+
 # Regex for TON contract addresses (adjust as needed)
 # Matches Base64url (EQ/UQ prefix) and the 48-char format
 TON_ADDRESS_REGEX = r"\b(?:(?:EQ|UQ)[A-Za-z0-9_\-]{46}|[A-Za-z0-9]{48})\b"
+TON_ADDRESS_DEDUP_WINDOW = 30  # Repeats of the same address in a chat within this are ignored (seconds)
+TON_ADDRESS_DEDUP_PER_CHAT = 16  # Addresses remembered per chat for that; the oldest claim is forgotten beyond this
 
-# DexScreener API endpoint
+# CoinMarketCap and ExchangeRate-API endpoints
+CMC_QUOTES_URL = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest"
+CMC_MAP_URL = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/map"
+EXCHANGE_RATE_PAIR_URL = "https://v6.exchangerate-api.com/v6/{api_key}/pair/{from_currency}/{to_currency}"
+EXCHANGE_RATE_LATEST_URL = "https://v6.exchangerate-api.com/v6/{api_key}/latest/{base_currency}"
+
+# DexScreener API endpoints
 DEXSCREENER_API_URL = "https://api.dexscreener.com/latest/dex/search?q={address}"
+DEXSCREENER_TOKENS_API_URL = "https://api.dexscreener.com/latest/dex/tokens/{addresses}"
+DEXSCREENER_TOKENS_BATCH_SIZE = 30  # Max addresses per multi-token request
+
+# Tokens priced from DexScreener while CoinMarketCap cannot price them (e.g. its circuit is open)
+DEXSCREENER_FALLBACK_TOKENS = {
+    "NOT": "EQAvlWFDxGF2lXm67y4yzC17wYKD9A0guwPkMs1gOsM__NOT",
+    "DOGS": "EQCvxJy4eG8hyHBFsZ7eePxrRsUQSFE_jpptRAYBmcG_DOGS",
+    "STON": "EQA2kCVNwVsil2EM2mB0SkXytxCqQjS4mttjDpnXmwG9T6bO",
+    # Add more TON tokens as needed
+}
+
+# Upstream circuit breakers (see circuit_breaker.py) and hedged CoinMarketCap requests
+CIRCUIT_FAILURE_THRESHOLD = 5      # Consecutive failures (transport errors, 5xx) that open a circuit
+CIRCUIT_RESET_TIMEOUT = 30         # Seconds an open circuit refuses requests before letting a probe through
+CMC_HEDGE_DELAY = None             # Send a second quotes request on another key after this many seconds (None: off)
+
+# Shared HTTP client for all upstreams (see http_client.py)
+HTTP_CONNECT_TIMEOUT = 3.05        # Seconds to establish a connection
+HTTP_READ_TIMEOUT = 10             # Seconds to wait for response data
+HTTP_POOL_MAXSIZE = 10             # Keep-alive connections kept per upstream host
+HTTP_MAX_RETRIES = 2               # Retries for connection errors and 5xx (by the HTTP client for DexScreener, by the CMC and ExchangeRate-API loops otherwise)
+HTTP_RETRY_BACKOFF = 0.5           # Backoff before the first retry, doubled for each further one (seconds)
+
+# Background price refresh (see price_refresher.py)
+PRICE_REFRESH_MIN_INTERVAL = 60    # Most requested symbols are refreshed this often (seconds)
+PRICE_REFRESH_MAX_INTERVAL = 900   # Idle symbols are still refreshed at least this often (seconds)
+PRICE_REFRESH_TICK = 5             # How often the refresher checks for due symbols (seconds)
+PRICE_DEMAND_HALF_LIFE = 600       # Requests lose half their weight after this long (seconds)
+CMC_CREDIT_BUDGET_PER_HOUR = 60    # Max CMC credits the refresher may spend per hour
+CMC_SYMBOLS_PER_CREDIT = 100       # quotes/latest costs 1 credit per 100 symbols returned
+FX_TABLE_REFRESH_AHEAD = 300       # Renew the FX table this long before it expires (seconds)
+
+# In-process price history (see price_history.py); costs 24 bytes per sample per symbol
+PRICE_HISTORY_CAPACITY = 1440      # Samples kept per symbol (a day at one-minute refreshes)
+PRICE_HISTORY_MIN_SPACING = 30     # Quotes closer together than this replace the previous sample (seconds)
+PRICE_SPARKLINE_WIDTH = 10         # Bars per sparkline on /crypto pages
+PRICE_SPARKLINE_WINDOW = 86400     # Period the /crypto sparklines cover (seconds)
+
+# Price alerts (see alerts.py); notifications are paced by the Telegram outbox
+ALERTS_DB_PATH = "cryptoteller_alerts.sqlite3"
+ALERTS_PER_CHAT = 20               # Max active alerts per chat
+ALERT_MAX_MOVE_WINDOW = 86400      # Longest window for percent-move alerts (the price history covers a day)
+
+# Symbol -> CoinMarketCap ID index (see cmc_id_index.py); quotes are requested by ID
+CMC_QUOTES_CHUNK_SIZE = 100        # Assets per quotes request; chunks run in parallel across keys
+CMC_MAP_LIMIT = 5000               # Top assets by rank read from /cryptocurrency/map (1 credit)
+CMC_ID_INDEX_REFRESH_INTERVAL = 7 * 86400  # Rebuild the index this often (seconds)
+CMC_ID_INDEX_RETRY_INTERVAL = 600  # Wait this long before retrying a failed rebuild (seconds)
+CMC_ID_OVERRIDES = {}              # Pin symbols the best-ranked guess gets wrong, e.g. {"TON": 11419}
+
+# Inline query answers (see inline_engine.py)
+INLINE_MEMO_SIZE = 2048            # Memoized answers kept across data versions
+
+# Per-chat state (see chat_state.py); each remembered chat costs roughly 300 bytes, plus about
+# 150 per TON address it remembers (at most TON_ADDRESS_DEDUP_PER_CHAT, for TON_ADDRESS_DEDUP_WINDOW)
+CHAT_STATE_MAX_CHATS = 100_000     # Least recently used chats are forgotten beyond this
+CHAT_STATE_IDLE_TTL = 2 * 86400    # Chats idle for longer than this are forgotten (seconds)
+# Pages rendered for a snapshot version answer presses on /crypto messages sent with it this
+# long (seconds); only versions that were sent are rendered, at roughly 4 KB each
+RENDERED_PAGES_TTL = CHAT_STATE_IDLE_TTL
+
+# Price, exchange rate and token caches (see bounded_cache.py); least recently used
+# entries are evicted beyond either budget, sizes are estimates
+CACHE_SWEEP_INTERVAL = 60          # Seconds between sweeps removing entries past their retention
+CRYPTO_PRICE_CACHE_MAX_ENTRIES = 5000
+CRYPTO_PRICE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+EXCHANGE_RATE_CACHE_MAX_ENTRIES = 10_000
+EXCHANGE_RATE_CACHE_MAX_BYTES = 2 * 1024 * 1024
+TON_TOKEN_CACHE_MAX_ENTRIES = 20_000
+TON_TOKEN_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Outgoing Telegram messages (see telegram_outbox.py), within the Bot API flood limits
+TELEGRAM_SEND_WORKERS = 4          # Calls in flight at once (one per chat at most)
+TELEGRAM_GLOBAL_RATE = 30          # Calls per second across all chats
+TELEGRAM_CHAT_RATE = 1             # Calls per second to one private chat
+TELEGRAM_GROUP_RATE = 20 / 60      # Calls per second to one group or channel
+TELEGRAM_CHAT_BURST = 3            # Calls a chat can get back to back before its rate applies
+TELEGRAM_SEND_MAX_RETRIES = 3      # Retries of a call answered with 429
+TELEGRAM_MAX_RETRY_AFTER = 60      # Cap on the retry_after honoured per retry (seconds)
+
+# Startup (see startup.py): caches are warmed in parallel before updates are consumed
+STARTUP_WARM_DEADLINE = 10         # Start consuming updates after this long even if the warm-up is not done (seconds)
+STARTUP_WARM_TOKENS = 50           # Most recently looked-up TON tokens refreshed during the warm-up
+
+# Metrics endpoint (see metrics.py); set METRICS_PORT to None, or METRICS_PORT=off in .env, to disable it
+METRICS_HOST = "127.0.0.1"        # Only reachable from this host by default
+METRICS_PORT = 9464               # Default; METRICS_PORT in .env overrides it per process
+
+# Webhook mode (see webhook_server.py); the public URL and secret come from .env
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8443               # Default; WEBHOOK_PORT in .env overrides it per process
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_WORKERS = 8                # Threads running handlers
+WEBHOOK_QUEUE_SIZE = 1000          # Updates waiting for a worker before the server answers 503
+
+# Warm-start cache persisted across restarts (see persistent_cache.py)
+PERSISTENT_CACHE_PATH = "cryptoteller_cache.sqlite3"
+PERSISTENT_CACHE_FLUSH_INTERVAL = 2  # Seconds between batched writes to disk
+
+# Caches and API key buckets shared by bot processes on one host (see shared_state.py);
+# enabled by setting SHARED_STATE_PATH in .env, e.g. when running several webhook workers
+SHARED_STATE_LEASE_TTL = 15        # Seconds a process may hold a fetch lease before others take over
+SHARED_STATE_FETCH_WAIT = 10       # Max seconds to wait for another process's fetch before fetching here
+SHARED_STATE_POLL_INTERVAL = 0.05  # Seconds between checks for another process's fetch
+SHARED_STATE_REUSE_WINDOW = 30     # Forced refreshes reuse entries another process fetched this recently
 
 # Cooldown times for commands (in seconds)
 COOLDOWN_TIME_CRYPTO = 10  # Cooldown for /crypto command
@@ -52,6 +180,7 @@ HELP_PAGES = {
 • **/start** - Starts a conversation with me
 • **/crypto** - Shows cryptocurrency prices with real-time updates
 • **/help** - Displays this help message
+• **/alert** - Price alerts, e.g. `/alert TON > 7` or `/alert BTC 5% 1h`
 • **/api** - **[DEV ONLY]** Shows currently used API key
 • **/devblog** - Get link to our development channel
 
@@ -67,12 +196,13 @@ HELP_PAGES = {
 **💱 Inline Currency Conversion**
 
 Use me in any chat by typing:
-`@crypteller_bot [amount] CUR1 [to] CUR2`
+`@crypteller_bot [amount] CUR1 [[to] CUR2]`
 
 *Examples:*
 • `@crypteller_bot 100 USD BTC`
 • `@crypteller_bot BTC EUR`
 • `@crypteller_bot 50 EUR USD`
+• `@crypteller_bot 100 TON` - TON in every supported currency
 
 Supports both crypto and fiat currencies!
 
@@ -101,6 +231,7 @@ HELP_PAGES = {
 • **/start** - Starts a conversation with me
 • **/crypto** - Shows cryptocurrency prices with real-time updates
 • **/help** - Displays this help message
+• **/alert** - Price alerts, e.g. `/alert TON > 7` or `/alert BTC 5% 1h`
 • **/api** - **[DEV ONLY]** Shows currently used API key
 • **/devblog** - Get link to our development channel
 
@@ -116,12 +247,13 @@ HELP_PAGES = {
 **💱 Inline Currency Conversion**
 
 Use me in any chat by typing:
-`@crypteller_bot [amount] CUR1 [to] CUR2`
+`@crypteller_bot [amount] CUR1 [[to] CUR2]`
 
 *Examples:*
 • `@crypteller_bot 100 USD BTC`
 • `@crypteller_bot BTC EUR`
 • `@crypteller_bot 50 EUR USD`
+• `@crypteller_bot 100 TON` - TON in every supported currency
 
 Supports both crypto and fiat currencies!
 
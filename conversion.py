@@ -0,0 +1,193 @@
+import re
+import numpy as np
+from constants import CRYPTO_SYMBOL_SET
+
+# Regex to parse input: optional amount, currency1, then optionally 'to' and currency2
+CONVERSION_QUERY_REGEX = re.compile(r"^(?:(\d*\.?\d+)\s)?([A-Z]{3,5})(?:\s(?:TO\s)?([A-Z]{3,5}))?$")
+
+def parse_conversion_query(query_text):
+    """
+    Parses an inline query like "100 USD to BTC", "BTC EUR" or "100 TON".
+
+    Args:
+        query_text (str): The raw inline query text.
+
+    Returns:
+        tuple: (amount, from_currency, to_currency), or None if the query does not match.
+        to_currency is None when the query names no target.
+    """
+    match = CONVERSION_QUERY_REGEX.match(query_text.strip().upper())
+    if not match:
+        return None
+    amount_str, from_currency, to_currency = match.groups()
+    amount = float(amount_str) if amount_str else 1.0
+    return amount, from_currency, to_currency
+
+def required_lookups(from_currency, to_currency):
+    """
+    Lists the upstream lookups a conversion needs, so callers can fetch them together.
+
+    Fiat legs are always bridged through USD, since crypto prices are quoted in USD.
+
+    Returns:
+        tuple: (crypto symbols to price, list of (from, to) fiat rate pairs).
+    """
+    is_from_crypto = from_currency in CRYPTO_SYMBOL_SET
+    is_to_crypto = to_currency in CRYPTO_SYMBOL_SET
+    symbols = [c for c in (from_currency, to_currency) if c in CRYPTO_SYMBOL_SET]
+    rate_pairs = []
+
+    if not is_from_crypto and not is_to_crypto:
+        rate_pairs.append((from_currency, to_currency))
+    elif is_from_crypto and not is_to_crypto and to_currency != "USD":
+        rate_pairs.append(("USD", to_currency))
+    elif not is_from_crypto and is_to_crypto and from_currency != "USD":
+        rate_pairs.append((from_currency, "USD"))
+
+    return symbols, rate_pairs
+
+def convert(amount, from_currency, to_currency, prices, rates):
+    """
+    Converts an amount between any two supported currencies using pre-fetched data.
+
+    Args:
+        amount (float): The amount to convert.
+        from_currency (str): The source currency code.
+        to_currency (str): The target currency code.
+        prices (dict): CoinMarketCap price data keyed by symbol, as from get_crypto_prices.
+        rates (dict): Fiat conversion rates keyed by (from, to), None where unavailable.
+
+    Returns:
+        tuple: (result_text, error_message); exactly one of them is set.
+    """
+    is_from_crypto = from_currency in CRYPTO_SYMBOL_SET
+    is_to_crypto = to_currency in CRYPTO_SYMBOL_SET
+
+    result_text = ""
+    error_message = None
+
+    # Case 1: Fiat to Fiat
+    if not is_from_crypto and not is_to_crypto:
+        rate = rates.get((from_currency, to_currency))
+        if rate is not None:
+            converted_amount = amount * rate
+            result_text = f"💸 {amount:,.2f} {from_currency} = 💸 {converted_amount:,.2f} {to_currency}"
+        else:
+            error_message = f"Could not get rate for {from_currency}/{to_currency}."
+
+    # Case 2: Crypto to Fiat
+    elif is_from_crypto and not is_to_crypto:
+        crypto_price_usd_data = prices.get(from_currency)
+
+        if crypto_price_usd_data and 'price' in crypto_price_usd_data:
+            crypto_price_usd = crypto_price_usd_data['price']
+            if to_currency == "USD":
+                converted_amount = amount * crypto_price_usd
+                result_text = f"🪙 {amount:,.4f} ${from_currency} = 💸 {converted_amount:,.2f} {to_currency}"
+            else:
+                usd_to_fiat_rate = rates.get(("USD", to_currency))
+                if usd_to_fiat_rate is not None:
+                    converted_amount = amount * crypto_price_usd * usd_to_fiat_rate
+                    result_text = f"🪙 {amount:,.4f} ${from_currency} = 💸 {converted_amount:,.2f} {to_currency}"
+                else:
+                    error_message = f"Could not get rate for USD/{to_currency}."
+        else:
+            error_message = f"Could not get price for ${from_currency}."
+
+    # Case 3: Fiat to Crypto
+    elif not is_from_crypto and is_to_crypto:
+        crypto_price_usd_data = prices.get(to_currency)
+
+        if crypto_price_usd_data and 'price' in crypto_price_usd_data:
+            crypto_price_usd = crypto_price_usd_data['price']
+            if from_currency == "USD":
+                converted_amount = amount / crypto_price_usd
+                result_text = f"💸 {amount:,.2f} {from_currency} = 🪙 {converted_amount:,.6f} ${to_currency}"
+            else:
+                fiat_to_usd_rate = rates.get((from_currency, "USD"))
+                if fiat_to_usd_rate is not None:
+                    converted_amount = (amount * fiat_to_usd_rate) / crypto_price_usd
+                    result_text = f"💸 {amount:,.2f} {from_currency} = 🪙 {converted_amount:,.6f} ${to_currency}"
+                else:
+                    error_message = f"Could not get rate for {from_currency}/USD."
+        else:
+            error_message = f"Could not get price for ${to_currency}."
+
+    # Case 4: Crypto to Crypto
+    else:
+        from_price_data = prices.get(from_currency)
+        to_price_data = prices.get(to_currency)
+
+        if from_price_data and 'price' in from_price_data and to_price_data and 'price' in to_price_data:
+            from_price_usd = from_price_data['price']
+            to_price_usd = to_price_data['price']
+            if to_price_usd > 0: # Avoid division by zero
+                converted_amount = amount * (from_price_usd / to_price_usd)
+                result_text = f"🪙 {amount:,.4f} ${from_currency} = 🪙 {converted_amount:,.6f} ${to_currency}"
+            else:
+                error_message = f"Price for ${to_currency} is zero."
+        else:
+            missing = []
+            if not (from_price_data and 'price' in from_price_data):
+                missing.append(from_currency)
+            if not (to_price_data and 'price' in to_price_data):
+                missing.append(to_currency)
+            error_message = f"Could not get price for ${' and '.join(missing)}."
+
+    return result_text, error_message
+
+def convert_many(amount, from_currency, targets, prices, fx_table):
+    """
+    Converts an amount into many currencies at once from one price and FX snapshot.
+
+    Every currency is expressed as its USD value per unit (crypto from `prices`,
+    fiat from the USD column of the cross-rate matrix), so all targets are one
+    vectorized division instead of a branch per currency pair.
+
+    Args:
+        amount (float): The amount to convert.
+        from_currency (str): The source currency code.
+        targets (list): Target currency codes.
+        prices (dict): CoinMarketCap price data keyed by symbol, as from get_crypto_prices.
+        fx_table (FxRateTable): The fiat cross-rate table, or None if unavailable.
+
+    Returns:
+        list: (target, result_text) for every target that could be priced, in target order.
+    """
+    currencies = [from_currency] + list(targets)
+    usd_per_unit = np.full(len(currencies), np.nan)
+
+    crypto_rows = [i for i, currency in enumerate(currencies)
+                   if currency in CRYPTO_SYMBOL_SET and prices.get(currency) and 'price' in prices[currency]]
+    usd_per_unit[crypto_rows] = [prices[currencies[i]]['price'] for i in crypto_rows]
+
+    if fx_table is not None and "USD" in fx_table.index:
+        fiat_rows = [i for i, currency in enumerate(currencies)
+                     if currency not in CRYPTO_SYMBOL_SET and currency in fx_table.index]
+        matrix_rows = [fx_table.index[currencies[i]] for i in fiat_rows]
+        usd_per_unit[fiat_rows] = fx_table.matrix[matrix_rows, fx_table.index["USD"]]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        converted = amount * usd_per_unit[0] / usd_per_unit[1:]
+
+    source_text = _format_amount(amount, from_currency, 4)
+    return [(target, f"{source_text} = {_format_amount(float(value), target, 6)}")
+            for target, value in zip(targets, converted) if np.isfinite(value)]
+
+def _format_amount(amount, currency, crypto_decimals):
+    """Formats an amount the way convert() does: crypto with a coin and $ sign, fiat with 2 decimals."""
+    if currency in CRYPTO_SYMBOL_SET:
+        return f"🪙 {amount:,.{crypto_decimals}f} ${currency}"
+    return f"💸 {amount:,.2f} {currency}"
+
+def stale_price_note(prices):
+    """
+    Describes how old the oldest stale price in a get_crypto_prices result is.
+
+    Returns:
+        str: e.g. "⏳ Prices from 7 min ago", or None if every price is fresh.
+    """
+    ages = [data["cache_age"] for data in prices.values() if data and "cache_age" in data]
+    if not ages:
+        return None
+    return f"⏳ Prices from {int(max(ages) // 60)} min ago"
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import uuid
+
+from dotenv import load_dotenv
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+
+import async_crypto_api
+import metrics
+from constants import (
+    HELP_PAGES, COOLDOWN_TIME_CRYPTO, CURRENCY_PAGES, SUPPORTED_CURRENCIES, SUPPORTED_CURRENCY_SET
+)
+from conversion import parse_conversion_query, convert, convert_many, stale_price_note
+# Rendering helpers, per-chat state, the background price refresher, alerts, the inline
+# engine, the Telegram outbox and startup are shared with the threaded bot
+from bot_core import (
+    DEV_USER_IDS, EXPIRED_BUTTONS_NOTICE, PAGE_CALLBACK_PREFIX, chat_states, command_arguments, create_help_markup, format_api_key_status,
+    format_chat_alerts, inline_engine, outbox, price_refresher, render_snapshot_pages, resolve_pagination,
+    send_crypto_message, start_bot, subscribe_alert, unsubscribe_alert
+)
+from telegram_outbox import AsyncBotBridge
+from ton_address import find_ton_address, has_ton_address
+
+# Asyncio execution mode: the same handlers as cryptoTeller.py on AsyncTeleBot, with
+# independent upstream lookups awaited concurrently. Messages, edits and deletes go through
+# the shared outbox, which paces them within Telegram's flood limits and sends them with
+# this bot on the event loop (see AsyncBotBridge); query answers are awaited here.
+# Run with `python cryptoTellerAsync.py`.
+
+load_dotenv()
+bot = AsyncTeleBot(os.getenv("MAIN_KEY"))
+
+@bot.message_handler(commands=["start"])
+async def handle_start(message):
+    """Handles the /start command."""
+    if message.chat.type == "private":
+        outbox.send_message(message.chat.id, "**What's up!** Add me into a group to access my functionality", parse_mode='Markdown')
+    else:
+        outbox.send_message(message.chat.id, "**Greetings!** I'm [CryptoTeller](https://t.me/crypteller_bot), your friend in the world of cryptocurrencies", parse_mode='Markdown', disable_web_page_preview=True)
+
+@bot.message_handler(commands=["help"])
+async def handle_help(message):
+    """Displays the help message in multiple pages."""
+    outbox.send_message(message.chat.id, HELP_PAGES[1], parse_mode='Markdown', reply_markup=create_help_markup())
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("help_page_"))
+async def handle_help_pagination(call):
+    """Handles help message pagination."""
+    page_num = int(call.data.split("_")[-1])
+
+    outbox.edit_message_text(
+        chat_id=call.message.chat.id,
+        message_id=call.message.message_id,
+        text=HELP_PAGES[page_num],
+        parse_mode='Markdown',
+        reply_markup=create_help_markup()
+    )
+
+@bot.message_handler(commands=["crypto"])
+@metrics.timed_handler("crypto")
+async def get_crypto_price(message):
+    """Fetches and displays cryptocurrency prices."""
+    chat_id = message.chat.id
+
+    if message.chat.type not in ("group", "supergroup"):
+        return
+
+    remaining_time = chat_states.start_crypto(chat_id, COOLDOWN_TIME_CRYPTO)
+    if not remaining_time:
+        # Render from the background snapshot; a cold start fills it off the event loop
+        snapshot = price_refresher.snapshot()
+        if not snapshot.prices:
+            snapshot = await asyncio.get_running_loop().run_in_executor(None, price_refresher.refresh_now)
+        price_refresher.record_demand(CURRENCY_PAGES[0])
+
+        if not any(snapshot.prices.values()):
+            # Every fetch failed (e.g. no API key was usable), or the prices are past their max staleness
+            chat_states.cancel_crypto(chat_id)
+            outbox.send_message(chat_id, "Prices are unavailable right now. Please try again in a minute.")
+            return
+
+        message_text_page1, markup = render_snapshot_pages(snapshot)[0]
+        send_crypto_message(chat_id, message_text_page1, markup)
+    else:
+        minutes = int(remaining_time // 60)
+        seconds = int(remaining_time % 60)
+        cooldown_text = f'*Command on cooldown.* Values will refresh in: *{minutes}* minutes *{seconds}* seconds'
+        outbox.send_message(chat_id, cooldown_text, replace_key="crypto_cooldown", parse_mode='Markdown')
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(PAGE_CALLBACK_PREFIX))
+@metrics.timed_handler("pagination")
+async def handle_pagination(call):
+    """Handles pagination for cryptocurrency prices."""
+    resolved = resolve_pagination(call)
+    if resolved is None:
+        await bot.answer_callback_query(call.id, EXPIRED_BUTTONS_NOTICE)
+        return
+    page, message_text, markup, unchanged = resolved
+
+    price_refresher.record_demand(CURRENCY_PAGES[page])
+    if not unchanged:
+        outbox.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, text=message_text, parse_mode='Markdown', reply_markup=markup, disable_web_page_preview=True)
+    await bot.answer_callback_query(call.id)
+
+@bot.callback_query_handler(func=lambda call: True)
+async def handle_expired_buttons(call):
+    """Answers presses on buttons no handler serves any more, e.g. prev_page/page_N from older /crypto messages."""
+    await bot.answer_callback_query(call.id, EXPIRED_BUTTONS_NOTICE)
+
+@bot.message_handler(commands=["api"])
+async def get_current_key(message):
+    """Displays the currently used API key and the live state of the key pool."""
+    outbox.send_message(message.chat.id, format_api_key_status(), parse_mode='Markdown')
+
+@bot.message_handler(commands=["metrics"], func=lambda message: message.from_user.id in DEV_USER_IDS)
+async def show_metrics(message):
+    """Developer-only: sends a digest of the bot's metrics."""
+    outbox.send_message(message.chat.id, metrics.format_summary()[:4000] or "No metrics recorded yet.")
+
+@bot.message_handler(commands=["alert"])
+async def set_alert(message):
+    """Sets a price alert for the chat."""
+    # Alerts are stored in SQLite, so change them off the event loop
+    reply = await asyncio.to_thread(subscribe_alert, message.chat.id, command_arguments(message))
+    outbox.reply_to(message, reply, parse_mode='Markdown')
+
+@bot.message_handler(commands=["alerts"])
+async def list_alerts(message):
+    """Lists the chat's price alerts."""
+    outbox.reply_to(message, format_chat_alerts(message.chat.id), parse_mode='Markdown')
+
+@bot.message_handler(commands=["unalert"])
+async def remove_alert(message):
+    """Removes one of the chat's price alerts."""
+    reply = await asyncio.to_thread(unsubscribe_alert, message.chat.id, command_arguments(message))
+    outbox.reply_to(message, reply, parse_mode='Markdown')
+
+@bot.message_handler(commands=["devblog"])
+async def share_dev_channel(message):
+    """Shares the development blog channel."""
+    outbox.reply_to(message, "• [ʀɢʙ.ᴅᴇᴠ](https://t.me/rgbdevelopment) - Your key to knowledge.", parse_mode='Markdown')
+
+@bot.inline_handler(func=inline_engine.admit)
+@metrics.timed_handler("inline")
+async def handle_inline_query(inline_query):
+    """Handles inline queries for currency and cryptocurrency conversions."""
+    try:
+        if inline_engine.is_superseded(inline_query):
+            return
+
+        parsed = parse_conversion_query(inline_query.query)
+        if not parsed:
+            await bot.answer_inline_query(inline_query.id, [], switch_pm_text="Invalid format. Use: [amount] CUR1 [to] [CUR2]")
+            return
+        amount, from_currency, to_currency = parsed
+        currencies = [currency for currency in (from_currency, to_currency) if currency]
+
+        for currency in currencies:
+            if currency not in SUPPORTED_CURRENCY_SET:
+                await bot.answer_inline_query(inline_query.id, [], switch_pm_text=f"Unsupported currency: {currency}")
+                return
+
+        price_refresher.record_demand(currencies)
+
+        memo_key, prices, missing_symbols, rate_pairs = inline_engine.prepare(amount, from_currency, to_currency)
+        answers = inline_engine.lookup(memo_key)
+        if answers is None:
+            if to_currency is None:
+                # No target: convert into every other supported currency at once
+                fetched_prices, fx_table = await asyncio.gather(
+                    async_crypto_api.get_crypto_prices(missing_symbols),
+                    async_crypto_api.get_fx_table()
+                )
+                prices.update(fetched_prices)
+                targets = [currency for currency in SUPPORTED_CURRENCIES if currency != from_currency]
+                result_texts = [text for _, text in convert_many(amount, from_currency, targets, prices, fx_table)]
+                error_message = f"Could not convert {from_currency} right now."
+            else:
+                # Crypto prices and fiat rates are independent, so fetch them concurrently
+                fetched_prices, *rate_values = await asyncio.gather(
+                    async_crypto_api.get_crypto_prices(missing_symbols),
+                    *(async_crypto_api.get_currency_rate(*pair) for pair in rate_pairs)
+                )
+                prices.update(fetched_prices)
+                rates = dict(zip(rate_pairs, rate_values))
+                result_text, error_message = convert(amount, from_currency, to_currency, prices, rates)
+                result_texts = [result_text] if result_text else []
+            if inline_engine.is_superseded(inline_query):
+                return
+
+            if not result_texts:
+                await bot.answer_inline_query(inline_query.id, [], switch_pm_text=error_message or "Conversion failed.")
+                return
+            description = stale_price_note(prices)
+            answers = [(result_text, description) for result_text in result_texts]
+            inline_engine.remember(memo_key, answers)
+
+        results = [
+            types.InlineQueryResultArticle(
+                id=str(uuid.uuid4()),
+                title=result_text,
+                description=description,
+                input_message_content=types.InputTextMessageContent(
+                    message_text=result_text,
+                    parse_mode='Markdown'
+                ),
+                thumbnail_url="https://i.imgur.com/ubbkPd7.jpeg"
+            )
+            for result_text, description in answers
+        ]
+        await bot.answer_inline_query(inline_query.id, results, cache_time=60) # Cache inline result for 1 min
+
+    except Exception as e:
+        print(f"Error in inline query handler: {e}")
+        await bot.answer_inline_query(inline_query.id, [], switch_pm_text="An error occurred.")
+    finally:
+        inline_engine.finish(inline_query)
+
+@bot.message_handler(func=has_ton_address)
+@metrics.timed_handler("contract_address")
+async def handle_contract_address(message):
+    """Detects TON contract addresses and fetches token info."""
+    # Process only the first found address to avoid spam
+    address = find_ton_address(message.text)
+    if address is None or not chat_states.claim_ton_address(message.chat.id, address):
+        return
+
+    response_text, error_message = await async_crypto_api.get_ton_token_info(address)
+
+    if response_text:
+        outbox.reply_to(message, response_text, parse_mode='Markdown', disable_web_page_preview=True)
+    elif error_message:
+        outbox.reply_to(message, error_message, parse_mode='Markdown')
+
+async def main():
+    """Runs the bot in asyncio mode until interrupted."""
+    outbox.bot = AsyncBotBridge(bot, asyncio.get_running_loop())
+    persistent_store = await asyncio.to_thread(start_bot)
+    print("Bot is running (asyncio mode)...")
+    try:
+        await bot.polling(non_stop=True)
+    finally:
+        # The outbox sends on this loop, so wait for it to drain off the loop
+        await asyncio.to_thread(price_refresher.stop, 5)
+        await asyncio.to_thread(outbox.stop, 5)
+        persistent_store.close()
+        await async_crypto_api.close_session()
+        await bot.close_session()
+
+# Start polling
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,146 +1,720 @@
+import math
 import requests
+import threading
+import time
+import http_client
+import metrics
+import request_steps
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
 from datetime import datetime, timezone, timedelta
-from constants import CMC_API_KEYS, EXCHANGE_RATE_API_KEYS, DEXSCREENER_API_URL
+from constants import (
+    CMC_API_KEYS, EXCHANGE_RATE_API_KEYS, CMC_QUOTES_URL, CMC_MAP_URL, CMC_MAP_LIMIT, CMC_QUOTES_CHUNK_SIZE,
+    CMC_SYMBOLS_PER_CREDIT, EXCHANGE_RATE_PAIR_URL, EXCHANGE_RATE_LATEST_URL,
+    DEXSCREENER_API_URL, DEXSCREENER_TOKENS_API_URL, DEXSCREENER_TOKENS_BATCH_SIZE, FIAT_CURRENCIES, FIAT_CURRENCY_SET,
+    HTTP_MAX_RETRIES, HTTP_RETRY_BACKOFF, CMC_KEY_CALLS_PER_MINUTE, EXCHANGE_RATE_KEY_CALLS_PER_MINUTE,
+    API_KEY_RATE_LIMIT_COOLDOWN, API_KEY_REJECTED_COOLDOWN,
+    SHARED_STATE_LEASE_TTL, SHARED_STATE_FETCH_WAIT, SHARED_STATE_POLL_INTERVAL, SHARED_STATE_REUSE_WINDOW,
+    CMC_HEDGE_DELAY, DEXSCREENER_FALLBACK_TOKENS, CRYPTO_PRICE_CACHE_MAX_ENTRIES, CRYPTO_PRICE_CACHE_MAX_BYTES,
+    EXCHANGE_RATE_CACHE_MAX_ENTRIES, EXCHANGE_RATE_CACHE_MAX_BYTES, TON_TOKEN_CACHE_MAX_ENTRIES, TON_TOKEN_CACHE_MAX_BYTES
+)
+from bounded_cache import BoundedCache
+from circuit_breaker import CircuitBreaker, CIRCUIT_CLOSED
+from cmc_id_index import CmcIdIndex
+from price_history import PriceHistory
+from key_pool import ApiKeyPool
+from request_steps import Call, Send, Sleep
 
-# Global variables for API key rotation
-current_api_key_index = 0
-current_exchange_rate_api_key_index = 0
+# API key pools: per-key rate limits, cooldowns and credit ledgers
+cmc_key_pool = ApiKeyPool("CMC", CMC_API_KEYS, CMC_KEY_CALLS_PER_MINUTE)
+exchange_rate_key_pool = ApiKeyPool("ExchangeRate-API", EXCHANGE_RATE_API_KEYS, EXCHANGE_RATE_KEY_CALLS_PER_MINUTE)
 
-# Caching dictionaries and timeouts
-crypto_price_cache = {}
+# Circuit breakers: a failing upstream is refused (and periodically probed) instead of retried by every caller
+cmc_breaker = CircuitBreaker("cmc")
+exchange_rate_breaker = CircuitBreaker("exchange_rate")
+dexscreener_breaker = CircuitBreaker("dexscreener")
+DEXSCREENER_UNAVAILABLE = "⚠️ DexScreener is unavailable right now. Please try again later."
+
+# Symbol -> CoinMarketCap ID index, and the threads fetching quote chunks in parallel
+cmc_id_index = CmcIdIndex()
+_quote_executor = ThreadPoolExecutor(max_workers=max(1, len(CMC_API_KEYS)), thread_name_prefix="cmc-quotes")
+_hedge_executor = ThreadPoolExecutor(max_workers=2 * max(1, len(CMC_API_KEYS)), thread_name_prefix="cmc-hedge")
+
+# Cache timeouts
 CRYPTO_CACHE_DURATION = timedelta(minutes=5) # Cache crypto prices for 5 minutes
+CRYPTO_CACHE_GRACE = timedelta(minutes=5) # Then serve them stale while a background refresh runs
+CRYPTO_CACHE_MAX_STALENESS = timedelta(minutes=30) # Never serve prices older than this
 
-exchange_rate_cache = {}
 EXCHANGE_RATE_CACHE_DURATION = timedelta(hours=1) # Cache exchange rates for 1 hour
+EXCHANGE_RATE_CACHE_GRACE = timedelta(hours=1) # Then serve them stale while a background refresh runs
+EXCHANGE_RATE_CACHE_MAX_STALENESS = timedelta(hours=12) # Never serve rates older than this
+
+# Stale-while-revalidate states of a cache entry (see cache_state)
+CACHE_FRESH = "fresh" # Within its TTL
+CACHE_STALE = "stale" # Within the grace window: serve it, refresh in the background
+CACHE_EXPIRED = "expired" # Past the grace window: refetch, serve it only if the fetch fails
+
+TON_TOKEN_CACHE_DURATION = timedelta(minutes=2) # Cache token info for 2 minutes
+TON_TOKEN_NEGATIVE_CACHE_DURATION = timedelta(seconds=30) # Remember "not found" results briefly
+TON_TOKEN_RECALL_WINDOW = timedelta(days=1) # Lookups this recent are reloaded on restart so the warm-up can refresh them
+
+# One bounded cache per class of data, each holding (value, stored_at) by key:
+# quotes by symbol, /pair rates by (from, to), DexScreener results by address
+crypto_price_cache = BoundedCache("crypto_price", CRYPTO_CACHE_DURATION, CRYPTO_CACHE_MAX_STALENESS,
+                                  CRYPTO_PRICE_CACHE_MAX_ENTRIES, CRYPTO_PRICE_CACHE_MAX_BYTES)
+exchange_rate_cache = BoundedCache("exchange_rate", EXCHANGE_RATE_CACHE_DURATION, EXCHANGE_RATE_CACHE_MAX_STALENESS,
+                                   EXCHANGE_RATE_CACHE_MAX_ENTRIES, EXCHANGE_RATE_CACHE_MAX_BYTES)
+ton_token_cache = BoundedCache("ton_token", TON_TOKEN_CACHE_DURATION, TON_TOKEN_RECALL_WINDOW,
+                               TON_TOKEN_CACHE_MAX_ENTRIES, TON_TOKEN_CACHE_MAX_BYTES)
+
+CMC_ID_INDEX_MAX_AGE = timedelta(days=90) # Drop a persisted ID index this old instead of loading it
+
+# Cross-rate matrix for all FIAT_CURRENCIES, built from one /latest/USD fetch.
+# matrix[index[a], index[b]] is the rate to convert currency a into currency b.
+FxRateTable = namedtuple("FxRateTable", ["currencies", "index", "matrix", "fetched_at"])
+fx_rate_table = None
+FX_TABLE_BASE_CURRENCY = "USD"
+
+# Every quote fetched, kept as per-symbol ring buffers for trends and sparklines
+price_history = PriceHistory()
+
+# Optional on-disk store the caches write through to (see enable_persistence)
+persistent_store = None
+
+# Optional state shared with other bot processes (see enable_shared_state)
+shared_state = None
 
-def get_crypto_prices(symbols):
+# Locks guarding the caches (telebot runs handlers on a thread pool); the price
+# cache lock makes a cache check and joining an in-flight fetch one step
+_crypto_cache_lock = threading.Lock()
+_fx_table_lock = threading.Lock()
+
+# Symbols currently being fetched from CoinMarketCap, mapped to their in-flight request.
+# Shared with async_crypto_api, so threads and coroutines never fetch a symbol twice.
+_inflight_crypto_fetches = {}
+
+# Cache keys with a background refresh running, so stale reads start at most one each
+# (in either execution mode; see claim_revalidation)
+_revalidating = set()
+_revalidate_lock = threading.Lock()
+
+class _InflightFetch:
+    """A CoinMarketCap request that concurrent callers wait on instead of duplicating."""
+
+    __slots__ = ("done", "results", "_callbacks")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.results = {}
+        self._callbacks = []
+
+    def add_done_callback(self, callback):
+        """Calls callback() once the fetch has finished (at once if it already has)."""
+        with _crypto_cache_lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def finish(self, results):
+        with _crypto_cache_lock:
+            self.results = results
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+class PriceLookup:
+    """
+    One get_crypto_prices call, planned by begin_price_lookup.
+
+    `results` holds what the cache answered; `to_fetch` are the symbols this
+    caller must fetch (registered in `own_fetch`), `pending` the fetches of
+    other callers it must wait for, `stale_symbols` the ones to refresh in the
+    background and `stale_fallbacks` the expired prices to fall back on.
+    """
+
+    __slots__ = ("use_cache", "results", "to_fetch", "own_fetch", "pending", "stale_symbols", "stale_fallbacks")
+
+    def __init__(self, use_cache):
+        self.use_cache = use_cache
+        self.results = {}
+        self.to_fetch = []
+        self.own_fetch = None
+        self.pending = {}
+        self.stale_symbols = []
+        self.stale_fallbacks = {}
+
+def get_crypto_prices(symbols, use_cache=True):
     """
     Fetches the latest cryptocurrency prices from CoinMarketCap, using cache if available.
 
+    Concurrent callers that miss the cache for the same symbols share a single
+    in-flight upstream request instead of each sending their own. Prices within
+    CRYPTO_CACHE_GRACE of expiry are returned stale (with a "cache_age" field, in
+    seconds) while one background refresh runs; older prices are refetched and only
+    served if that fetch fails and they are within CRYPTO_CACHE_MAX_STALENESS.
+
     Args:
         symbols (list): List of cryptocurrency symbols to fetch prices for.
+        use_cache (bool): If False, always fetch from the API (the cache is still updated).
 
     Returns:
         dict: A dictionary containing the prices and other details for the requested symbols.
     """
-    global current_api_key_index, crypto_price_cache
-    results = {}
-    symbols_to_fetch = []
+    lookup = begin_price_lookup(symbols, use_cache)
+    if lookup.stale_symbols:
+        _revalidate_in_background([("crypto", symbol) for symbol in lookup.stale_symbols],
+                                  lambda keys: get_crypto_prices([symbol for _, symbol in keys], use_cache=False))
+
+    # Fetch missing symbols; we are the leader for these
+    if lookup.to_fetch:
+        fetched = {}
+        try:
+            fetched = _fetch_shared_crypto_prices(lookup.to_fetch, price_fetch_max_age(use_cache))
+        finally:
+            finish_price_fetch(lookup, fetched)
+
+    # Wait for the symbols fetched on our behalf by other callers
+    for fetch in lookup.pending.values():
+        fetch.done.wait()
+    return collect_price_lookup(lookup)
+
+def begin_price_lookup(symbols, use_cache):
+    """
+    Answers what it can of a price lookup from the cache and joins or registers the in-flight fetches.
+
+    The caller fetches `to_fetch` and passes the results to finish_price_fetch (even
+    if the fetch failed), waits for `pending`, then calls collect_price_lookup.
+
+    Returns:
+        PriceLookup: The plan.
+    """
+    lookup = PriceLookup(use_cache)
     now = datetime.now(timezone.utc)
 
-    # Check cache first
-    for symbol in symbols:
-        if symbol in crypto_price_cache:
-            cached_data, timestamp = crypto_price_cache[symbol]
-            if now - timestamp < CRYPTO_CACHE_DURATION:
-                results[symbol] = cached_data
-            else:
-                symbols_to_fetch.append(symbol)
-        else:
-            symbols_to_fetch.append(symbol)
+    with _crypto_cache_lock:
+        # Check cache first, then join any request already fetching the symbol
+        for symbol in symbols:
+            cached = crypto_price_cache.get(symbol) if use_cache else None
+            if cached is not None:
+                cached_data, timestamp = cached
+                state = cache_state(now - timestamp, CRYPTO_CACHE_DURATION, CRYPTO_CACHE_GRACE, CRYPTO_CACHE_MAX_STALENESS)
+                metrics.CACHE_LOOKUPS.inc("crypto_price", cache_lookup_result(state))
+                if state == CACHE_FRESH:
+                    lookup.results[symbol] = cached_data
+                    continue
+                if state == CACHE_STALE:
+                    lookup.results[symbol] = mark_stale(cached_data, now - timestamp)
+                    if symbol not in _inflight_crypto_fetches:
+                        lookup.stale_symbols.append(symbol)
+                    continue
+                if state == CACHE_EXPIRED:
+                    lookup.stale_fallbacks[symbol] = mark_stale(cached_data, now - timestamp)
+            elif use_cache:
+                metrics.CACHE_LOOKUPS.inc("crypto_price", "miss")
+            if symbol in _inflight_crypto_fetches:
+                lookup.pending[symbol] = _inflight_crypto_fetches[symbol]
+            elif symbol not in lookup.to_fetch:
+                lookup.to_fetch.append(symbol)
 
-    # Fetch missing symbols
-    if symbols_to_fetch:
-        url = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest"
-        params = {"symbol": ",".join(symbols_to_fetch), "convert": "USD"}
-        headers = {"X-CMC_PRO_API_KEY": CMC_API_KEYS[current_api_key_index]}
+        if lookup.to_fetch:
+            lookup.own_fetch = _InflightFetch()
+            for symbol in lookup.to_fetch:
+                _inflight_crypto_fetches[symbol] = lookup.own_fetch
+    return lookup
 
-        while True:
-            try:
-                response = requests.get(url, params=params, headers=headers, timeout=10) # Added timeout
-                response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-
-                if response.status_code == 200:
-                    data = response.json().get("data", {})
-                    fetch_time = datetime.now(timezone.utc)
-                    for symbol in symbols_to_fetch:
-                        if symbol in data and 'quote' in data[symbol] and 'USD' in data[symbol]['quote']:
-                            price_data = data[symbol]["quote"]["USD"]
-                            results[symbol] = price_data
-                            crypto_price_cache[symbol] = (price_data, fetch_time) # Update cache
-                        else:
-                            # Handle cases where a specific symbol wasn't returned or data is incomplete
-                            print(f"Warning: Data for symbol {symbol} not found or incomplete in API response.")
-                            results[symbol] = None # Indicate data unavailable
-                    break # Exit while loop on success
-
-            except requests.exceptions.HTTPError as http_err:
-                if response.status_code == 429:  # Rate limit
-                    print(f"Rate limit hit for CMC API key index {current_api_key_index}. Switching key.")
-                    # Try all available API keys before giving up
-                    initial_key = current_api_key_index
-                    while True:
-                        switch_api_key()
-                        if current_api_key_index == initial_key:
-                            print("All API keys exhausted. Waiting 60 seconds before retry.")
-                            time.sleep(60)  # Wait before retrying with first key
-                        headers = {"X-CMC_PRO_API_KEY": CMC_API_KEYS[current_api_key_index]}
-                        try:
-                            response = requests.get(url, params=params, headers=headers, timeout=10)
-                            response.raise_for_status()
-                            if response.status_code == 200:
-                                break
-                        except requests.exceptions.HTTPError as retry_err:
-                            if retry_err.response.status_code != 429:
-                                raise  # Re-raise if it's not a rate limit error
-                elif 400 <= response.status_code < 500:
-                    print(f"Client error occurred: {http_err} - Status Code: {response.status_code}")
-                    if response.status_code == 401:  # Unauthorized
-                        switch_api_key()  # Try another key
-                        headers = {"X-CMC_PRO_API_KEY": CMC_API_KEYS[current_api_key_index]}
-                    else:
-                        return results  # Return partial results for other client errors
-                else:  # 500+ server errors
-                    print(f"Server error occurred: {http_err} - Status Code: {response.status_code}")
-                    time.sleep(2)  # Wait before retry on server error
-            except requests.exceptions.RequestException as e:
-                print(f"Error fetching crypto prices: {e}")
-                retry_count = 0
-                max_retries = 3
-                retry_delay = 1  # Initial delay in seconds
-                
-                while retry_count < max_retries:
-                    try:
-                        print(f"Retrying request (attempt {retry_count + 1}/{max_retries})...")
-                        time.sleep(retry_delay)
-                        
-                        # Switch API key before retry
-                        switch_api_key()
-                        headers = {"X-CMC_PRO_API_KEY": CMC_API_KEYS[current_api_key_index]}
-                        
-                        response = requests.get(url, params=params, headers=headers, timeout=10)
-                        response.raise_for_status()
-                        
-                        if response.status_code == 200:
-                            data = response.json().get("data", {})
-                            fetch_time = datetime.now(timezone.utc)
-                            for symbol in symbols_to_fetch:
-                                if symbol in data and 'quote' in data[symbol] and 'USD' in data[symbol]['quote']:
-                                    price_data = data[symbol]["quote"]["USD"]
-                                    results[symbol] = price_data
-                                    crypto_price_cache[symbol] = (price_data, fetch_time)
-                            return results
-                            
-                    except requests.exceptions.RequestException as retry_error:
-                        print(f"Retry attempt {retry_count + 1} failed: {retry_error}")
-                        retry_count += 1
-                        retry_delay *= 2  # Exponential backoff
-                
-                print("All retry attempts failed. Returning partial results.")
+def price_fetch_max_age(use_cache):
+    """Returns the age in seconds up to which a price lookup reuses another process's fetch."""
+    return CRYPTO_CACHE_DURATION.total_seconds() if use_cache else SHARED_STATE_REUSE_WINDOW
+
+def finish_price_fetch(lookup, fetched):
+    """Publishes the results of a lookup's own fetch to its waiters and unregisters it."""
+    with _crypto_cache_lock:
+        for symbol in lookup.to_fetch:
+            if _inflight_crypto_fetches.get(symbol) is lookup.own_fetch:
+                del _inflight_crypto_fetches[symbol]
+    lookup.own_fetch.finish(fetched)
+
+def collect_price_lookup(lookup):
+    """
+    Merges a finished lookup's cached, fetched and awaited prices.
+
+    Returns:
+        dict: Price data keyed by symbol, as returned by get_crypto_prices.
+    """
+    results = dict(lookup.results)
+    if lookup.own_fetch is not None:
+        results.update(lookup.own_fetch.results)
+    # Collect symbols fetched on our behalf by other callers
+    for symbol, fetch in lookup.pending.items():
+        if symbol in fetch.results:
+            results[symbol] = fetch.results[symbol]
+
+    # Fall back to expired prices still within the max staleness if the refetch failed
+    for symbol, fallback in lookup.stale_fallbacks.items():
+        if results.get(symbol) is None:
+            results[symbol] = fallback
+    return results
+
+def cached_price_state(symbol):
+    """Returns the cache state (CACHE_FRESH, ...) of a symbol's price, or None if it is not cached."""
+    cached = crypto_price_cache.peek(symbol)
+    if cached is None:
+        return None
+    return cache_state(datetime.now(timezone.utc) - cached[1], CRYPTO_CACHE_DURATION, CRYPTO_CACHE_GRACE,
+                       CRYPTO_CACHE_MAX_STALENESS)
+
+def cache_state(age, duration, grace, max_staleness):
+    """
+    Classifies a cache entry for stale-while-revalidate reads.
+
+    Args:
+        age (timedelta): Time since the entry was fetched.
+        duration (timedelta): The cache TTL.
+        grace (timedelta): How long past the TTL the entry may be served while refreshing.
+        max_staleness (timedelta): Age beyond which the entry must never be served.
+
+    Returns:
+        str: CACHE_FRESH, CACHE_STALE or CACHE_EXPIRED, or None if the entry is unusable.
+    """
+    if age < duration:
+        return CACHE_FRESH
+    if age < min(duration + grace, max_staleness):
+        return CACHE_STALE
+    if age < max_staleness:
+        return CACHE_EXPIRED
+    return None
+
+def cache_lookup_result(state):
+    """Maps a cache_state to the result label of the cache lookup metric."""
+    if state == CACHE_FRESH:
+        return "hit"
+    return state or "miss"
+
+def mark_stale(price_data, age):
+    """Returns a copy of cached price data with its age in seconds under "cache_age"."""
+    return {**price_data, "cache_age": age.total_seconds()}
+
+def _revalidate_in_background(keys, refresh):
+    """
+    Runs refresh(keys) on a background thread for the keys not already being refreshed.
+
+    Args:
+        keys (list): Hashable cache keys, e.g. ("crypto", "BTC").
+        refresh (callable): Called with the list of keys this thread claimed.
+    """
+    keys = claim_revalidation(keys)
+    if not keys:
+        return
+
+    def run():
+        try:
+            refresh(keys)
+        except Exception as e:
+            print(f"Error refreshing stale cache entries {keys}: {e}")
+        finally:
+            release_revalidation(keys)
+
+    threading.Thread(target=run, name="cache-revalidate", daemon=True).start()
+
+def claim_revalidation(keys):
+    """Marks the keys not already being refreshed as refreshing and returns them."""
+    with _revalidate_lock:
+        keys = [key for key in dict.fromkeys(keys) if key not in _revalidating]
+        _revalidating.update(keys)
+    return keys
+
+def release_revalidation(keys):
+    """Ends the background refresh of keys claimed with claim_revalidation."""
+    with _revalidate_lock:
+        _revalidating.difference_update(keys)
+
+def _fetch_shared_crypto_prices(symbols, max_age):
+    """
+    Fetches prices through _shared_fetch, caching those another process fetched.
+
+    Returns:
+        dict: Price data keyed by symbol, like _fetch_crypto_prices.
+    """
+    fetched, shared = _shared_fetch("crypto_price", symbols, max_age, _fetch_crypto_prices)
+    return {**fetched, **adopt_shared_crypto_prices(shared)}
+
+def adopt_shared_crypto_prices(shared):
+    """Caches prices another process fetched, given as (price_data, stored_at) by symbol, and returns them."""
+    for symbol, (price_data, stored_at) in shared.items():
+        crypto_price_cache.put(symbol, price_data, datetime.fromtimestamp(stored_at, timezone.utc))
+    for symbol, (price_data, stored_at) in shared.items():
+        _record_history(symbol, price_data, datetime.fromtimestamp(stored_at, timezone.utc))
+    return {symbol: price_data for symbol, (price_data, _) in shared.items()}
+
+def _shared_fetch(namespace, keys, max_age, fetch):
+    """
+    Runs fetch(keys) so that each key is fetched by one bot process at a time.
+
+    Without shared state this is just fetch(keys). Otherwise entries another process
+    stored within `max_age` seconds are reused, and the remaining keys are fetched here
+    under a per-key lease. Keys leased by another process are awaited until they
+    appear in the shared state; if that process fails or takes longer than
+    SHARED_STATE_FETCH_WAIT, they are fetched here instead.
+
+    Args:
+        namespace (str): Cache name, e.g. "crypto_price".
+        keys (list): String keys within the namespace.
+        max_age (float): Age in seconds up to which another process's entry is reused.
+        fetch (callable): Fetches a list of keys and returns a dict of results.
+
+    Returns:
+        tuple: (fetched, shared) - fetch()'s merged results, and the reused entries
+        as (value, stored_at unix timestamp) keyed by key.
+    """
+    return request_steps.run_steps(shared_fetch_steps(namespace, keys, max_age, fetch))
+
+def shared_fetch_steps(namespace, keys, max_age, fetch):
+    """
+    The steps (see request_steps) of _shared_fetch.
+
+    fetch() is a non-blocking Call, so the async fetchers can pass a coroutine function.
+    """
+    state = shared_state
+    if state is None:
+        return (yield Call(fetch, (keys,), False)), {}
+
+    fetched, shared = {}, {}
+    pending = list(keys)
+    deadline = time.monotonic() + SHARED_STATE_FETCH_WAIT
+    try:
+        while pending:
+            shared.update((yield Call(state.get_many, (namespace, pending, max_age))))
+            pending = [key for key in pending if key not in shared]
+            leased = yield Call(_take_leases, (state, namespace, pending))
+            if leased:
+                error = None
+                try:
+                    # The previous holder may have stored the key between our read and the lease
+                    shared.update((yield Call(state.get_many, (namespace, leased, max_age))))
+                    to_fetch = [key for key in leased if key not in shared]
+                    if to_fetch:
+                        fetched.update((yield Call(fetch, (to_fetch,), False)))
+                except GeneratorExit:
+                    _release_leases(state, namespace, leased)  # Cancelled; no more steps can run
+                    raise
+                except Exception as e:
+                    error = e
+                yield Call(_release_leases, (state, namespace, leased))
+                if error is not None:
+                    raise error
+                pending = [key for key in pending if key not in leased]
+            elif time.monotonic() >= deadline:
+                fetched.update((yield Call(fetch, (pending,), False)))
                 break
+            else:
+                yield Sleep(SHARED_STATE_POLL_INTERVAL)
+    except Exception as e:
+        # A broken shared store must not take the bot down; fetch the rest here
+        print(f"Error using the shared state for {namespace}: {e}")
+        remaining = [key for key in pending if key not in fetched and key not in shared]
+        if remaining:
+            fetched.update((yield Call(fetch, (remaining,), False)))
+    return fetched, shared
+
+def _take_leases(state, namespace, keys):
+    """Returns the keys whose fetch lease this process got."""
+    return [key for key in keys if state.try_lease(f"{namespace}:{key}", SHARED_STATE_LEASE_TTL)]
+
+def _release_leases(state, namespace, keys):
+    for key in keys:
+        state.release_lease(f"{namespace}:{key}")
+
+def _store_crypto_price(symbol, price_data, fetch_time):
+    """Writes a freshly fetched quote to the price cache."""
+    crypto_price_cache.put(symbol, price_data, fetch_time)
+    _record_history(symbol, price_data, fetch_time)
+    _persist("crypto_price", symbol, price_data, fetch_time)
 
+def _record_history(symbol, price_data, fetch_time):
+    if price_data.get("price") is not None:
+        price_history.append(symbol, fetch_time.timestamp(), price_data["price"], price_data.get("volume_24h"))
+
+def _fetch_crypto_prices(symbols_to_fetch):
+    """
+    Fetches prices for the given symbols from CoinMarketCap, bypassing the cache.
+
+    Symbols known to cmc_id_index are requested by ID, the rest by symbol, in
+    chunks of CMC_QUOTES_CHUNK_SIZE. Several chunks run in parallel, each on its
+    own key from cmc_key_pool; if every key is rate limited or cooling down, or
+    the CMC circuit is open, a chunk fails fast instead of sleeping, leaving its
+    symbols out of the results. Symbols CMC could not price that are listed in
+    DEXSCREENER_FALLBACK_TOKENS are then priced from DexScreener.
+
+    Args:
+        symbols_to_fetch (list): Symbols to request from the API.
+
+    Returns:
+        dict: Price data keyed by symbol (None for symbols missing from the response).
+    """
+    chunks = quote_chunks(symbols_to_fetch)
+    if len(chunks) == 1:
+        results = _fetch_quote_chunk(*chunks[0])
+    else:
+        results = {}
+        for chunk_results in _quote_executor.map(lambda chunk: _fetch_quote_chunk(*chunk), chunks):
+            results.update(chunk_results)
+
+    unpriced = [symbol for symbol in symbols_to_fetch if results.get(symbol) is None and symbol in DEXSCREENER_FALLBACK_TOKENS]
+    if unpriced:
+        results.update(_fetch_dexscreener_prices(unpriced))
     return results
 
-def switch_api_key():
+def quote_chunks(symbols):
     """
-    Switches to the next available CoinMarketCap API key.
+    Splits symbols into quote requests of at most CMC_QUOTES_CHUNK_SIZE assets.
+
+    Also starts a background rebuild of cmc_id_index when it is due.
+
+    Returns:
+        list: (symbols, ids) tuples; ids is None for chunks requested by symbol.
     """
-    global current_api_key_index
-    current_api_key_index = (current_api_key_index + 1) % len(CMC_API_KEYS)
+    if cmc_id_index.needs_refresh():
+        cmc_id_index.attempted_at = cmc_id_index.clock()
+        _revalidate_in_background(["cmc_id_index"], lambda keys: refresh_cmc_id_index())
+    return _plan_quote_chunks(symbols)
+
+def quote_credits(symbols):
+    """
+    Returns the CMC credits fetching the symbols costs: one request per chunk from
+    quote_chunks, each charged 1 credit per started CMC_SYMBOLS_PER_CREDIT symbols.
+    """
+    return sum(math.ceil(len(chunk) / CMC_SYMBOLS_PER_CREDIT) for chunk, _ in _plan_quote_chunks(symbols))
+
+def _plan_quote_chunks(symbols):
+    ids, unresolved = cmc_id_index.resolve(symbols)
+    resolved = list(ids)
+    chunks = []
+    for start in range(0, len(resolved), CMC_QUOTES_CHUNK_SIZE):
+        chunk = resolved[start:start + CMC_QUOTES_CHUNK_SIZE]
+        chunks.append((chunk, [ids[symbol] for symbol in chunk]))
+    for start in range(0, len(unresolved), CMC_QUOTES_CHUNK_SIZE):
+        chunks.append((unresolved[start:start + CMC_QUOTES_CHUNK_SIZE], None))
+    return chunks
+
+def quote_params(symbols, ids):
+    """Returns the quotes/latest query parameters for a chunk from quote_chunks."""
+    if ids is not None:
+        return {"id": ",".join(str(cmc_id) for cmc_id in ids), "convert": "USD"}
+    return {"symbol": ",".join(symbols), "convert": "USD"}
+
+def store_quote_chunk(symbols, ids, data):
+    """
+    Caches the quotes of a successful quotes/latest response for a chunk.
+
+    Responses are keyed by ID (as a string) for requests by ID, by symbol otherwise.
+
+    Returns:
+        dict: Price data keyed by symbol (None for symbols missing from the response).
+    """
+    results = {}
+    fetch_time = datetime.now(timezone.utc)
+    keys = [str(cmc_id) for cmc_id in ids] if ids is not None else symbols
+    for symbol, key in zip(symbols, keys):
+        quote = data.get(key)
+        if isinstance(quote, dict) and 'USD' in quote.get('quote', {}):
+            price_data = quote["quote"]["USD"]
+            results[symbol] = price_data
+            _store_crypto_price(symbol, price_data, fetch_time) # Update cache
+        else:
+            # Handle cases where a specific symbol wasn't returned or data is incomplete
+            print(f"Warning: Data for symbol {symbol} not found or incomplete in API response.")
+            results[symbol] = None # Indicate data unavailable
+    return results
+
+def _fetch_quote_chunk(symbols, ids):
+    """Fetches one chunk from quote_chunks; returns {} if the request failed."""
+    if CMC_HEDGE_DELAY is not None and len(CMC_API_KEYS) > 1:
+        body = _request_cmc_hedged(CMC_QUOTES_URL, quote_params(symbols, ids))
+    else:
+        body = _request_cmc(CMC_QUOTES_URL, quote_params(symbols, ids))
+    if body is None:
+        return {}
+    return store_quote_chunk(symbols, ids, body.get("data", {}))
+
+def _request_cmc_hedged(url, params):
+    """
+    Sends a CoinMarketCap request, and a second one on another key if the first is slow.
+
+    If the first request has not answered within CMC_HEDGE_DELAY seconds (and the
+    circuit is closed), the same request is sent again on a key with no request in
+    flight, so it never queues behind the first one on the same key; when every key
+    is busy, no hedge is sent. The first successful body wins. Each hedge costs an
+    extra request's credits, so it is off by default.
+
+    Returns:
+        dict: The decoded JSON body of a 200 response, or None if both requests failed.
+    """
+    primary = _hedge_executor.submit(_request_cmc, url, params)
+    try:
+        return primary.result(timeout=CMC_HEDGE_DELAY)
+    except FutureTimeoutError:
+        pass
+    if cmc_breaker.state != CIRCUIT_CLOSED or not cmc_key_pool.has_idle_key():
+        return primary.result()
+
+    metrics.UPSTREAM_HEDGES.inc("cmc")
+    hedge = _hedge_executor.submit(request_steps.run_steps, cmc_request_steps(url, params, idle_only=True))
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            body = future.result()
+            if body is not None:
+                return body
+    return None
+
+def refresh_cmc_id_index():
+    """Rebuilds cmc_id_index from /cryptocurrency/map and persists it; returns False on failure."""
+    body = _request_cmc(CMC_MAP_URL, {"listing_status": "active", "sort": "cmc_rank", "limit": CMC_MAP_LIMIT})
+    if body is None or not isinstance(body.get("data"), list):
+        print("Could not rebuild the CoinMarketCap ID index; quotes are requested by symbol meanwhile.")
+        return False
+    built_at = datetime.now(timezone.utc)
+    ids = cmc_id_index.build(body["data"], built_at.timestamp())
+    _persist("cmc_id_index", "active", ids, built_at)
+    print(f"Indexed {len(ids)} CoinMarketCap symbols.")
+    return True
+
+def _request_cmc(url, params):
+    """
+    Sends a request to CoinMarketCap with a key from cmc_key_pool (see cmc_request_steps).
+
+    Returns:
+        dict: The decoded JSON body of a 200 response, or None if the request failed.
+    """
+    return request_steps.run_steps(cmc_request_steps(url, params))
+
+def cmc_request_steps(url, params, queue_wait=0, idle_only=False):
+    """
+    The steps (see request_steps) of a CoinMarketCap request with a key from cmc_key_pool.
+
+    Keys that are rate limited, out of credits or rejected are cooled down and the
+    next key is tried; transport and server errors are retried up to HTTP_MAX_RETRIES
+    times with exponential backoff (the HTTP client itself does not retry these
+    requests). Credits are booked per key. Every failed attempt counts against
+    cmc_breaker; while it is open the request fails without being sent.
+
+    Args:
+        url (str): The endpoint.
+        params (dict): Query parameters.
+        queue_wait (float): How long to wait for a key when all are busy (0 fails fast).
+        idle_only (bool): Only use keys with no request in flight (for hedged requests).
+
+    Returns:
+        dict: The decoded JSON body of a 200 response, or None if the request failed.
+    """
+    retry_delay = HTTP_RETRY_BACKOFF
+    # Every key gets one chance on rejection, on top of the retries for errors
+    for _ in range(len(CMC_API_KEYS) + HTTP_MAX_RETRIES):
+        if not cmc_breaker.allow():
+            print(f"CoinMarketCap circuit is open (next probe in {cmc_breaker.retry_in():.0f}s).")
+            return None
+        key_index = yield from request_steps.acquire_key(cmc_key_pool, queue_wait, idle_only)
+        if key_index is None:
+            return None
+
+        started = time.perf_counter()
+        try:
+            reply = yield Send(url, params, {"X-CMC_PRO_API_KEY": CMC_API_KEYS[key_index]})
+        except GeneratorExit:
+            cmc_key_pool.release(key_index)  # Cancelled, e.g. the slower of two hedged requests
+            raise
+        metrics.observe_upstream("cmc", reply.status, key_index, started)
+        if reply.error is not None:
+            metrics.UPSTREAM_RETRIES.inc("cmc")
+            cmc_key_pool.release(key_index)
+            cmc_breaker.record_failure()
+            print(f"Error fetching from CoinMarketCap: {reply.error}")
+            yield Sleep(retry_delay)
+            retry_delay *= 2  # Exponential backoff
+            continue
+        body = reply.body
+
+        if reply.status == 200:
+            cmc_key_pool.release(key_index, body.get("status", {}).get("credit_count", 0))
+            cmc_breaker.record_success()
+            return body
+
+        rejection = cmc_key_rejection(reply.status, body, reply.headers.get("Retry-After"))
+        if rejection:
+            yield from request_steps.cool_down_key(cmc_key_pool, key_index, *rejection)
+            continue
+
+        cmc_key_pool.release(key_index)
+        if 400 <= reply.status < 500:
+            cmc_breaker.record_success()  # The API is up; the request itself was bad
+            print(f"Client error occurred - Status Code: {reply.status}")
+            return None
+        cmc_breaker.record_failure()
+        print(f"Server error occurred - Status Code: {reply.status}")
+        metrics.UPSTREAM_RETRIES.inc("cmc")
+        yield Sleep(retry_delay)
+        retry_delay *= 2
+
+    print("All retry attempts failed.")
+    return None
+
+def cmc_key_rejection(status_code, body, retry_after=None):
+    """
+    Classifies a CoinMarketCap error response that should take the key out of rotation.
+
+    Args:
+        status_code (int): HTTP status of the response.
+        body (dict): Decoded JSON body (CMC puts its error_code under "status").
+        retry_after (str): Value of the Retry-After header, if any.
+
+    Returns:
+        tuple: (cooldown_seconds, reason) for ApiKeyPool.cooldown, or None if the key is fine.
+    """
+    error_code = body.get("status", {}).get("error_code")
+    if status_code == 429:
+        if error_code in (1009, 1010):  # Daily or monthly credit limit reached
+            return seconds_until_utc_midnight(), "out of credits"
+        try:
+            cooldown = float(retry_after) if retry_after else API_KEY_RATE_LIMIT_COOLDOWN
+        except ValueError:
+            cooldown = API_KEY_RATE_LIMIT_COOLDOWN
+        return cooldown, "rate limited"
+    if status_code in (401, 402, 403):
+        return API_KEY_REJECTED_COOLDOWN, f"rejected ({status_code})"
+    return None
+
+def exchange_rate_key_rejection(error_type):
+    """
+    Classifies an ExchangeRate-API error type that should take the key out of rotation.
+
+    Returns:
+        tuple: (cooldown_seconds, reason) for ApiKeyPool.cooldown, or None if the key is fine.
+    """
+    if error_type == "quota-reached":
+        return seconds_until_utc_midnight(), "out of quota"
+    if error_type == "rate-limit-reached":
+        return API_KEY_RATE_LIMIT_COOLDOWN, "rate limited"
+    if error_type in ("invalid-key", "inactive-account", "plan-upgrade-required"):
+        return API_KEY_REJECTED_COOLDOWN, f"rejected ({error_type})"
+    return None
+
+def seconds_until_utc_midnight():
+    """Returns the number of seconds until the next UTC midnight, when daily quotas reset."""
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
 
 def get_currency_rate(from_currency, to_currency):
     """
-    Fetches the currency conversion rate from ExchangeRate-API, using cache if available.
+    Returns the conversion rate between two fiat currencies, using cache if available.
+
+    Pairs within FIAT_CURRENCIES are a lookup in the cross-rate matrix; any other
+    pair falls back to ExchangeRate-API's /pair endpoint.
 
     Args:
         from_currency (str): The source currency code.
@@ -149,104 +723,273 @@ def get_currency_rate(from_currency, to_currency):
     Returns:
         float: The conversion rate, or None if an error occurs or rate not found.
     """
-    global current_exchange_rate_api_key_index, exchange_rate_cache
+    if from_currency in FIAT_CURRENCY_SET and to_currency in FIAT_CURRENCY_SET:
+        return lookup_fx_rate(get_fx_table(), from_currency, to_currency)
+    return _get_pair_rate(from_currency, to_currency)
+
+def lookup_fx_rate(table, from_currency, to_currency):
+    """
+    Looks up a conversion rate in an FxRateTable.
+
+    Returns:
+        float: The conversion rate, or None if the table is missing either currency.
+    """
+    if table is None or from_currency not in table.index or to_currency not in table.index:
+        return None
+    return float(table.matrix[table.index[from_currency], table.index[to_currency]])
+
+def fx_table_is_fresh(table):
+    """Returns True if the FX table exists and is within EXCHANGE_RATE_CACHE_DURATION."""
+    return fx_table_state(table) == CACHE_FRESH
+
+def fx_table_state(table):
+    """Returns the cache_state of the FX table, or None if there is no usable table."""
+    if table is None:
+        return None
+    return cache_state(datetime.now(timezone.utc) - table.fetched_at, EXCHANGE_RATE_CACHE_DURATION,
+                       EXCHANGE_RATE_CACHE_GRACE, EXCHANGE_RATE_CACHE_MAX_STALENESS)
+
+def get_fx_table(use_cache=True):
+    """
+    Returns the fiat cross-rate table, refreshing it from ExchangeRate-API when expired.
+
+    Concurrent callers wait for a single refresh instead of each fetching the table.
+    Within EXCHANGE_RATE_CACHE_GRACE of expiry the stale table is returned at once
+    (its fetched_at gives its age) and refreshed in the background.
+
+    Args:
+        use_cache (bool): If False, always fetch a new table from the API.
+
+    Returns:
+        FxRateTable: The current table, or None if it could not be fetched.
+    """
+    table = fx_rate_table
+    if use_cache:
+        state = fx_table_state(table)
+        metrics.CACHE_LOOKUPS.inc("fx_table", cache_lookup_result(state))
+        if state == CACHE_FRESH:
+            return table
+        if state == CACHE_STALE:
+            _revalidate_in_background(["fx_table"], lambda keys: get_fx_table(use_cache=False))
+            return table
+
+    with _fx_table_lock:
+        # Another thread may have refreshed the table while we waited for the lock
+        table = fx_rate_table
+        state = fx_table_state(table)
+        if use_cache and state == CACHE_FRESH:
+            return table
+
+        max_age = EXCHANGE_RATE_CACHE_DURATION.total_seconds() if use_cache else SHARED_STATE_REUSE_WINDOW
+        fetched, shared = _shared_fetch("fx_table", [FX_TABLE_BASE_CURRENCY], max_age, _fetch_fx_tables)
+        if FX_TABLE_BASE_CURRENCY in shared:
+            return adopt_shared_fx_table(*shared[FX_TABLE_BASE_CURRENCY])
+        if FX_TABLE_BASE_CURRENCY not in fetched:
+            # Keep serving the old table until it passes the max staleness
+            return table if state is not None else None
+        return fetched[FX_TABLE_BASE_CURRENCY]
+
+def build_fx_table(conversion_rates, fetched_at):
+    """
+    Builds the cross-rate matrix for FIAT_CURRENCIES from a single base-currency rate table.
+
+    Args:
+        conversion_rates (dict): Rates from the base currency to every other currency.
+        fetched_at (datetime): When the rates were fetched.
+
+    Returns:
+        FxRateTable: The cross-rate table.
+    """
+    currencies = [currency for currency in FIAT_CURRENCIES if conversion_rates.get(currency)]
+    base_rates = np.array([float(conversion_rates[currency]) for currency in currencies])
+    # Going a -> base -> b: divide by a's base rate, multiply by b's
+    matrix = base_rates[np.newaxis, :] / base_rates[:, np.newaxis]
+    index = {currency: i for i, currency in enumerate(currencies)}
+    return FxRateTable(currencies, index, matrix, fetched_at)
+
+def store_fx_table(table):
+    """Publishes a new FX table, writes it through to the persistent and shared stores, and returns it."""
+    _publish_fx_table(table)
+    # Persist the base-currency row; the full matrix is rebuilt from it on load
+    base_row = table.matrix[table.index[FX_TABLE_BASE_CURRENCY]]
+    conversion_rates = {currency: float(base_row[i]) for currency, i in table.index.items()}
+    _persist("fx_table", FX_TABLE_BASE_CURRENCY, conversion_rates, table.fetched_at)
+    return table
+
+def adopt_shared_fx_table(conversion_rates, stored_at):
+    """Publishes the FX table another process fetched, without writing it back, and returns it."""
+    return _publish_fx_table(build_fx_table(conversion_rates, datetime.fromtimestamp(stored_at, timezone.utc)))
+
+def _publish_fx_table(table):
+    global fx_rate_table
+    fx_rate_table = table
+    return table
+
+def _fetch_fx_tables(base_currencies):
+    """Fetches and stores the FX table for _shared_fetch, keyed by base currency."""
+    tables = {}
+    for base_currency in base_currencies:
+        conversion_rates = _fetch_fx_rates(base_currency)
+        if conversion_rates is not None:
+            tables[base_currency] = store_fx_table(build_fx_table(conversion_rates, datetime.now(timezone.utc)))
+    return tables
+
+def _fetch_fx_rates(base_currency):
+    """
+    Fetches every rate for the base currency from ExchangeRate-API's /latest endpoint.
+
+    Returns:
+        dict: Currency code to rate, or None if the request failed.
+    """
+    data = _request_exchange_rate_api(EXCHANGE_RATE_LATEST_URL, base_currency=base_currency)
+    if data is None or not data.get("conversion_rates"):
+        return None
+    return data["conversion_rates"]
+
+def _get_pair_rate(from_currency, to_currency):
+    """
+    Fetches a single pair rate from ExchangeRate-API's /pair endpoint, using cache if available.
+
+    Only used for currencies outside FIAT_CURRENCIES. Follows the same
+    stale-while-revalidate rules as the FX table.
+
+    Returns:
+        float: The conversion rate, or None if an error occurs or rate not found.
+    """
     cache_key = (from_currency, to_currency)
-    now = datetime.now(timezone.utc)
+    state = None
 
     # Check cache
-    if cache_key in exchange_rate_cache:
-        rate, timestamp = exchange_rate_cache[cache_key]
-        if now - timestamp < EXCHANGE_RATE_CACHE_DURATION:
-            return rate
-
-    # Fetch from API if not in cache or expired
-    while True:
-        current_api_key = EXCHANGE_RATE_API_KEYS[current_exchange_rate_api_key_index]
+    cached = exchange_rate_cache.get(cache_key)
+    if cached is not None:
+        rate, timestamp = cached
+        state = cache_state(datetime.now(timezone.utc) - timestamp, EXCHANGE_RATE_CACHE_DURATION,
+                            EXCHANGE_RATE_CACHE_GRACE, EXCHANGE_RATE_CACHE_MAX_STALENESS)
+    metrics.CACHE_LOOKUPS.inc("exchange_rate", cache_lookup_result(state))
+    if state == CACHE_FRESH:
+        return rate
+    if state == CACHE_STALE:
+        _revalidate_in_background([("pair", cache_key)], lambda keys: _fetch_pair_rate(from_currency, to_currency))
+        return rate
+
+    fetched_rate = _fetch_pair_rate(from_currency, to_currency)
+    if fetched_rate is None and state == CACHE_EXPIRED:
+        return rate
+    return fetched_rate
+
+def _fetch_pair_rate(from_currency, to_currency):
+    """Fetches a single pair rate (or reuses another process's fresh one), bypassing the local cache."""
+    pair = f"{from_currency}/{to_currency}"
+    fetched, shared = _shared_fetch("exchange_rate", [pair], EXCHANGE_RATE_CACHE_DURATION.total_seconds(),
+                                    lambda pairs: {pair: _request_pair_rate(from_currency, to_currency)})
+    if pair in shared:
+        return adopt_shared_pair_rate((from_currency, to_currency), *shared[pair])
+    return fetched.get(pair)
+
+def adopt_shared_pair_rate(cache_key, rate, stored_at):
+    """Caches a /pair rate another process fetched, without writing it back, and returns it."""
+    exchange_rate_cache.put(cache_key, rate, datetime.fromtimestamp(stored_at, timezone.utc))
+    return rate
+
+def _request_pair_rate(from_currency, to_currency):
+    """Requests a single pair rate from ExchangeRate-API and caches it."""
+    data = _request_exchange_rate_api(EXCHANGE_RATE_PAIR_URL, from_currency=from_currency, to_currency=to_currency)
+    if data is None:
+        return None
+    rate = data.get('conversion_rate')
+    if rate is None:
+        print(f"Error: 'conversion_rate' not found in ExchangeRate-API response for {from_currency}/{to_currency}. Response: {data}")
+        return None # Rate not found in successful response
+    return _store_pair_rate((from_currency, to_currency), float(rate), datetime.now(timezone.utc)) # Update cache
+
+def _store_pair_rate(cache_key, rate, fetch_time):
+    """Writes a /pair rate to the exchange rate cache and returns it."""
+    exchange_rate_cache.put(cache_key, rate, fetch_time)
+    _persist("exchange_rate", "/".join(cache_key), rate, fetch_time)
+    return rate
+
+def _request_exchange_rate_api(url_template, **url_fields):
+    """
+    Sends a request to ExchangeRate-API with a key from exchange_rate_key_pool (see exchange_rate_request_steps).
+
+    Returns:
+        dict: The successful JSON response, or None if the request failed.
+    """
+    return request_steps.run_steps(exchange_rate_request_steps(url_template, url_fields))
+
+def exchange_rate_request_steps(url_template, url_fields, queue_wait=0):
+    """
+    The steps (see request_steps) of an ExchangeRate-API request with a key from exchange_rate_key_pool.
+
+    Keys that report quota, rate-limit or account errors are cooled down and the
+    next key is tried; transport and server errors are retried with backoff as in
+    cmc_request_steps. If no key is usable, or exchange_rate_breaker is open, the
+    call fails fast.
+
+    Args:
+        url_template (str): Endpoint template with an {api_key} field.
+        url_fields (dict): Remaining fields of the template.
+        queue_wait (float): How long to wait for a key when all are busy (0 fails fast).
+
+    Returns:
+        dict: The successful JSON response, or None if the request failed.
+    """
+    retry_delay = HTTP_RETRY_BACKOFF
+    # Every key gets one chance on rejection, on top of the retries for errors
+    for _ in range(len(EXCHANGE_RATE_API_KEYS) + HTTP_MAX_RETRIES):
+        if not exchange_rate_breaker.allow():
+            print(f"ExchangeRate-API circuit is open (next probe in {exchange_rate_breaker.retry_in():.0f}s).")
+            return None
+        key_index = yield from request_steps.acquire_key(exchange_rate_key_pool, queue_wait)
+        if key_index is None:
+            return None
+
+        url = url_template.format(api_key=EXCHANGE_RATE_API_KEYS[key_index], **url_fields)
+        started = time.perf_counter()
         try:
-            url = f"https://v6.exchangerate-api.com/v6/{current_api_key}/pair/{from_currency}/{to_currency}"
-            # Using the /pair endpoint is more direct
-            response = requests.get(url, timeout=10) # Added timeout
-            response.raise_for_status()
-
-            data = response.json()
-            if data.get("result") == "success":
-                rate = data.get('conversion_rate')
-                if rate is not None:
-                    exchange_rate_cache[cache_key] = (float(rate), datetime.now(timezone.utc)) # Update cache
-                    return float(rate)
-                else:
-                    print(f"Error: 'conversion_rate' not found in ExchangeRate-API response for {from_currency}/{to_currency}. Response: {data}")
-                    return None # Rate not found in successful response
-            elif data.get("error-type") == "invalid-key" or data.get("error-type") == "inactive-account":
-                 print(f"ExchangeRate-API key {current_exchange_rate_api_key_index} is invalid or inactive. Switching key.")
-                 switch_exchange_rate_api_key()
-                 # Continue loop to retry with new key
-            elif data.get("error-type") == "unsupported-code":
-                 print(f"Error: Unsupported currency code used: {from_currency} or {to_currency}")
-                 return None # Unsupported currency
-            else:
-                print(f"Error: ExchangeRate-API request failed. Response: {data}")
-                error_type = data.get("error-type", "unknown")
-                
-                # Switch API key for specific error types that might benefit from using a different key
-                if error_type in ["quota-reached", "plan-upgrade-required", "server-error"]:
-                    print(f"Switching API key due to error: {error_type}")
-                    switch_exchange_rate_api_key()
-                    continue  # Retry with new key
-                
-                # For rate limiting, implement exponential backoff
-                if error_type == "rate-limit-reached":
-                    retry_delay = 2
-                    max_retries = 3
-                    for retry in range(max_retries):
-                        print(f"Rate limit reached. Waiting {retry_delay} seconds before retry {retry + 1}/{max_retries}")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2
-                        switch_exchange_rate_api_key()
-                        continue
-                
-                return None  # Failed for other unrecoverable reasons
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching exchange rate: {e}")
-            retry_count = 0
-            max_retries = 3
-            retry_delay = 1  # Initial delay in seconds
-            
-            while retry_count < max_retries:
-                try:
-                    print(f"Retrying exchange rate request (attempt {retry_count + 1}/{max_retries})...")
-                    time.sleep(retry_delay)
-                    
-                    # Switch API key before retry
-                    switch_exchange_rate_api_key()
-                    current_api_key = EXCHANGE_RATE_API_KEYS[current_exchange_rate_api_key_index]
-                    
-                    url = f"https://v6.exchangerate-api.com/v6/{current_api_key}/pair/{from_currency}/{to_currency}"
-                    response = requests.get(url, timeout=10)
-                    response.raise_for_status()
-                    
-                    data = response.json()
-                    if data.get("result") == "success":
-                        rate = data.get('conversion_rate')
-                        if rate is not None:
-                            exchange_rate_cache[cache_key] = (float(rate), datetime.now(timezone.utc))
-                            return float(rate)
-                    
-                except requests.exceptions.RequestException as retry_error:
-                    print(f"Retry attempt {retry_count + 1} failed: {retry_error}")
-                    retry_count += 1
-                    retry_delay *= 2  # Exponential backoff
-            
-            print("All retry attempts failed")
-            return None  # Return None after all retries exhausted
-
-def switch_exchange_rate_api_key():
-    """
-    Switches to the next available ExchangeRate-API key.
-    """
-    global current_exchange_rate_api_key_index
-    current_exchange_rate_api_key_index = (current_exchange_rate_api_key_index + 1) % len(EXCHANGE_RATE_API_KEYS)
+            reply = yield Send(url, None, None)
+        except GeneratorExit:
+            exchange_rate_key_pool.release(key_index)
+            raise
+        metrics.observe_upstream("exchange_rate", reply.status, key_index, started)
+        if reply.error is not None:
+            metrics.UPSTREAM_RETRIES.inc("exchange_rate")
+            exchange_rate_key_pool.release(key_index)
+            exchange_rate_breaker.record_failure()
+            print(f"Error fetching exchange rate: {reply.error}")
+            yield Sleep(retry_delay)
+            retry_delay *= 2
+            continue
+        data = reply.body
+
+        if data.get("result") == "success":
+            exchange_rate_key_pool.release(key_index, 1)
+            exchange_rate_breaker.record_success()
+            return data
+
+        error_type = data.get("error-type", "unknown")
+        rejection = exchange_rate_key_rejection(error_type)
+        if rejection:
+            yield from request_steps.cool_down_key(exchange_rate_key_pool, key_index, *rejection)
+            continue
+
+        exchange_rate_key_pool.release(key_index)
+        if error_type == "server-error" or reply.status >= 500:
+            exchange_rate_breaker.record_failure()
+        else:
+            exchange_rate_breaker.record_success()
+        if error_type == "unsupported-code":
+            print(f"Error: Unsupported currency code used: {url_fields}")
+            return None # Unsupported currency
+        print(f"Error: ExchangeRate-API request failed. Response: {data}")
+        if error_type != "server-error" and reply.status < 500:
+            return None # Failed for other unrecoverable reasons
+        metrics.UPSTREAM_RETRIES.inc("exchange_rate")
+        yield Sleep(retry_delay)
+        retry_delay *= 2
+
+    print("All retry attempts failed")
+    return None
 
 def format_large_number(num):
     if num >= 1_000_000:
@@ -270,63 +1013,300 @@ def calculate_age(timestamp_ms):
     else:
         return "<1h"
 
-def get_ton_token_info(address):
-    """Fetches TON token information from DexScreener using a contract address."""
+def _request_dexscreener(url):
+    """
+    Sends a GET request to DexScreener through dexscreener_breaker.
+
+    Raises:
+        requests.exceptions.RequestException: On transport errors and error statuses.
+
+    Returns:
+        dict: The decoded JSON body, or None without a request while the circuit is open.
+    """
+    if not dexscreener_breaker.allow():
+        return None
+    response = None
+    started = time.perf_counter()
     try:
-        api_url = DEXSCREENER_API_URL.format(address=address)
-        response = requests.get(api_url)
+        response = http_client.get(url)
+        metrics.observe_upstream("dexscreener", response.status_code, None, started)
         response.raise_for_status() # Raise an exception for bad status codes
-        data = response.json()
-
-        if data and data.get('pairs'):
-            # Filtering for TON pairs specifically
-            ton_pairs = [p for p in data['pairs'] if p.get('chainId') == 'ton']
-            if not ton_pairs:
-                 print(f"No TON pair found for address: {address}")
-                 return None, "No TON pair found."
-
-            # Sort by liquidity or volume if needed, here just taking the first TON pair
-            pair = ton_pairs[0]
-
-            # Extract data
-            base_token = pair.get('baseToken', {})
-            token_name = base_token.get('name', 'N/A')
-            token_symbol = base_token.get('symbol', 'N/A')
-            price_usd_str = pair.get('priceUsd', '0')
-            price_usd = float(price_usd_str) if price_usd_str else 0.0
-            price_change_h1 = pair.get('priceChange', {}).get('h1', 0)
-            price_change_h24 = pair.get('priceChange', {}).get('h24', 0)
-            volume_h24 = pair.get('volume', {}).get('h24', 0)
-            liquidity_usd = pair.get('liquidity', {}).get('usd', 0)
-            market_cap = pair.get('fdv', 0) # Using FDV as Market Cap proxy
-            pair_created_at = pair.get('pairCreatedAt') # Timestamp in ms
-            dexscreener_url = pair.get('url', '#')
-
-            # Calculate age
-            age = calculate_age(pair_created_at)
-
-            response_text = (
-                f"💎 *{token_name} (${token_symbol})*\n"
-                f"`{address}`\n\n"
-                f"⛓️ Chain: TON | ⏳ Age: {age}\n\n"
-                f"📊 *Token Stats*\n"
-                f" ├─ Price: *${price_usd:.6f}*\n"
-                f" ├─ 1H Change: {price_change_h1:+.2f}%\n"
-                f" ├─ 24H Change: {price_change_h24:+.2f}%\n"
-                f" ├─ Volume (24H): *${format_large_number(volume_h24)}*\n"
-                f" ├─ Liquidity: *${format_large_number(liquidity_usd)}*\n"
-                f" └─ Market Cap (FDV): *${format_large_number(market_cap)}*\n\n"
-                f"🔗 [View on DexScreener]({dexscreener_url})"
-            )
-            return response_text, None # Success
+    except requests.exceptions.RequestException:
+        if response is None:
+            metrics.observe_upstream("dexscreener", "error", None, started)
+        if response is None or response.status_code >= 500:
+            dexscreener_breaker.record_failure()
+        raise
+    dexscreener_breaker.record_success()
+    return response.json()
 
-        else:
-            print(f"No pair data found on DexScreener for address: {address}")
-            return None, f"⚠️ Could not find token information for address: `{address}`"
+def get_ton_token_info(address):
+    """Fetches TON token information from DexScreener using a contract address, using cache if available."""
+    cached_result = _get_cached_token_info(address)
+    if cached_result:
+        return cached_result
+
+    try:
+        data = _request_dexscreener(DEXSCREENER_API_URL.format(address=address))
+        if data is None:
+            return None, DEXSCREENER_UNAVAILABLE
+        return _store_token_info(address, build_ton_token_response(address, data))
 
     except requests.exceptions.RequestException as e:
         print(f"Error fetching data from DexScreener for {address}: {e}")
         return None, "⚠️ Error fetching token data from DexScreener. Please try again later."
     except Exception as e:
         print(f"An unexpected error occurred while processing address {address}: {e}")
-        return None, "⚠️ An unexpected error occurred while processing the address."
\ No newline at end of file
+        return None, "⚠️ An unexpected error occurred while processing the address."
+
+def get_ton_tokens_info(addresses):
+    """
+    Resolves many TON contract addresses at once via DexScreener's multi-token endpoint.
+
+    Cached addresses are served from the cache; the rest are requested in batches of
+    DEXSCREENER_TOKENS_BATCH_SIZE. Addresses the batch response does not list as a base
+    token (e.g. a different address form was pasted) fall back to a single search.
+
+    Args:
+        addresses (list): TON contract addresses.
+
+    Returns:
+        dict: (response_text, error_message) keyed by address.
+    """
+    results = {}
+    addresses_to_fetch = []
+    for address in dict.fromkeys(addresses):
+        cached_result = _get_cached_token_info(address)
+        if cached_result:
+            results[address] = cached_result
+        else:
+            addresses_to_fetch.append(address)
+
+    for start in range(0, len(addresses_to_fetch), DEXSCREENER_TOKENS_BATCH_SIZE):
+        batch = addresses_to_fetch[start:start + DEXSCREENER_TOKENS_BATCH_SIZE]
+        try:
+            data = _request_dexscreener(DEXSCREENER_TOKENS_API_URL.format(addresses=",".join(batch)))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error fetching batch of {len(batch)} tokens from DexScreener: {e}")
+            for address in batch:
+                results[address] = (None, "⚠️ Error fetching token data from DexScreener. Please try again later.")
+            continue
+        if data is None:
+            for address in batch:
+                results[address] = (None, DEXSCREENER_UNAVAILABLE)
+            continue
+        pairs = data.get('pairs') or []
+
+        pairs_by_address = {}
+        for pair in pairs:
+            base_address = pair.get('baseToken', {}).get('address')
+            pairs_by_address.setdefault(base_address, []).append(pair)
+
+        for address in batch:
+            if address not in pairs_by_address:
+                results[address] = get_ton_token_info(address)
+                continue
+            try:
+                result = build_ton_token_response(address, {'pairs': pairs_by_address[address]})
+                results[address] = _store_token_info(address, result)
+            except Exception as e:
+                print(f"An unexpected error occurred while processing address {address}: {e}")
+                results[address] = (None, "⚠️ An unexpected error occurred while processing the address.")
+
+    return results
+
+def _fetch_dexscreener_prices(symbols):
+    """
+    Prices tokens from DEXSCREENER_FALLBACK_TOKENS with one DexScreener request.
+
+    The prices are cached like CoinMarketCap quotes (see dexscreener_quote).
+
+    Returns:
+        dict: Price data keyed by symbol, for the symbols DexScreener could price.
+    """
+    addresses = {DEXSCREENER_FALLBACK_TOKENS[symbol]: symbol for symbol in symbols}
+    try:
+        data = _request_dexscreener(DEXSCREENER_TOKENS_API_URL.format(addresses=",".join(addresses)))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error fetching fallback prices from DexScreener: {e}")
+        return {}
+    return store_dexscreener_prices(addresses, (data or {}).get("pairs") or [])
+
+def store_dexscreener_prices(addresses, pairs):
+    """Caches the fallback prices found in a DexScreener tokens response; addresses maps address -> symbol."""
+    results = {}
+    fetch_time = datetime.now(timezone.utc)
+    for address, symbol in addresses.items():
+        price_data = dexscreener_quote(address, pairs)
+        if price_data is not None:
+            results[symbol] = price_data
+            _store_crypto_price(symbol, price_data, fetch_time)
+    return results
+
+def dexscreener_quote(address, pairs):
+    """
+    Builds CoinMarketCap-shaped price data for a token from its DexScreener pairs.
+
+    Uses the most liquid pair with the token as the base token; the volume is summed
+    over all of them. The data carries "source": "dexscreener" so pages can say so.
+
+    Returns:
+        dict: The price data, or None if no pair prices the token.
+    """
+    token_pairs = [pair for pair in pairs
+                   if pair.get('baseToken', {}).get('address') == address and pair.get('priceUsd')]
+    if not token_pairs:
+        return None
+    pair = max(token_pairs, key=lambda pair: (pair.get('liquidity') or {}).get('usd') or 0)
+    return {
+        "price": float(pair['priceUsd']),
+        "percent_change_24h": (pair.get('priceChange') or {}).get('h24') or 0.0,
+        "volume_24h": sum((token_pair.get('volume') or {}).get('h24') or 0 for token_pair in token_pairs),
+        "market_cap": pair.get('marketCap') or pair.get('fdv'),
+        "source": "dexscreener",
+    }
+
+def _get_cached_token_info(address):
+    """Returns the cached (response_text, error_message) for an address, or None if absent or expired."""
+    cached = ton_token_cache.get(address)
+    if cached is None:
+        metrics.CACHE_LOOKUPS.inc("ton_token", "miss")
+        return None
+    result, timestamp = cached
+    ttl = TON_TOKEN_CACHE_DURATION if result[0] else TON_TOKEN_NEGATIVE_CACHE_DURATION
+    if datetime.now(timezone.utc) - timestamp < ttl:
+        metrics.CACHE_LOOKUPS.inc("ton_token", "hit")
+        return result
+    metrics.CACHE_LOOKUPS.inc("ton_token", "expired")
+    return None
+
+def recent_token_addresses(limit):
+    """Returns up to `limit` TON addresses with a cached token, most recently looked up first."""
+    entries = [(stored_at, address) for address, (result, stored_at) in ton_token_cache.items() if result[0]]
+    return [address for _, address in sorted(entries, reverse=True)[:limit]]
+
+def _store_token_info(address, result):
+    """Caches a DexScreener lookup result; "not found" results get the shorter negative TTL on read."""
+    stored_at = datetime.now(timezone.utc)
+    ton_token_cache.put(address, result, stored_at)
+    _persist("ton_token", address, list(result), stored_at)
+    return result
+
+def enable_persistence(store):
+    """
+    Reloads the caches from a PersistentCache and writes every later update through to it.
+
+    Only entries still within their max staleness are loaded, with their original
+    timestamps, so they are served immediately after a restart and expire on
+    schedule. Token info is reloaded for TON_TOKEN_RECALL_WINDOW, but only served
+    within its TTL; older entries tell the warm-up which tokens to refresh.
+
+    Args:
+        store (PersistentCache): The on-disk store to use.
+    """
+    global persistent_store
+    persistent_store = None  # Don't write the entries being loaded straight back
+
+    def load(namespace, duration):
+        max_age = duration.total_seconds()
+        store.prune(namespace, max_age)
+        return [(key, value, datetime.fromtimestamp(stored_at, timezone.utc))
+                for key, value, stored_at in store.load(namespace, max_age)]
+
+    for symbol, price_data, fetch_time in load("crypto_price", CRYPTO_CACHE_MAX_STALENESS):
+        crypto_price_cache.put(symbol, price_data, fetch_time)
+    for pair, rate, fetch_time in load("exchange_rate", EXCHANGE_RATE_CACHE_MAX_STALENESS):
+        exchange_rate_cache.put(tuple(pair.split("/")), rate, fetch_time)
+    # Restored into this process only: the shared state already has this table or a newer one
+    for _, conversion_rates, fetch_time in load("fx_table", EXCHANGE_RATE_CACHE_MAX_STALENESS):
+        _publish_fx_table(build_fx_table(conversion_rates, fetch_time))
+    for address, result, stored_at in load("ton_token", TON_TOKEN_RECALL_WINDOW):
+        ton_token_cache.put(address, tuple(result), stored_at)
+    # A stale ID index still resolves almost every symbol; quote_chunks rebuilds it when due
+    for _, ids, built_at in load("cmc_id_index", CMC_ID_INDEX_MAX_AGE):
+        cmc_id_index.load(ids, built_at.timestamp())
+
+    persistent_store = store
+
+def enable_shared_state(state):
+    """
+    Shares the caches and API key buckets with other bot processes through `state`.
+
+    Cache writes are published to it, cache misses check it before calling an API
+    (see _shared_fetch), and both key pools draw their request tokens and cooldowns
+    from it, so N processes stay within the same per-key limits as one.
+
+    Args:
+        state (SharedState): The shared store, or None to go back to process-local state.
+    """
+    global shared_state
+    shared_state = state
+    cmc_key_pool.shared_state = state
+    exchange_rate_key_pool.shared_state = state
+
+def _persist(namespace, key, value, timestamp):
+    """Queues a cache write for the persistent store and publishes it to the shared state, if enabled."""
+    if persistent_store is not None:
+        persistent_store.put(namespace, key, value, timestamp.timestamp())
+    if shared_state is not None:
+        try:
+            shared_state.put(namespace, key, value, timestamp.timestamp())
+        except Exception as e:
+            print(f"Error publishing {namespace} entry {key} to the shared state: {e}")
+
+def build_ton_token_response(address, data):
+    """
+    Formats a DexScreener search response into the token info message.
+
+    Args:
+        address (str): The TON contract address that was searched for.
+        data (dict): The decoded DexScreener JSON response.
+
+    Returns:
+        tuple: (response_text, error_message); exactly one of them is set.
+    """
+    if data and data.get('pairs'):
+        # Filtering for TON pairs specifically
+        ton_pairs = [p for p in data['pairs'] if p.get('chainId') == 'ton']
+        if not ton_pairs:
+             print(f"No TON pair found for address: {address}")
+             return None, "No TON pair found."
+
+        # Sort by liquidity or volume if needed, here just taking the first TON pair
+        pair = ton_pairs[0]
+
+        # Extract data
+        base_token = pair.get('baseToken', {})
+        token_name = base_token.get('name', 'N/A')
+        token_symbol = base_token.get('symbol', 'N/A')
+        price_usd_str = pair.get('priceUsd', '0')
+        price_usd = float(price_usd_str) if price_usd_str else 0.0
+        price_change_h1 = pair.get('priceChange', {}).get('h1', 0)
+        price_change_h24 = pair.get('priceChange', {}).get('h24', 0)
+        volume_h24 = pair.get('volume', {}).get('h24', 0)
+        liquidity_usd = pair.get('liquidity', {}).get('usd', 0)
+        market_cap = pair.get('fdv', 0) # Using FDV as Market Cap proxy
+        pair_created_at = pair.get('pairCreatedAt') # Timestamp in ms
+        dexscreener_url = pair.get('url', '#')
+
+        # Calculate age
+        age = calculate_age(pair_created_at)
+
+        response_text = (
+            f"💎 *{token_name} (${token_symbol})*\n"
+            f"`{address}`\n\n"
+            f"⛓️ Chain: TON | ⏳ Age: {age}\n\n"
+            f"📊 *Token Stats*\n"
+            f" ├─ Price: *${price_usd:.6f}*\n"
+            f" ├─ 1H Change: {price_change_h1:+.2f}%\n"
+            f" ├─ 24H Change: {price_change_h24:+.2f}%\n"
+            f" ├─ Volume (24H): *${format_large_number(volume_h24)}*\n"
+            f" ├─ Liquidity: *${format_large_number(liquidity_usd)}*\n"
+            f" └─ Market Cap (FDV): *${format_large_number(market_cap)}*\n\n"
+            f"🔗 [View on DexScreener]({dexscreener_url})"
+        )
+        return response_text, None # Success
+
+    else:
+        print(f"No pair data found on DexScreener for address: {address}")
+        return None, f"⚠️ Could not find token information for address: `{address}`"
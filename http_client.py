@@ -0,0 +1,71 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from constants import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_MAXSIZE, HTTP_MAX_RETRIES, HTTP_RETRY_BACKOFF
+)
+
+# One keep-alive session per upstream host (CoinMarketCap, ExchangeRate-API, DexScreener)
+# and retry setting. Callers with their own retry loop (CoinMarketCap and ExchangeRate-API)
+# pass retries=0, so retries and backoff live in one layer.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _create_session(retries):
+    """Creates a session with a pooled adapter retrying up to `retries` times."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        # Hand the last response back to the caller so the existing status handling still applies
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session(url, retries=HTTP_MAX_RETRIES):
+    """
+    Returns the shared session for the host of the given URL, creating it on first use.
+
+    Args:
+        url (str): Any URL on the upstream host.
+        retries (int): Transport-level retries for connection errors and 502/503/504.
+
+    Returns:
+        requests.Session: A session whose connections are kept alive and reused.
+    """
+    parts = urlsplit(url)
+    host_key = (parts.scheme, parts.netloc, retries)
+    session = _sessions.get(host_key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host_key)
+            if session is None:
+                session = _sessions[host_key] = _create_session(retries)
+    return session
+
+def get(url, retries=HTTP_MAX_RETRIES, **kwargs):
+    """
+    Sends a GET request through the pooled session for the URL's host.
+
+    Accepts the same keyword arguments as `requests.get`. If no timeout is given,
+    the configured (connect, read) timeouts are applied so a stalled upstream
+    can never pin a worker thread. Pass retries=0 when the caller retries itself.
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_session(url, retries).get(url, **kwargs)
+
+def close_all():
+    """Closes every pooled session (used on shutdown)."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
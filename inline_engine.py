@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+import crypto_api
+from constants import CRYPTO_SYMBOLS, INLINE_MEMO_SIZE
+from conversion import required_lookups
+
+
+class InlineQueryEngine:
+    """
+    Keeps inline conversion answers cheap while users are typing.
+
+    Telegram sends a new inline query on every keystroke, so:
+
+    - `admit()` runs as the handler filter, in the order updates arrive, and
+      records each user's newest query. Handlers call `is_superseded()` before
+      and after any upstream work and drop older queries without answering.
+    - Answers are memoized by the normalized (amount, from, to) plus the price
+      snapshot version and FX table they were computed from, so repeated
+      queries cost one dict lookup until the underlying data changes.
+
+    `clock` returns unix time, for aging the snapshot prices.
+    """
+
+    def __init__(self, price_refresher, memo_size=INLINE_MEMO_SIZE, clock=time.time):
+        self.price_refresher = price_refresher
+        self.memo_size = memo_size
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._latest_query_ids = {}
+        self._memo = OrderedDict()
+
+    def admit(self, inline_query):
+        """
+        Handler filter: accepts non-empty queries and marks them as their user's newest.
+
+        Returns:
+            bool: True if the query should be handled.
+        """
+        if not inline_query.query:
+            return False
+        with self._lock:
+            self._latest_query_ids[inline_query.from_user.id] = inline_query.id
+        return True
+
+    def is_superseded(self, inline_query):
+        """Returns True if the same user has sent a newer query since this one was admitted."""
+        with self._lock:
+            latest_id = self._latest_query_ids.get(inline_query.from_user.id, inline_query.id)
+        return latest_id != inline_query.id
+
+    def finish(self, inline_query):
+        """Forgets the user's newest query once it has been handled."""
+        with self._lock:
+            if self._latest_query_ids.get(inline_query.from_user.id) == inline_query.id:
+                del self._latest_query_ids[inline_query.from_user.id]
+
+    def prepare(self, amount, from_currency, to_currency):
+        """
+        Resolves everything a conversion can get without touching the network.
+
+        Args:
+            amount (float): The parsed amount.
+            from_currency (str): The source currency code.
+            to_currency (str): The target currency code, or None to convert into every
+                supported currency (which needs every crypto price and the FX table).
+
+        Returns:
+            tuple: (memo_key, prices, missing_symbols, rate_pairs). `prices` holds the
+            snapshot prices the conversion needs, aged as of now: older than
+            CRYPTO_CACHE_DURATION they carry "cache_age", past CRYPTO_CACHE_MAX_STALENESS
+            they count as missing. `missing_symbols` are the ones to fetch. `memo_key`
+            is None when the answer must not be memoized.
+        """
+        if to_currency is None:
+            symbols, rate_pairs, needs_fx = list(CRYPTO_SYMBOLS), [], True
+        else:
+            symbols, rate_pairs = required_lookups(from_currency, to_currency)
+            needs_fx = bool(rate_pairs)
+        snapshot = self.price_refresher.snapshot()
+        prices, has_stale = {}, False
+        now = self.clock()
+        for symbol in symbols:
+            price_data, quoted_at = snapshot.prices.get(symbol), snapshot.quoted_at.get(symbol)
+            if not price_data or quoted_at is None:
+                continue
+            # The snapshot may be up to a refresher tick old; age its prices now
+            age = timedelta(seconds=now - quoted_at)
+            if age >= crypto_api.CRYPTO_CACHE_MAX_STALENESS:
+                continue
+            if age >= crypto_api.CRYPTO_CACHE_DURATION:
+                price_data, has_stale = crypto_api.mark_stale(price_data, age), True
+            prices[symbol] = price_data
+        missing_symbols = [symbol for symbol in symbols if symbol not in prices]
+
+        # Fiat rates are only memoizable while the FX table serves them without a refresh
+        fx_table = crypto_api.fx_rate_table
+        fx_version = None
+        if needs_fx:
+            fx_version = fx_table.fetched_at if crypto_api.fx_table_is_fresh(fx_table) else False
+
+        # Stale answers carry their age in the description, so they are not memoized
+        memo_key = None
+        if not missing_symbols and not has_stale and fx_version is not False:
+            memo_key = (amount, from_currency, to_currency, snapshot.version if symbols else None, fx_version)
+        return memo_key, prices, missing_symbols, rate_pairs
+
+    def lookup(self, memo_key):
+        """Returns the memoized answer for a key from prepare(), or None."""
+        if memo_key is None:
+            return None
+        with self._lock:
+            answer = self._memo.get(memo_key)
+            if answer is not None:
+                self._memo.move_to_end(memo_key)
+            return answer
+
+    def remember(self, memo_key, answer):
+        """Memoizes an answer, evicting the least recently used ones beyond memo_size."""
+        if memo_key is None:
+            return
+        with self._lock:
+            self._memo[memo_key] = answer
+            self._memo.move_to_end(memo_key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
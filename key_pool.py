@@ -0,0 +1,220 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+import metrics
+
+
+class _KeyState:
+    """Per-key bookkeeping for ApiKeyPool."""
+
+    __slots__ = ("tokens", "refilled_at", "cooldown_until", "cooldown_reason", "in_flight",
+                 "credits_total", "credits_today", "ledger_day", "requests_total", "rejections_total")
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.refilled_at = now
+        self.cooldown_until = 0.0
+        self.cooldown_reason = None
+        self.in_flight = 0
+        self.credits_total = 0
+        self.credits_today = 0
+        self.ledger_day = datetime.now(timezone.utc).date()
+        self.requests_total = 0
+        self.rejections_total = 0
+
+
+class ApiKeyPool:
+    """
+    Schedules requests across a set of API keys without ever sleeping.
+
+    Every key has a token bucket refilled at `calls_per_minute`, an optional
+    cooldown (set after 429 or quota errors) and a credit ledger. `acquire()`
+    picks the least loaded key that is usable right now, or returns None
+    immediately when every key is exhausted, so callers can fail fast or
+    retry after `next_available_in()` seconds.
+
+    With `shared_state` set (see SharedState), a key must also have a token in
+    its shared bucket, and cooldowns are published there, so every process
+    using the same keys stays within the per-key limits together.
+
+    `clock` is the monotonic time source for the buckets and cooldowns (tests
+    pass their own).
+    """
+
+    def __init__(self, name, keys, calls_per_minute, burst=None, clock=time.monotonic):
+        self.name = name
+        self.keys = list(keys)
+        self.rate_per_second = calls_per_minute / 60.0
+        self.burst = burst if burst is not None else max(1, calls_per_minute // 4)
+        self.last_used_index = 0
+        self.shared_state = None
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        now = clock()
+        self._states = [_KeyState(self.burst, now) for _ in self.keys]
+
+    def _refill(self, state, now):
+        state.tokens = min(self.burst, state.tokens + (now - state.refilled_at) * self.rate_per_second)
+        state.refilled_at = now
+
+    def acquire(self, idle_only=False):
+        """
+        Reserves one request on the least loaded usable key.
+
+        Keys are ranked by requests in flight, then by credits spent today. The key
+        is reserved under the pool's lock; its shared token (see `shared_state`) is
+        taken after releasing it, and if that bucket is empty the reservation is
+        undone and the next key is tried.
+
+        Args:
+            idle_only (bool): Only consider keys with no request in flight, e.g. for a
+                hedged request that must not share a key with the one it races.
+
+        Returns:
+            int: The index of the key to use, or None if no key can be used right now.
+        """
+        tried = set()
+        while True:
+            index = self._reserve(tried, idle_only)
+            if index is None:
+                metrics.RATE_LIMIT_EVENTS.inc(self.name, "no key available")
+                return None
+            if self._take_shared_token(index):
+                return index
+            with self._lock:
+                state = self._states[index]
+                state.tokens = min(self.burst, state.tokens + 1)
+                state.in_flight = max(0, state.in_flight - 1)
+                state.requests_total -= 1
+            tried.add(index)
+
+    def _reserve(self, excluded, idle_only=False):
+        """Takes a local token and an in-flight slot on the best usable key not in `excluded`; returns its index."""
+        now = self.clock()
+        with self._lock:
+            best = None
+            for index, state in enumerate(self._states):
+                if index in excluded or state.cooldown_until > now or (idle_only and state.in_flight):
+                    continue
+                self._refill(state, now)
+                if state.tokens < 1:
+                    continue
+                rank = (state.in_flight, state.credits_today, index)
+                if best is None or rank < best:
+                    best = rank
+            if best is None:
+                return None
+
+            index = best[2]
+            state = self._states[index]
+            state.tokens -= 1
+            state.in_flight += 1
+            state.requests_total += 1
+            self.last_used_index = index
+            return index
+
+    def _shared_bucket(self, index):
+        return f"{self.name}:{index}"
+
+    def _take_shared_token(self, index):
+        """Takes a token from the key's shared bucket; always succeeds without shared state."""
+        if self.shared_state is None:
+            return True
+        try:
+            return self.shared_state.take_token(self._shared_bucket(index), self.rate_per_second, self.burst)
+        except Exception as e:
+            print(f"Error using the shared {self.name} key state: {e}")
+            return True  # Fall back to the local bucket alone
+
+    def has_idle_key(self):
+        """Returns True if some key has no request in flight and could be acquired right now (locally)."""
+        now = self.clock()
+        with self._lock:
+            for state in self._states:
+                if state.in_flight or state.cooldown_until > now:
+                    continue
+                self._refill(state, now)
+                if state.tokens >= 1:
+                    return True
+            return False
+
+    def next_available_in(self):
+        """Returns how many seconds until some key can be acquired again (0 if one is available now)."""
+        now = self.clock()
+        with self._lock:
+            waits = []
+            for state in self._states:
+                self._refill(state, now)
+                token_wait = max(0.0, (1 - state.tokens) / self.rate_per_second) if self.rate_per_second else float("inf")
+                waits.append(max(state.cooldown_until - now, token_wait, 0.0))
+            return min(waits) if waits else float("inf")
+
+    def release(self, index, credits=0):
+        """
+        Marks a request on the key as finished and books the credits it used.
+
+        Args:
+            index (int): The key index returned by acquire().
+            credits (int): Upstream credits charged for the request.
+        """
+        with self._lock:
+            state = self._states[index]
+            state.in_flight = max(0, state.in_flight - 1)
+            today = datetime.now(timezone.utc).date()
+            if state.ledger_day != today:
+                state.ledger_day = today
+                state.credits_today = 0
+            state.credits_total += credits
+            state.credits_today += credits
+
+    def cooldown(self, index, seconds, reason):
+        """
+        Releases the key and keeps it out of rotation for the given number of seconds.
+
+        Args:
+            index (int): The key index returned by acquire().
+            seconds (float): How long the key must not be used.
+            reason (str): Short description shown in status(), e.g. "rate limited".
+        """
+        with self._lock:
+            state = self._states[index]
+            state.in_flight = max(0, state.in_flight - 1)
+            state.cooldown_until = max(state.cooldown_until, self.clock() + seconds)
+            state.cooldown_reason = reason
+            state.rejections_total += 1
+        if self.shared_state is not None:
+            try:
+                self.shared_state.set_cooldown(self._shared_bucket(index), seconds, reason)
+            except Exception as e:
+                print(f"Error using the shared {self.name} key state: {e}")
+        metrics.RATE_LIMIT_EVENTS.inc(self.name, reason)
+        print(f"{self.name} API key #{index + 1} {reason}; cooling down for {seconds:.0f} seconds.")
+
+    def status(self):
+        """
+        Returns a snapshot of every key's live state.
+
+        Returns:
+            list: One dict per key with its index, available tokens, cooldown
+            remaining (seconds), in-flight requests and credit ledger.
+        """
+        now = self.clock()
+        with self._lock:
+            snapshot = []
+            for index, state in enumerate(self._states):
+                self._refill(state, now)
+                cooling = state.cooldown_until > now
+                snapshot.append({
+                    "index": index,
+                    "tokens": state.tokens,
+                    "cooldown_remaining": state.cooldown_until - now if cooling else 0.0,
+                    "cooldown_reason": state.cooldown_reason if cooling else None,
+                    "in_flight": state.in_flight,
+                    "credits_today": state.credits_today,
+                    "credits_total": state.credits_total,
+                    "requests_total": state.requests_total,
+                    "rejections_total": state.rejections_total,
+                })
+            return snapshot
@@ -0,0 +1,274 @@
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-process counters and latency histograms, exposed in the Prometheus text format.
+# Recording is a dict update under a per-metric lock, so it is cheap enough for hot paths.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+class Counter:
+    """A monotonically increasing count per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        """Adds `amount` to the series identified by the label values (in labelnames order)."""
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        """Returns (suffix, labels, value) tuples for the exposition format."""
+        with self._lock:
+            values = dict(self._values)
+        return [("", dict(zip(self.labelnames, labelvalues)), value) for labelvalues, value in values.items()]
+
+
+class Histogram:
+    """Observations bucketed by upper bound, with a running sum and count per label combination."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        """Records one observation (in seconds, for latencies)."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                series = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labelvalues):
+        """Context manager that observes the duration of its block."""
+        return _Timer(self, labelvalues)
+
+    def samples(self):
+        with self._lock:
+            values = {labelvalues: list(series) for labelvalues, series in self._values.items()}
+        samples = []
+        for labelvalues, series in values.items():
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                samples.append(("_bucket", {**labels, "le": _format_bound(bound)}, cumulative))
+            samples.append(("_sum", labels, series[-1]))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+    def quantile(self, q, *labelvalues):
+        """Estimates a quantile from the buckets (upper bound of the bucket it falls in)."""
+        with self._lock:
+            series = list(self._values.get(labelvalues, ()))
+        total = sum(series[:-1])
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+
+class Gauge:
+    """A value per label combination that can go up and down, or is read from a function at collection time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def set_function(self, function):
+        """Reads the values from function() -> {label values tuple: value} instead of set()."""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            values = self._function()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [("", dict(zip(self.labelnames, labelvalues)), value) for labelvalues, value in values.items()]
+
+
+class _Timer:
+    __slots__ = ("histogram", "labelvalues", "started")
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labelvalues)
+        return False
+
+
+def counter(name, documentation, labelnames=()):
+    """Creates and registers a Counter."""
+    metric = Counter(name, documentation, labelnames)
+    _registry.append(metric)
+    return metric
+
+def gauge(name, documentation, labelnames=()):
+    """Creates and registers a Gauge."""
+    metric = Gauge(name, documentation, labelnames)
+    _registry.append(metric)
+    return metric
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Creates and registers a Histogram."""
+    metric = Histogram(name, documentation, labelnames, buckets)
+    _registry.append(metric)
+    return metric
+
+# Upstream APIs: upstream is "cmc", "exchange_rate" or "dexscreener"; key is the
+# 1-based key number ("-" for keyless APIs); status is the HTTP status or "error".
+UPSTREAM_REQUESTS = counter("cryptoteller_upstream_requests_total", "Upstream API requests.", ("upstream", "status", "key"))
+UPSTREAM_LATENCY = histogram("cryptoteller_upstream_request_seconds", "Upstream API request latency.", ("upstream",))
+UPSTREAM_RETRIES = counter("cryptoteller_upstream_retries_total", "Upstream requests retried after an error.", ("upstream",))
+UPSTREAM_HEDGES = counter("cryptoteller_upstream_hedges_total", "Second requests sent because the first was slow.", ("upstream",))
+CIRCUIT_TRANSITIONS = counter("cryptoteller_circuit_transitions_total", "Circuit breaker state changes.", ("upstream", "state"))
+RATE_LIMIT_EVENTS = counter("cryptoteller_rate_limit_events_total", "API keys taken out of rotation, or no key free.", ("pool", "reason"))
+
+# Caches: result is "hit", "stale" (served while revalidating), "expired" or "miss"
+CACHE_LOOKUPS = counter("cryptoteller_cache_lookups_total", "Cache lookups by result.", ("cache", "result"))
+# Cache memory (see bounded_cache.py): reason is "lru" (over budget) or "expired" (past retention)
+CACHE_EVICTIONS = counter("cryptoteller_cache_evictions_total", "Cache entries evicted.", ("cache", "reason"))
+CACHE_ENTRIES = gauge("cryptoteller_cache_entries", "Entries held per cache.", ("cache",))
+CACHE_BYTES = gauge("cryptoteller_cache_bytes", "Estimated memory held per cache.", ("cache",))
+
+# Outgoing Telegram calls (see telegram_outbox.py): status is "ok", the Bot API error
+# code or "error"; coalesced calls were merged into or dropped for a later one
+TELEGRAM_CALLS = counter("cryptoteller_telegram_calls_total", "Bot API calls sent from the outbox.", ("method", "status"))
+TELEGRAM_COALESCED = counter("cryptoteller_telegram_coalesced_total", "Queued Bot API calls coalesced away.", ("reason",))
+
+# Bot handlers: "crypto", "pagination", "inline" and "contract_address"
+HANDLER_LATENCY = histogram("cryptoteller_handler_seconds", "Time spent handling an update.", ("handler",))
+
+# Startup (see startup.py): phase is e.g. "persistent_cache", "warm_up:fx_table" or "ready" (the total)
+STARTUP_PHASE_SECONDS = histogram("cryptoteller_startup_phase_seconds", "Duration of each startup phase.", ("phase",),
+                                  buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+
+def observe_upstream(upstream, status, key_index, started):
+    """Records an upstream response (or transport error) that was sent at perf_counter `started`."""
+    UPSTREAM_REQUESTS.inc(upstream, str(status), str(key_index + 1) if key_index is not None else "-")
+    UPSTREAM_LATENCY.observe(time.perf_counter() - started, upstream)
+
+def timed_handler(handler_name):
+    """Decorator recording a bot handler's latency; works for plain and async handlers."""
+    def decorator(handler):
+        if inspect.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def async_wrapper(*args, **kwargs):
+                with HANDLER_LATENCY.time(handler_name):
+                    return await handler(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            with HANDLER_LATENCY.time(handler_name):
+                return handler(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def render():
+    """Renders every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples():
+            label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+            lines.append(f"{metric.name}{suffix}{{{label_text}}} {value}" if label_text else f"{metric.name}{suffix} {value}")
+    return "\n".join(lines) + "\n"
+
+def format_summary():
+    """Formats a compact plain-text digest of all metrics for the /metrics bot command."""
+    lines = []
+    for metric in _registry:
+        lines.append(metric.name.replace("cryptoteller_", ""))
+        if metric.kind in ("counter", "gauge"):
+            for _, labels, value in sorted(metric.samples(), key=lambda sample: -sample[2]):
+                lines.append(f"  {' '.join(labels.values())}: {value}")
+        else:
+            with metric._lock:
+                series = {labelvalues: (sum(values[:-1]), values[-1]) for labelvalues, values in metric._values.items()}
+            for labelvalues, (count, total) in series.items():
+                p50, p99 = metric.quantile(0.5, *labelvalues), metric.quantile(0.99, *labelvalues)
+                lines.append(f"  {' '.join(labelvalues)}: n={count} avg={total / count * 1000:.0f}ms "
+                             f"p50<={_format_bound(p50)}s p99<={_format_bound(p99)}s")
+    return "\n".join(lines)
+
+def start_http_server(port, host="127.0.0.1"):
+    """
+    Serves GET /metrics in the Prometheus text format on a daemon thread.
+
+    Binds to localhost by default so the endpoint is only reachable from the host.
+
+    Returns:
+        ThreadingHTTPServer: The running server (call shutdown() to stop it).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would otherwise print a line every few seconds
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,130 @@
+import json
+import sqlite3
+import threading
+import time
+
+from constants import PERSISTENT_CACHE_FLUSH_INTERVAL
+
+
+class PersistentCache:
+    """
+    On-disk write-behind store for the in-memory caches, backed by SQLite.
+
+    `put()` only records the entry in a pending dict, so the hot path never
+    touches the disk. A background thread flushes pending entries in one
+    transaction every `flush_interval` seconds; repeated writes of the same
+    key between flushes collapse into one row update. Entries keep their
+    original timestamps so TTLs still apply after a restart.
+    """
+
+    def __init__(self, path, flush_interval=PERSISTENT_CACHE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " stored_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+        connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def put(self, namespace, key, value, stored_at):
+        """
+        Queues an entry for the next flush.
+
+        Args:
+            namespace (str): Cache name, e.g. "crypto_price".
+            key (str): Entry key within the namespace.
+            value: Any JSON-serialisable value.
+            stored_at (float): Unix timestamp the value was fetched at.
+        """
+        with self._lock:
+            self._pending[(namespace, key)] = (value, stored_at)
+
+    def load(self, namespace, max_age=None):
+        """
+        Reads all entries of a namespace.
+
+        Args:
+            namespace (str): Cache name to load.
+            max_age (float): If given, skip entries older than this many seconds.
+
+        Returns:
+            list: (key, value, stored_at) tuples.
+        """
+        min_stored_at = time.time() - max_age if max_age is not None else float("-inf")
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT key, value, stored_at FROM cache_entries WHERE namespace = ? AND stored_at >= ?",
+                (namespace, min_stored_at)
+            ).fetchall()
+        finally:
+            connection.close()
+        return [(key, json.loads(value), stored_at) for key, value, stored_at in rows]
+
+    def flush(self):
+        """Writes all pending entries to disk in a single transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        rows = [(namespace, key, json.dumps(value), stored_at)
+                for (namespace, key), (value, stored_at) in pending.items()]
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, stored_at) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+        finally:
+            connection.close()
+
+    def prune(self, namespace, max_age):
+        """Deletes entries of a namespace older than max_age seconds."""
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND stored_at < ?",
+                    (namespace, time.time() - max_age)
+                )
+        finally:
+            connection.close()
+
+    def start(self):
+        """Starts the background flush thread (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="persistent-cache", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops the flush thread and writes whatever is still pending."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Error flushing persistent cache: {e}")
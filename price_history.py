@@ -0,0 +1,142 @@
+import threading
+
+import numpy as np
+
+from constants import PRICE_HISTORY_CAPACITY, PRICE_HISTORY_MIN_SPACING, PRICE_SPARKLINE_WIDTH
+
+SPARKLINE_BARS = "▁▂▃▄▅▆▇█"
+
+
+class _Series:
+    """Fixed-capacity ring buffers for one symbol; `end` is where the next sample goes."""
+
+    __slots__ = ("times", "prices", "volumes", "end", "count")
+
+    def __init__(self, capacity):
+        self.times = np.zeros(capacity)
+        self.prices = np.zeros(capacity)
+        self.volumes = np.zeros(capacity)
+        self.end = 0
+        self.count = 0
+
+
+class PriceHistory:
+    """
+    In-process price history, kept as columnar NumPy ring buffers per symbol.
+
+    Every quote fetched from CoinMarketCap is appended as (unix time, price,
+    24h volume). Each symbol costs a fixed 3 * 8 * `capacity` bytes (about 35 KB
+    at the default 1440 samples, a day at one-minute refreshes); the oldest
+    samples are overwritten once it is full. Quotes arriving within `min_spacing`
+    seconds of the previous one replace it, so bursts of on-demand fetches don't
+    crowd out older history. All queries are answered from the buffers without
+    upstream calls.
+    """
+
+    def __init__(self, capacity=PRICE_HISTORY_CAPACITY, min_spacing=PRICE_HISTORY_MIN_SPACING):
+        self.capacity = capacity
+        self.min_spacing = min_spacing
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def append(self, symbol, timestamp, price, volume_24h=0.0):
+        """Records one quote; samples older than the symbol's latest are ignored."""
+        with self._lock:
+            series = self._series.get(symbol)
+            if series is None:
+                series = self._series[symbol] = _Series(self.capacity)
+            if series.count:
+                last = (series.end - 1) % self.capacity
+                if timestamp < series.times[last]:
+                    return
+                if timestamp - series.times[last] < self.min_spacing:
+                    series.end, series.count = last, series.count - 1
+            series.times[series.end] = timestamp
+            series.prices[series.end] = price
+            series.volumes[series.end] = volume_24h or 0.0
+            series.end = (series.end + 1) % self.capacity
+            series.count = min(series.count + 1, self.capacity)
+
+    def window(self, symbol, since=None):
+        """
+        Returns the samples of a symbol at or after `since` (unix time), oldest first.
+
+        Returns:
+            tuple: (times, prices, volumes) NumPy arrays; empty if there is no history.
+        """
+        with self._lock:
+            series = self._series.get(symbol)
+            if series is None or not series.count:
+                return np.empty(0), np.empty(0), np.empty(0)
+            order = (series.end - series.count + np.arange(series.count)) % self.capacity
+            times, prices, volumes = series.times[order], series.prices[order], series.volumes[order]
+        if since is not None:
+            start = np.searchsorted(times, since)
+            times, prices, volumes = times[start:], prices[start:], volumes[start:]
+        return times, prices, volumes
+
+    def change_since(self, symbol, since):
+        """
+        Returns the percent change from the price at `since` (unix time) to the latest.
+
+        The reference is the last sample at or before `since`, or the first one after
+        it if the history is shorter than that.
+
+        Returns:
+            float: The change in percent, or None with fewer than two samples.
+        """
+        times, prices, _ = self.window(symbol)
+        if len(prices) < 2:
+            return None
+        reference = max(0, np.searchsorted(times, since, side="right") - 1)
+        if reference == len(prices) - 1 or not prices[reference]:
+            return None
+        return float((prices[-1] / prices[reference] - 1) * 100)
+
+    def stats(self, symbol, since):
+        """
+        Summarises the samples since `since` (unix time).
+
+        The VWAP weights each price by the volume traded until the next sample,
+        estimated from CoinMarketCap's rolling 24h volume; with no volume data it
+        falls back to a time-weighted average.
+
+        Returns:
+            dict: "min", "max", "vwap", "first", "last" and "samples", or None if empty.
+        """
+        times, prices, volumes = self.window(symbol, since)
+        if not len(prices):
+            return None
+        if len(prices) > 1:
+            durations = np.diff(times, append=times[-1] + np.median(np.diff(times)))
+            weights = durations * volumes if volumes.any() else durations
+            vwap = float(np.average(prices, weights=weights)) if weights.sum() else float(prices.mean())
+        else:
+            vwap = float(prices[0])
+        return {"min": float(prices.min()), "max": float(prices.max()), "vwap": vwap,
+                "first": float(prices[0]), "last": float(prices[-1]), "samples": len(prices)}
+
+    def sparkline(self, symbol, since, width=PRICE_SPARKLINE_WIDTH):
+        """
+        Renders the prices since `since` as a sparkline of up to `width` bars.
+
+        Samples are bucketed into `width` equal time slots and each bar shows the
+        last price in its slot; empty slots repeat the previous bar.
+
+        Returns:
+            str: The sparkline, or "" with fewer than two samples.
+        """
+        times, prices, _ = self.window(symbol, since)
+        if len(prices) < 2:
+            return ""
+        width = min(width, len(prices))
+        slots = np.minimum(((times - times[0]) / (times[-1] - times[0] or 1) * width).astype(int), width - 1)
+        # Slots are sorted, so this is the last sample in each slot (or in the slot before an empty one)
+        points = prices[np.searchsorted(slots, np.arange(width), side="right") - 1]
+
+        low, high = points.min(), points.max()
+        if high == low:
+            return SPARKLINE_BARS[len(SPARKLINE_BARS) // 2] * width
+        levels = ((points - low) / (high - low) * (len(SPARKLINE_BARS) - 1)).round().astype(int)
+        return "".join(SPARKLINE_BARS[level] for level in levels)
@@ -0,0 +1,271 @@
+import math
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta, timezone
+
+import crypto_api
+from constants import (
+    PRICE_REFRESH_MIN_INTERVAL, PRICE_REFRESH_MAX_INTERVAL, PRICE_REFRESH_TICK,
+    PRICE_DEMAND_HALF_LIFE, CMC_CREDIT_BUDGET_PER_HOUR, CMC_SYMBOLS_PER_CREDIT, FX_TABLE_REFRESH_AHEAD
+)
+from crypto_api import (
+    get_crypto_prices, get_fx_table, mark_stale, quote_credits, CRYPTO_CACHE_DURATION, CRYPTO_CACHE_MAX_STALENESS,
+    EXCHANGE_RATE_CACHE_DURATION
+)
+
+# Immutable view of the latest prices. `prices` must never be mutated in place;
+# every refresh publishes a new snapshot with a bumped version. `quoted_at` holds
+# the unix time each symbol's price was fetched at: prices older than
+# CRYPTO_CACHE_DURATION carry their age under "cache_age" (see mark_stale), and
+# those past CRYPTO_CACHE_MAX_STALENESS are None.
+PriceSnapshot = namedtuple("PriceSnapshot", ["version", "prices", "fetched_at", "quoted_at"])
+
+
+class PriceRefresher:
+    """
+    Keeps a warm snapshot of CoinMarketCap prices for a fixed set of symbols.
+
+    A background thread refreshes symbols on an interval that adapts to demand:
+    symbols that are requested often are refreshed every `min_interval` seconds,
+    idle ones drift towards `max_interval`. All refreshes are charged against an
+    hourly CMC credit budget, so a burst of demand can never exceed the quota.
+
+    The same thread also renews the fiat cross-rate table FX_TABLE_REFRESH_AHEAD
+    seconds before it expires, so conversions never wait on ExchangeRate-API either.
+
+    A symbol whose refresh fails keeps its previous price, marked with its age,
+    until that price passes CRYPTO_CACHE_MAX_STALENESS; then it is dropped, so
+    pages show "Data not available" rather than an hours-old price.
+
+    `clock` returns unix time, for the fetch times of the quotes and their age.
+    """
+
+    def __init__(self, symbols, min_interval=PRICE_REFRESH_MIN_INTERVAL, max_interval=PRICE_REFRESH_MAX_INTERVAL,
+                 credit_budget_per_hour=CMC_CREDIT_BUDGET_PER_HOUR, tick=PRICE_REFRESH_TICK,
+                 demand_half_life=PRICE_DEMAND_HALF_LIFE, clock=time.time):
+        self.symbols = list(dict.fromkeys(symbols))
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.credit_budget_per_hour = credit_budget_per_hour
+        self.tick = tick
+        self.demand_half_life = demand_half_life
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self._snapshot = PriceSnapshot(0, {}, None, {})
+        self._listeners = []
+        self._last_refreshed = {symbol: -math.inf for symbol in self.symbols}
+        self._demand = {symbol: (0.0, time.monotonic()) for symbol in self.symbols}
+        self._spent_credits = deque()  # (monotonic timestamp, credits)
+        self._fx_attempted_at = -math.inf
+
+    def start(self):
+        """Starts the background refresh thread (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="price-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Signals the background thread to stop and waits for it."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def add_listener(self, listener):
+        """Calls listener(snapshot) on the refresh thread after every refresh; it must return quickly."""
+        self._listeners.append(listener)
+
+    def snapshot(self):
+        """Returns the latest published PriceSnapshot without touching the network."""
+        return self._snapshot
+
+    def record_demand(self, symbols):
+        """
+        Registers that the given symbols were just requested by a user.
+
+        Args:
+            symbols (list): Symbols that were displayed or converted.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for symbol in symbols:
+                if symbol in self._demand:
+                    self._demand[symbol] = (self._decayed_demand(symbol, now) + 1.0, now)
+
+    def refresh_interval(self, symbol):
+        """
+        Returns the current target refresh interval for a symbol in seconds.
+
+        The interval moves from `max_interval` towards `min_interval` as the
+        symbol's decayed request count grows.
+        """
+        with self._lock:
+            demand = self._decayed_demand(symbol, time.monotonic())
+        heat = demand / (demand + 1.0)
+        interval = self.max_interval - (self.max_interval - self.min_interval) * heat
+        # Never schedule faster than the credit budget could sustain on its own.
+        if self.credit_budget_per_hour > 0:
+            interval = max(interval, 3600.0 / self.credit_budget_per_hour)
+        return interval
+
+    def restore(self, cached_prices):
+        """
+        Seeds the snapshot from previously fetched quotes, e.g. reloaded from disk.
+
+        Restored symbols are scheduled as if they had been refreshed at their
+        original fetch time, so fresh ones are not fetched again right away.
+
+        Args:
+            cached_prices (dict): (price_data, fetched_at datetime) keyed by symbol.
+        """
+        with self._refresh_lock:
+            offset = time.monotonic() - self.clock()
+            merged = dict(self._snapshot.prices)
+            quoted_at = dict(self._snapshot.quoted_at)
+            for symbol, (price_data, fetch_time) in cached_prices.items():
+                if symbol in self._last_refreshed and price_data is not None:
+                    merged[symbol] = price_data
+                    quoted_at[symbol] = fetch_time.timestamp()
+                    self._last_refreshed[symbol] = fetch_time.timestamp() + offset
+            if quoted_at != self._snapshot.quoted_at:
+                self._publish(merged, quoted_at, min(quoted_at.values()), notify=False)
+
+    def refresh_now(self, symbols=None):
+        """
+        Synchronously refreshes the given symbols (all configured symbols by default).
+
+        Used for the initial fill when no snapshot has been published yet. Still
+        charged against the credit budget, but never refused by it.
+
+        Returns:
+            PriceSnapshot: The newly published snapshot.
+        """
+        self._refresh(list(symbols) if symbols else self.symbols)
+        return self._snapshot
+
+    def _decayed_demand(self, symbol, now):
+        score, updated_at = self._demand[symbol]
+        return score * 0.5 ** ((now - updated_at) / self.demand_half_life)
+
+    def _credits_spent_last_hour(self, now):
+        while self._spent_credits and now - self._spent_credits[0][0] >= 3600:
+            self._spent_credits.popleft()
+        return sum(credits for _, credits in self._spent_credits)
+
+    def _due_symbols(self, now):
+        """Returns symbols that are due, padded with nearly-due ones that ride along for free."""
+        due, nearly_due = [], []
+        for symbol in self.symbols:
+            interval = self.refresh_interval(symbol)
+            elapsed = now - self._last_refreshed[symbol]
+            if elapsed >= interval:
+                due.append(symbol)
+            elif elapsed >= interval / 2:
+                nearly_due.append((elapsed / interval, symbol))
+        if not due:
+            return []
+
+        # CMC charges per started block of symbols, so fill the last block up.
+        capacity = math.ceil(len(due) / CMC_SYMBOLS_PER_CREDIT) * CMC_SYMBOLS_PER_CREDIT
+        nearly_due.sort(reverse=True)
+        due.extend(symbol for _, symbol in nearly_due[:capacity - len(due)])
+        return due
+
+    def _refresh(self, symbols):
+        with self._refresh_lock:
+            started = time.monotonic()
+            # Booked per quotes request: symbols requested by ID and by symbol go out separately
+            credits = quote_credits(symbols)
+            prices = get_crypto_prices(symbols, use_cache=False)
+            self._spent_credits.append((started, credits))
+
+            # Failed symbols keep their previous price (aged by _publish) and are retried
+            # on their next interval rather than on every tick, which would drain the budget.
+            now = self.clock()
+            merged = dict(self._snapshot.prices)
+            quoted_at = dict(self._snapshot.quoted_at)
+            for symbol in symbols:
+                self._last_refreshed[symbol] = started
+                if prices.get(symbol) is not None:
+                    merged[symbol] = prices[symbol]
+                    quoted_at[symbol] = now
+            self._publish(merged, quoted_at, now)
+
+    def _publish(self, prices, quoted_at, fetched_at, notify=True):
+        """Ages the prices, publishes them as the next snapshot and notifies the listeners (refresh lock held)."""
+        now = self.clock()
+        for symbol, quote_time in quoted_at.items():
+            age = now - quote_time
+            if prices.get(symbol) is None or age < CRYPTO_CACHE_DURATION.total_seconds():
+                continue
+            if age >= CRYPTO_CACHE_MAX_STALENESS.total_seconds():
+                prices[symbol] = None
+            else:
+                prices[symbol] = mark_stale(prices[symbol], timedelta(seconds=age))
+        self._snapshot = PriceSnapshot(self._snapshot.version + 1, prices, fetched_at, quoted_at)
+        if not notify:
+            return
+        for listener in self._listeners:
+            try:
+                listener(self._snapshot)
+            except Exception as e:
+                print(f"Error in price snapshot listener: {e}")
+
+    def _expire_prices(self):
+        """
+        Republishes the snapshot when a price has become stale, passed the max
+        staleness, or its age has reached another whole minute since it was published.
+
+        The minute steps keep the "Prices from N min ago" note on /crypto pages current.
+        """
+        with self._refresh_lock:
+            now = self.clock()
+            snapshot = self._snapshot
+            for symbol, quote_time in snapshot.quoted_at.items():
+                price_data = snapshot.prices.get(symbol)
+                if price_data is None:
+                    continue
+                age = now - quote_time
+                if age >= CRYPTO_CACHE_MAX_STALENESS.total_seconds():
+                    break
+                if age < CRYPTO_CACHE_DURATION.total_seconds():
+                    continue
+                if "cache_age" not in price_data or age // 60 != price_data["cache_age"] // 60:
+                    break
+            else:
+                return
+            self._publish(dict(snapshot.prices), dict(snapshot.quoted_at), snapshot.fetched_at)
+
+    def _renew_fx_table(self):
+        """Refetches the FX table once it is within FX_TABLE_REFRESH_AHEAD seconds of expiring."""
+        table = crypto_api.fx_rate_table
+        renew_after = EXCHANGE_RATE_CACHE_DURATION.total_seconds() - FX_TABLE_REFRESH_AHEAD
+        if table is not None and (datetime.now(timezone.utc) - table.fetched_at).total_seconds() < renew_after:
+            return
+        # A failed renewal is retried every min_interval, not on every tick
+        now = time.monotonic()
+        if now - self._fx_attempted_at < self.min_interval:
+            return
+        self._fx_attempted_at = now
+        get_fx_table(use_cache=False)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                now = time.monotonic()
+                symbols = self._due_symbols(now)
+                if symbols:
+                    if self._credits_spent_last_hour(now) + quote_credits(symbols) <= self.credit_budget_per_hour:
+                        self._refresh(symbols)
+                self._expire_prices()
+                self._renew_fx_table()
+            except Exception as e:
+                print(f"Error in background price refresh: {e}")
+            self._stop_event.wait(self.tick)
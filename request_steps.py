@@ -0,0 +1,93 @@
+import time
+from collections import namedtuple
+
+import requests
+
+import http_client
+
+# Upstream request logic written once for both execution modes. The key rotation,
+# retry and shared-state policies in crypto_api are generators that yield the I/O
+# they need as steps and are sent each step's result; run_steps() below drives them
+# with blocking calls, async_crypto_api.run_steps() with awaits.
+
+Send = namedtuple("Send", ["url", "params", "headers"])  # A GET request, answered with a Reply
+Sleep = namedtuple("Sleep", ["seconds"])  # Backoff or queueing; answered with None
+# function(*args), answered with its result; exceptions are thrown into the generator.
+# Blocking calls (SQLite) run in a worker thread in async mode; non-blocking ones may
+# return an awaitable there (e.g. the async fetch passed to crypto_api.shared_fetch_steps).
+Call = namedtuple("Call", ["function", "args", "blocking"], defaults=(True,))
+# status is the HTTP status, or "error" with `error` set for transport errors; body is
+# the decoded JSON object, or {} if the response was not one
+Reply = namedtuple("Reply", ["status", "headers", "body", "error"])
+
+
+def run_steps(steps):
+    """
+    Drives a step generator with blocking I/O.
+
+    Returns:
+        The generator's return value.
+    """
+    result, error = None, None
+    try:
+        while True:
+            try:
+                step = steps.throw(error) if error is not None else steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result, error = None, None
+            try:
+                if isinstance(step, Send):
+                    result = _send(step)
+                elif isinstance(step, Sleep):
+                    time.sleep(step.seconds)
+                else:
+                    result = step.function(*step.args)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+
+def _send(step):
+    # The policies retry themselves, so the HTTP client must not
+    try:
+        response = http_client.get(step.url, retries=0, params=step.params, headers=step.headers)
+    except requests.exceptions.RequestException as e:
+        return Reply("error", {}, {}, e)
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    return Reply(response.status_code, response.headers, body if isinstance(body, dict) else {}, None)
+
+def acquire_key(pool, queue_wait=0, idle_only=False):
+    """
+    Steps reserving a key from an ApiKeyPool (see ApiKeyPool.acquire for `idle_only`).
+
+    If every key is busy, waits for the next one to free up as long as the total
+    wait stays within `queue_wait` seconds (0 fails fast).
+
+    Returns:
+        int: The key index, or None if no key frees up in time.
+    """
+    waited = 0.0
+    while True:
+        if pool.shared_state is not None:
+            key_index = yield Call(pool.acquire, (idle_only,))
+        else:
+            key_index = pool.acquire(idle_only)
+        if key_index is not None:
+            return key_index
+        wait = max(pool.next_available_in(), 0.01)
+        if waited + wait > queue_wait:
+            print(f"All {pool.name} API keys are busy or cooling down (next in {pool.next_available_in():.0f}s).")
+            return None
+        yield Sleep(wait)
+        waited += wait
+
+def cool_down_key(pool, index, seconds, reason):
+    """Steps putting a key on cooldown (which publishes it to the shared state, if enabled)."""
+    if pool.shared_state is not None:
+        yield Call(pool.cooldown, (index, seconds, reason))
+    else:
+        pool.cooldown(index, seconds, reason)
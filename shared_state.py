@@ -0,0 +1,159 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+class SharedState:
+    """
+    Cache entries, leases and API key buckets shared by bot processes on one host.
+
+    Backed by a SQLite file in WAL mode, so any number of processes (e.g. several
+    webhook workers behind a load balancer) can use it without a separate server.
+    Every method is a short transaction; callers never hold one across a network
+    request. Another backend (say, Redis) only needs the same methods:
+
+    - get_many / put: cache entries as (value, stored_at) per namespace and key.
+    - try_lease / release_lease: expiring mutexes for cross-process single-flight.
+    - take_token / set_cooldown: token buckets and cooldowns for API keys.
+
+    For tests, point two instances at the same temporary file; `clock` (unix time)
+    can be replaced to expire leases and refill buckets without waiting.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self._local = threading.local()
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS shared_cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, stored_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS key_buckets ("
+                " name TEXT PRIMARY KEY, tokens REAL NOT NULL, refilled_at REAL NOT NULL,"
+                " cooldown_until REAL NOT NULL DEFAULT 0, cooldown_reason TEXT)"
+            )
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        return connection
+
+    def get_many(self, namespace, keys, max_age):
+        """
+        Reads the entries of `keys` stored within the last `max_age` seconds.
+
+        Returns:
+            dict: (value, stored_at unix timestamp) keyed by key; absent keys are omitted.
+        """
+        keys = list(keys)
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = self._connection().execute(
+            f"SELECT key, value, stored_at FROM shared_cache WHERE namespace = ? AND stored_at >= ? AND key IN ({placeholders})",
+            (namespace, self.clock() - max_age, *keys)
+        ).fetchall()
+        return {key: (json.loads(value), stored_at) for key, value, stored_at in rows}
+
+    def put(self, namespace, key, value, stored_at):
+        """Stores a JSON-serialisable value fetched at unix time `stored_at`, unless a newer one is stored."""
+        self._connection().execute(
+            "INSERT INTO shared_cache (namespace, key, value, stored_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, stored_at = excluded.stored_at"
+            " WHERE excluded.stored_at >= shared_cache.stored_at",
+            (namespace, key, json.dumps(value), stored_at)
+        )
+
+    def try_lease(self, name, ttl):
+        """
+        Takes the named lease for `ttl` seconds if it is free, expired or already ours.
+
+        Returns:
+            bool: True if this process now holds the lease.
+        """
+        now = self.clock()
+        connection = self._connection()
+        with _immediate(connection):
+            row = connection.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != self.owner and row[1] > now:
+                return False
+            connection.execute("INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                               (name, self.owner, now + ttl))
+            return True
+
+    def release_lease(self, name):
+        """Releases the named lease if this process holds it."""
+        self._connection().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.owner))
+
+    def take_token(self, bucket, rate_per_second, burst):
+        """
+        Takes one request token from a shared bucket refilled at `rate_per_second`.
+
+        Returns:
+            bool: False if the bucket is empty or cooling down.
+        """
+        now = self.clock()
+        connection = self._connection()
+        with _immediate(connection):
+            row = connection.execute(
+                "SELECT tokens, refilled_at, cooldown_until FROM key_buckets WHERE name = ?", (bucket,)
+            ).fetchone()
+            tokens, refilled_at, cooldown_until = row if row is not None else (float(burst), now, 0.0)
+            if cooldown_until > now:
+                return False
+            tokens = min(float(burst), tokens + (now - refilled_at) * rate_per_second)
+            if tokens < 1:
+                return False
+            connection.execute(
+                "INSERT INTO key_buckets (name, tokens, refilled_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET tokens = excluded.tokens, refilled_at = excluded.refilled_at",
+                (bucket, tokens - 1, now)
+            )
+            return True
+
+    def set_cooldown(self, bucket, seconds, reason):
+        """Keeps a shared bucket from handing out tokens for the given number of seconds."""
+        now = self.clock()
+        self._connection().execute(
+            "INSERT INTO key_buckets (name, tokens, refilled_at, cooldown_until, cooldown_reason) VALUES (?, 0, ?, ?, ?)"
+            " ON CONFLICT (name) DO UPDATE SET cooldown_until = max(cooldown_until, excluded.cooldown_until),"
+            " cooldown_reason = excluded.cooldown_reason",
+            (bucket, now, now + seconds, reason)
+        )
+
+    def close(self):
+        """Closes this thread's connection."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class _immediate:
+    """Runs a block in a BEGIN IMMEDIATE transaction, so read-modify-write is atomic across processes."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
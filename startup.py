@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import metrics
+from constants import STARTUP_WARM_DEADLINE
+
+
+class StartupPipeline:
+    """
+    Runs the bot's startup as timed phases, with a cache warm-up gating readiness.
+
+    Phases run in order through phase(); warm_up() runs its tasks in parallel and
+    returns once they have all finished or `warm_deadline` seconds have passed,
+    whichever comes first (stragglers finish in the background). Updates should
+    only be consumed after mark_ready(), so the first users after a deploy are
+    served from warm caches instead of paying for every upstream fetch in turn.
+    Each phase is printed and recorded in the startup histogram.
+    """
+
+    def __init__(self, warm_deadline=STARTUP_WARM_DEADLINE):
+        self.warm_deadline = warm_deadline
+        self.timings = {}  # Phase -> seconds, in the order they finished
+        self.ready = threading.Event()
+
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def phase(self, name):
+        """Context manager timing one startup phase."""
+        return _Phase(self, name)
+
+    def warm_up(self, tasks):
+        """
+        Runs warm-up tasks in parallel until they finish or the deadline passes.
+
+        Args:
+            tasks (dict): Callables keyed by name; exceptions are printed, not raised.
+
+        Returns:
+            list: Names of the tasks still running at the deadline.
+        """
+        started = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=max(1, len(tasks)), thread_name_prefix="warm-up")
+        futures = {executor.submit(self._run_task, name, task): name for name, task in tasks.items()}
+        _, not_done = wait(futures, timeout=self.warm_deadline)
+        executor.shutdown(wait=False)
+        self._record("warm_up", time.perf_counter() - started)
+
+        unfinished = [futures[future] for future in not_done]
+        if unfinished:
+            print(f"Warm-up deadline of {self.warm_deadline}s passed; still warming {', '.join(unfinished)} in the background.")
+        return unfinished
+
+    def mark_ready(self):
+        """Records the time to readiness, prints the timings and sets `ready`."""
+        self._record("ready", time.perf_counter() - self._started)
+        self.ready.set()
+        print("Startup: " + " | ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.timings.items()))
+
+    def _run_task(self, name, task):
+        started = time.perf_counter()
+        try:
+            task()
+        except Exception as e:
+            print(f"Warm-up of {name} failed: {e}")
+        self._record(f"warm_up:{name}", time.perf_counter() - started)
+
+    def _record(self, name, seconds):
+        with self._lock:
+            self.timings[name] = seconds
+        metrics.STARTUP_PHASE_SECONDS.observe(seconds, name)
+
+
+class _Phase:
+    __slots__ = ("pipeline", "name", "started")
+
+    def __init__(self, pipeline, name):
+        self.pipeline = pipeline
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.pipeline._record(self.name, time.perf_counter() - self.started)
+        return False
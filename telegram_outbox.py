@@ -0,0 +1,308 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+from telebot import apihelper, asyncio_helper
+
+import metrics
+from constants import (
+    TELEGRAM_SEND_WORKERS, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE, TELEGRAM_CHAT_BURST,
+    TELEGRAM_SEND_MAX_RETRIES, TELEGRAM_MAX_RETRY_AFTER
+)
+
+OUTBOX_PRUNE_INTERVAL = 60  # Seconds between sweeps of idle per-chat buckets
+
+# Bot API errors of TeleBot and AsyncTeleBot (separate classes with the same fields)
+TELEGRAM_API_ERRORS = (apihelper.ApiTelegramException, asyncio_helper.ApiTelegramException)
+
+
+class _Outgoing:
+    """One queued Bot API call."""
+
+    __slots__ = ("method", "args", "kwargs", "message_id", "replace_key", "on_sent", "attempts")
+
+    def __init__(self, method, args, kwargs, message_id=None, replace_key=None, on_sent=None):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.message_id = message_id  # Message an edit or delete targets
+        self.replace_key = replace_key
+        self.on_sent = on_sent
+        self.attempts = 0
+
+
+class _ChatLane:
+    """Pending calls and the flood-limit bucket of one chat."""
+
+    __slots__ = ("pending", "tokens", "refilled_at", "ready_at", "scheduled", "busy")
+
+    def __init__(self, burst, now):
+        self.pending = deque()
+        self.tokens = float(burst)
+        self.refilled_at = now
+        self.ready_at = now      # Not before this (monotonic), e.g. after a 429
+        self.scheduled = False   # In the ready heap
+        self.busy = False        # A call of this chat is in flight
+
+
+class TelegramOutbox:
+    """
+    Sends messages, edits and deletes on worker threads so handlers never wait on Telegram.
+
+    Calls are queued per chat and sent in order, at most one in flight per chat,
+    within Telegram's flood limits: a global token bucket (`global_rate` calls
+    per second) and one per chat (`chat_rate` for private chats, `group_rate`
+    for groups and channels, which have negative ids). A 429 puts the chat on
+    hold for the `retry_after` Telegram asks for and retries the call, up to
+    `max_retries` times.
+
+    Calls still waiting are coalesced:
+      - an edit of a message with an edit already queued replaces it, so only the
+        latest text is sent;
+      - a delete drops the queued edits of that message;
+      - a send with a `replace_key` supersedes a queued send of the chat with the
+        same key: the older message is never sent, so it never has to be deleted
+        either (e.g. a /crypto reply replaced before it went out).
+
+    Query answers (callback and inline) are not queued: they are not subject to the
+    flood limits and must reach Telegram within seconds.
+
+    `bot` is a TeleBot, or an AsyncBotBridge to send through an AsyncTeleBot; it
+    may be set after construction, but before start(). `clock` is the monotonic
+    time source for the flood limits and holds (tests pass their own).
+    """
+
+    def __init__(self, bot, workers=TELEGRAM_SEND_WORKERS, global_rate=TELEGRAM_GLOBAL_RATE,
+                 chat_rate=TELEGRAM_CHAT_RATE, group_rate=TELEGRAM_GROUP_RATE, chat_burst=TELEGRAM_CHAT_BURST,
+                 max_retries=TELEGRAM_SEND_MAX_RETRIES, max_retry_after=TELEGRAM_MAX_RETRY_AFTER,
+                 clock=time.monotonic):
+        self.bot = bot
+        self.workers = workers
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.clock = clock
+
+        self._condition = threading.Condition()
+        self._lanes = {}
+        self._ready = []  # Heap of (ready_at, seq, chat_id) for lanes with a call to send
+        self._sequence = itertools.count()
+        self._global_tokens = float(global_rate)
+        self._global_refilled_at = clock()
+        self._pruned_at = clock()
+        self._stopping = False
+        self._threads = []
+
+    def start(self):
+        """Starts the sender threads (idempotent)."""
+        with self._condition:
+            self._stopping = False
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for index in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._run, name=f"telegram-outbox-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Sends the calls still queued, then stops the sender threads."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+    def pending(self):
+        """Returns the number of calls queued or in flight."""
+        with self._condition:
+            return sum(len(lane.pending) + lane.busy for lane in self._lanes.values())
+
+    def send_message(self, chat_id, text, replace_key=None, on_sent=None, **kwargs):
+        """
+        Queues bot.send_message(chat_id, text, **kwargs).
+
+        Args:
+            replace_key (str): Supersede a queued, unsent message of the chat with the same key.
+            on_sent (callable): Called with the sent Message on a sender thread.
+        """
+        self._enqueue(chat_id, _Outgoing("send_message", (chat_id, text), kwargs,
+                                         replace_key=replace_key, on_sent=on_sent))
+
+    def reply_to(self, message, text, replace_key=None, on_sent=None, **kwargs):
+        """Queues bot.reply_to(message, text, **kwargs); see send_message()."""
+        self._enqueue(message.chat.id, _Outgoing("reply_to", (message, text), kwargs,
+                                                 replace_key=replace_key, on_sent=on_sent))
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        """Queues bot.edit_message_text(); a queued edit of the same message is replaced."""
+        kwargs.update(text=text, chat_id=chat_id, message_id=message_id)
+        self._enqueue(chat_id, _Outgoing("edit_message_text", (), kwargs, message_id=message_id))
+
+    def delete_message(self, chat_id, message_id):
+        """Queues bot.delete_message(); queued edits of the message are dropped."""
+        self._enqueue(chat_id, _Outgoing("delete_message", (chat_id, message_id), {}, message_id=message_id))
+
+    def _enqueue(self, chat_id, outgoing):
+        now = self.clock()
+        with self._condition:
+            lane = self._lanes.get(chat_id)
+            if lane is None:
+                lane = self._lanes[chat_id] = _ChatLane(self.chat_burst, now)
+            if not self._coalesce(lane, outgoing):
+                lane.pending.append(outgoing)
+            self._schedule(chat_id, lane)
+
+    def _coalesce(self, lane, outgoing):
+        """Merges a new call into the lane's queued ones; returns True if it was absorbed (lock held)."""
+        if outgoing.method == "edit_message_text":
+            for queued in lane.pending:
+                if queued.method == "edit_message_text" and queued.message_id == outgoing.message_id:
+                    queued.kwargs = outgoing.kwargs
+                    metrics.TELEGRAM_COALESCED.inc("edit")
+                    return True
+        elif outgoing.method == "delete_message":
+            kept = [queued for queued in lane.pending
+                    if not (queued.method == "edit_message_text" and queued.message_id == outgoing.message_id)]
+            if len(kept) != len(lane.pending):
+                metrics.TELEGRAM_COALESCED.inc("delete", amount=len(lane.pending) - len(kept))
+                lane.pending = deque(kept)
+        elif outgoing.replace_key is not None:
+            for index, queued in enumerate(lane.pending):
+                if queued.replace_key == outgoing.replace_key:
+                    lane.pending[index] = outgoing
+                    metrics.TELEGRAM_COALESCED.inc("replace")
+                    return True
+        return False
+
+    def _schedule(self, chat_id, lane):
+        """Puts a lane with queued calls into the ready heap (lock held)."""
+        if lane.pending and not lane.busy and not lane.scheduled:
+            lane.scheduled = True
+            heapq.heappush(self._ready, (lane.ready_at, next(self._sequence), chat_id))
+            self._condition.notify()
+
+    def _refill(self, lane, chat_id, now):
+        rate = self.group_rate if chat_id < 0 else self.chat_rate
+        lane.tokens = min(self.chat_burst, lane.tokens + (now - lane.refilled_at) * rate)
+        lane.refilled_at = now
+        return rate
+
+    def _next_call(self):
+        """Waits for a call that may be sent now and reserves its tokens; None once stopped and drained."""
+        with self._condition:
+            while True:
+                now = self.clock()
+                if now - self._pruned_at >= OUTBOX_PRUNE_INTERVAL:
+                    self._prune(now)
+                if not self._ready:
+                    if self._stopping and not any(lane.busy for lane in self._lanes.values()):
+                        return None
+                    self._condition.wait(None if not self._stopping else 0.1)
+                    continue
+
+                ready_at, _, chat_id = self._ready[0]
+                self._global_tokens = min(self.global_rate,
+                                          self._global_tokens + (now - self._global_refilled_at) * self.global_rate)
+                self._global_refilled_at = now
+                wait = max(ready_at - now, (1 - self._global_tokens) / self.global_rate)
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+                heapq.heappop(self._ready)
+                lane = self._lanes[chat_id]
+                lane.scheduled = False
+                rate = self._refill(lane, chat_id, now)
+                if lane.tokens < 1:
+                    lane.ready_at = now + (1 - lane.tokens) / rate
+                    self._schedule(chat_id, lane)
+                    continue
+
+                lane.tokens -= 1
+                self._global_tokens -= 1
+                lane.busy = True
+                return chat_id, lane, lane.pending.popleft()
+
+    def _prune(self, now):
+        """Forgets lanes that are idle with a full bucket (lock held)."""
+        idle = []
+        for chat_id, lane in self._lanes.items():
+            if not lane.pending and not lane.busy:
+                self._refill(lane, chat_id, now)
+                if lane.tokens >= self.chat_burst:
+                    idle.append(chat_id)
+        for chat_id in idle:
+            del self._lanes[chat_id]
+        self._pruned_at = now
+
+    def _run(self):
+        while True:
+            call = self._next_call()
+            if call is None:
+                return
+            chat_id, lane, outgoing = call
+            self._finish(chat_id, lane, outgoing, self._send(outgoing))
+
+    def _finish(self, chat_id, lane, outgoing, retry_after):
+        """Frees the lane after a call, putting the call back on hold if it is to be retried."""
+        with self._condition:
+            lane.busy = False
+            if retry_after is not None:
+                lane.pending.appendleft(outgoing)
+                lane.ready_at = self.clock() + retry_after
+            self._schedule(chat_id, lane)
+            if self._stopping:
+                self._condition.notify_all()
+
+    def _send(self, outgoing):
+        """Makes the call; returns the seconds to wait before retrying it, or None when done."""
+        try:
+            result = getattr(self.bot, outgoing.method)(*outgoing.args, **outgoing.kwargs)
+        except TELEGRAM_API_ERRORS as e:
+            outgoing.attempts += 1
+            if e.error_code == 429 and outgoing.attempts <= self.max_retries:
+                metrics.TELEGRAM_CALLS.inc(outgoing.method, "429")
+                retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+                return min(float(retry_after), self.max_retry_after)
+            metrics.TELEGRAM_CALLS.inc(outgoing.method, str(e.error_code))
+            print(f"Telegram {outgoing.method} failed: {e.description}")
+            return None
+        except Exception as e:
+            metrics.TELEGRAM_CALLS.inc(outgoing.method, "error")
+            print(f"Telegram {outgoing.method} failed: {e}")
+            return None
+
+        metrics.TELEGRAM_CALLS.inc(outgoing.method, "ok")
+        if outgoing.on_sent is not None:
+            try:
+                outgoing.on_sent(result)
+            except Exception as e:
+                print(f"Error after Telegram {outgoing.method}: {e}")
+        return None
+
+
+class AsyncBotBridge:
+    """
+    Lets the outbox's sender threads call an AsyncTeleBot.
+
+    Every method call is run as a coroutine on the bot's event loop, where the
+    bot's own HTTP session makes the request; the sender thread only waits for
+    the result. Must not be called from the loop itself.
+    """
+
+    def __init__(self, bot, loop):
+        self.bot = bot
+        self.loop = loop
+
+    def __getattr__(self, method):
+        bot_method = getattr(self.bot, method)
+
+        def call(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(bot_method(*args, **kwargs), self.loop).result()
+        return call
@@ -0,0 +1,41 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# The bot's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    """A clock that only moves when told to; call it for the time, advance() to move it."""
+
+    def __init__(self, now=1_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeUtcClock(FakeClock):
+    """FakeClock returning aware UTC datetimes, as BoundedCache expects."""
+
+    def __init__(self, now=datetime(2024, 1, 1, tzinfo=timezone.utc)):
+        super().__init__(now)
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def utc_clock():
+    return FakeUtcClock()
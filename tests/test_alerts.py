@@ -0,0 +1,129 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from alerts import ALERT_ABOVE, ALERT_BELOW, ALERT_MOVE, AlertEngine, parse_alert_command
+from price_history import PriceHistory
+
+
+@pytest.fixture
+def engine(tmp_path, clock):
+    engine = AlertEngine(PriceHistory(min_spacing=0), notify=lambda chat_id, text: None,
+                         path=str(tmp_path / "alerts.sqlite3"), per_chat_limit=5, clock=clock)
+    engine.load()
+    return engine
+
+
+def publish(engine, **prices):
+    """Evaluates a snapshot of the given prices; returns the ids of the fired alerts."""
+    snapshot = SimpleNamespace(prices={symbol: {"price": price} for symbol, price in prices.items()})
+    return sorted(alert.id for alert in engine.on_snapshot(snapshot))
+
+
+def test_rise_fires_the_above_thresholds_it_crosses(engine):
+    publish(engine, TON=4)
+    five, six, seven, eight = (engine.subscribe(1, "TON", ALERT_ABOVE, value).id for value in (5, 6, 7, 8))
+    below = engine.subscribe(1, "TON", ALERT_BELOW, 3).id
+
+    assert publish(engine, TON=5) == [five]
+    assert publish(engine, TON=7) == [six, seven]  # Thresholds in (5, 7]
+    assert publish(engine, TON=6) == []
+    assert publish(engine, TON=9) == [eight]
+    assert [alert.id for alert in engine.chat_alerts(1)] == [below]
+
+
+def test_fall_fires_the_below_thresholds_it_crosses(engine):
+    publish(engine, TON=10)
+    at_new, inside, at_old = (engine.subscribe(1, "TON", ALERT_BELOW, value).id for value in (6, 8, 10 - 1e-9))
+    outside = engine.subscribe(1, "TON", ALERT_BELOW, 5).id
+
+    assert publish(engine, TON=6) == [at_new, inside, at_old]  # Thresholds in [6, 10)
+    assert publish(engine, TON=6) == []
+    assert [alert.id for alert in engine.chat_alerts(1)] == [outside]
+
+
+def test_first_price_fires_thresholds_already_crossed(engine):
+    above = engine.subscribe(1, "TON", ALERT_ABOVE, 7).id
+    engine.subscribe(1, "TON", ALERT_ABOVE, 9)
+    below = engine.subscribe(1, "TON", ALERT_BELOW, 8).id
+    engine.subscribe(1, "TON", ALERT_BELOW, 5)
+
+    assert publish(engine, TON=8) == [above, below]
+
+
+def test_alerts_are_one_shot_and_survive_a_reload(engine, tmp_path, clock):
+    fired = engine.subscribe(1, "TON", ALERT_ABOVE, 7).id
+    kept = engine.subscribe(1, "TON", ALERT_ABOVE, 9).id
+    engine.start()
+    assert publish(engine, TON=8) == [fired]
+    engine.stop(timeout=5)  # Deletes the fired alert from disk
+
+    reloaded = AlertEngine(PriceHistory(), notify=None, path=engine.path, clock=clock)
+    assert reloaded.load() == 1
+    assert [alert.id for alert in reloaded.chat_alerts(1)] == [kept]
+
+
+def test_subscribe_refuses_thresholds_already_reached(engine):
+    publish(engine, TON=8)
+    with pytest.raises(ValueError):
+        engine.subscribe(1, "TON", ALERT_ABOVE, 7)
+    with pytest.raises(ValueError):
+        engine.subscribe(1, "TON", ALERT_BELOW, 8)
+    assert engine.chat_alerts(1) == []
+
+
+def test_concurrent_subscriptions_respect_the_chat_limit(engine):
+    errors = []
+
+    def subscribe(value):
+        try:
+            engine.subscribe(1, "TON", ALERT_ABOVE, value)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=subscribe, args=(10 + value,)) for value in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(engine.chat_alerts(1)) == 5
+    assert len(errors) == 15
+
+
+def test_move_alerts_fire_on_the_change_within_their_window(engine, clock):
+    small = engine.subscribe(1, "TON", ALERT_MOVE, 5, 3600).id
+    large = engine.subscribe(1, "TON", ALERT_MOVE, 20, 3600).id
+    engine.history.append("TON", clock() - 7200, 5.0)
+    engine.history.append("TON", clock() - 3600, 10.0)
+    engine.history.append("TON", clock(), 9.0)
+
+    assert publish(engine, TON=9.0) == [small]  # -10% over the hour
+    assert [alert.id for alert in engine.chat_alerts(1)] == [large]
+
+
+def test_unsubscribe_only_removes_the_chats_own_alert(engine):
+    alert = engine.subscribe(1, "TON", ALERT_ABOVE, 7)
+
+    assert not engine.unsubscribe(2, alert.id)
+    assert engine.unsubscribe(1, alert.id)
+    assert engine.chat_alerts(1) == []
+    assert publish(engine, TON=8) == []
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("TON > 7", ("TON", ALERT_ABOVE, 7.0, None)),
+    ("ton below $5.5 usd", ("TON", ALERT_BELOW, 5.5, None)),
+    ("BTC < .5", ("BTC", ALERT_BELOW, 0.5, None)),
+    ("BTC 5% 1h", ("BTC", ALERT_MOVE, 5.0, 3600)),
+    ("eth ±2.5% in 30m", ("ETH", ALERT_MOVE, 2.5, 1800)),
+    ("TON 10% 1d", ("TON", ALERT_MOVE, 10.0, 86400)),
+])
+def test_parse_alert_command(text, expected):
+    assert parse_alert_command(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "TON", "TON = 7", "TON > ", "BTC 5%", "BTC 0% 1h", "BTC 5% 0m", "BTC 5% 30d"])
+def test_parse_alert_command_rejects_invalid_input(text):
+    assert parse_alert_command(text) is None
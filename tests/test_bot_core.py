@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+
+import bot_core
+from bot_core import PAGE_CALLBACK_PREFIX, create_pagination_keyboard, parse_page_callback, render_snapshot_pages, resolve_pagination
+from constants import CURRENCY_PAGES
+from price_refresher import PriceSnapshot
+
+LAST_PAGE = len(CURRENCY_PAGES) - 1
+
+
+def snapshot(version, price):
+    prices = {symbol: {"price": price, "percent_change_24h": 1.0} for page in CURRENCY_PAGES for symbol in page}
+    return PriceSnapshot(version, prices, 0, {})
+
+
+@pytest.fixture(autouse=True)
+def rendered_pages(monkeypatch):
+    monkeypatch.setattr(bot_core, "rendered_pages", type(bot_core.rendered_pages)())
+    monkeypatch.setattr(bot_core.price_refresher, "snapshot", lambda: snapshot(100, 9.0))
+
+
+def press(callback_data, shown):
+    """A pagination press on a message whose keyboard is `shown`."""
+    message = SimpleNamespace(reply_markup=shown)
+    return SimpleNamespace(data=callback_data, message=message)
+
+
+def buttons(markup):
+    return [(button.text, button.callback_data) for button in markup.keyboard[0]]
+
+
+def test_keyboard_targets_are_0_based_and_only_the_label_counts_from_1():
+    assert buttons(create_pagination_keyboard(0, 5)) == [
+        ("⬅️", f"{PAGE_CALLBACK_PREFIX}0:5"), ("1️⃣", f"{PAGE_CALLBACK_PREFIX}0:5"), ("➡️", f"{PAGE_CALLBACK_PREFIX}1:5")]
+    assert [data for _, data in buttons(create_pagination_keyboard(LAST_PAGE, 5))] == [
+        f"{PAGE_CALLBACK_PREFIX}{LAST_PAGE - 1}:5", f"{PAGE_CALLBACK_PREFIX}{LAST_PAGE}:5", f"{PAGE_CALLBACK_PREFIX}{LAST_PAGE}:5"]
+
+
+@pytest.mark.parametrize("callback_data, expected", [
+    (f"{PAGE_CALLBACK_PREFIX}1:42", (1, 42)),
+    (f"{PAGE_CALLBACK_PREFIX}{LAST_PAGE + 1}:42", None),
+    (f"{PAGE_CALLBACK_PREFIX}-1:42", None),
+    (f"{PAGE_CALLBACK_PREFIX}1", None),
+    (f"{PAGE_CALLBACK_PREFIX}x:42", None),
+    ("next_page", None),
+    ("page_2", None),
+    (None, None),
+])
+def test_parse_page_callback(callback_data, expected):
+    assert parse_page_callback(callback_data) == expected
+
+
+def test_presses_resolve_to_the_version_the_message_was_sent_with():
+    old_pages = render_snapshot_pages(snapshot(1, 5.0))
+    for version in range(2, 50):
+        render_snapshot_pages(snapshot(version, 6.0))
+
+    page, text, markup, unchanged = resolve_pagination(press(f"{PAGE_CALLBACK_PREFIX}1:1", old_pages[0][1]))
+
+    assert (page, text, unchanged) == (1, old_pages[1][0], False)
+    assert "5.000000" in text
+    assert markup is old_pages[1][1]
+
+
+def test_pressing_the_shown_page_is_unchanged():
+    pages = render_snapshot_pages(snapshot(1, 5.0))
+
+    assert resolve_pagination(press(f"{PAGE_CALLBACK_PREFIX}0:1", pages[0][1]))[3]
+
+
+def test_unknown_versions_fall_back_to_the_latest_snapshot():
+    shown = create_pagination_keyboard(0, 7)
+
+    page, text, _, unchanged = resolve_pagination(press(f"{PAGE_CALLBACK_PREFIX}2:7", shown))
+
+    assert page == 2 and "9.000000" in text and not unchanged
+    assert resolve_pagination(press("next_page", shown)) is None
+
+
+def test_rendered_versions_expire_by_age(monkeypatch, clock):
+    monkeypatch.setattr(bot_core.time, "monotonic", clock)
+    first = render_snapshot_pages(snapshot(1, 5.0))
+
+    clock.advance(bot_core.RENDERED_PAGES_TTL)
+    assert render_snapshot_pages(snapshot(1, 6.0)) is first
+    render_snapshot_pages(snapshot(2, 6.0))
+    assert bot_core.rendered_snapshot_pages(1) is first
+
+    clock.advance(1)
+    render_snapshot_pages(snapshot(3, 7.0))
+    assert bot_core.rendered_snapshot_pages(1) is None
+    assert bot_core.rendered_snapshot_pages(2) is not None
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from bounded_cache import ENTRY_OVERHEAD, BoundedCache
+
+
+def make_cache(utc_clock, **kwargs):
+    return BoundedCache("test", timedelta(seconds=60), retention=timedelta(seconds=300), clock=utc_clock, **kwargs)
+
+
+def test_get_returns_value_and_counts_hits_and_misses(utc_clock):
+    cache = make_cache(utc_clock)
+    cache.put("TON", {"price": 7.0}, utc_clock())
+
+    assert cache.get("TON") == ({"price": 7.0}, utc_clock())
+    assert cache.get("BTC") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_get_drops_entries_past_retention(utc_clock):
+    cache = make_cache(utc_clock)
+    cache.put("TON", {"price": 7.0}, utc_clock())
+
+    utc_clock.advance(299)
+    assert cache.get("TON") is not None
+    utc_clock.advance(1)
+    assert cache.get("TON") is None
+    assert "TON" not in cache
+    assert cache.expirations == 1
+
+
+def test_peek_applies_retention_without_touching_the_entry(utc_clock):
+    cache = make_cache(utc_clock)
+    cache.put("TON", {"price": 7.0}, utc_clock())
+    cache.put("BTC", {"price": 60_000.0}, utc_clock())
+
+    assert cache.peek("TON") == ({"price": 7.0}, utc_clock())
+    assert [key for key, _ in cache.items()] == ["TON", "BTC"]  # LRU order unchanged
+    assert (cache.hits, cache.misses) == (0, 0)
+
+    utc_clock.advance(300)
+    assert cache.peek("TON") is None
+    assert "TON" in cache  # Left for the sweep
+
+
+def test_sweep_removes_only_expired_entries(utc_clock):
+    cache = make_cache(utc_clock)
+    cache.put("old", 1, utc_clock())
+    utc_clock.advance(200)
+    cache.put("new", 2, utc_clock())
+    utc_clock.advance(100)
+
+    assert cache.sweep() == 1
+    assert "old" not in cache and "new" in cache
+
+
+def test_evicts_least_recently_used_beyond_max_entries(utc_clock):
+    cache = make_cache(utc_clock, max_entries=2)
+    cache.put("a", 1, utc_clock())
+    cache.put("b", 2, utc_clock())
+    cache.get("a")
+    cache.put("c", 3, utc_clock())
+
+    assert [key for key, _ in cache.items()] == ["a", "c"]
+    assert cache.evictions == 1
+
+
+def test_evicts_beyond_max_bytes_but_keeps_the_newest_entry(utc_clock):
+    cache = make_cache(utc_clock, max_bytes=ENTRY_OVERHEAD + 100)
+    cache.put("a", "x", utc_clock())
+    cache.put("b", "y" * 1000, utc_clock())
+
+    assert [key for key, _ in cache.items()] == ["b"]
+
+
+def test_size_bytes_tracks_puts_replacements_and_removals(utc_clock):
+    cache = make_cache(utc_clock)
+    assert cache.size_bytes() == 0
+
+    cache.put("a", "x" * 100, utc_clock())
+    one_entry = cache.size_bytes()
+    assert one_entry > ENTRY_OVERHEAD
+    cache.put("a", "x" * 100, utc_clock())
+    assert cache.size_bytes() == one_entry
+
+    utc_clock.advance(300)
+    cache.sweep()
+    assert cache.size_bytes() == 0 == cache.stats()["bytes"]
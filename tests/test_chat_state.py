@@ -0,0 +1,74 @@
+import pytest
+
+from chat_state import ChatStateStore
+
+ADDRESSES = [f"EQ{letter * 46}" for letter in "ABCDEFGHIJ"]
+
+
+@pytest.fixture
+def store(clock):
+    return ChatStateStore(max_chats=3, idle_ttl=100, clock=clock)
+
+
+def test_crypto_cooldown(store, clock):
+    assert store.start_crypto(1, cooldown=30) == 0
+    clock.advance(10)
+    assert store.start_crypto(1, cooldown=30) == 20
+    assert store.start_crypto(2, cooldown=30) == 0  # Per chat
+
+    store.cancel_crypto(1)
+    assert store.start_crypto(1, cooldown=30) == 0
+
+
+def test_replace_crypto_message_returns_the_previous_one(store):
+    assert store.replace_crypto_message(1, 10) is None
+    assert store.replace_crypto_message(1, 11) == 10
+
+
+def test_least_recently_used_chats_are_evicted_beyond_max_chats(store):
+    for chat_id in (1, 2, 3):
+        store.replace_crypto_message(chat_id, 10 + chat_id)
+    store.replace_crypto_message(1, 21)  # Chat 2 is now the least recently used
+    store.replace_crypto_message(4, 14)
+
+    assert len(store) == 3
+    assert store.replace_crypto_message(2, 22) is None
+    assert store.replace_crypto_message(1, 31) == 21
+
+
+def test_idle_chats_are_forgotten(store, clock):
+    store.start_crypto(1, cooldown=1_000)
+    store.replace_crypto_message(2, 12)
+    clock.advance(60)
+    store.replace_crypto_message(3, 13)
+    clock.advance(40)
+
+    store.replace_crypto_message(3, 23)  # Evicts chats 1 and 2 on the way
+    assert len(store) == 1
+    assert store.start_crypto(1, cooldown=1_000) == 0  # A forgotten chat starts over
+
+
+def test_ton_address_repeats_are_ignored_within_the_window(store, clock):
+    assert store.claim_ton_address(1, ADDRESSES[0], window=60)
+    assert not store.claim_ton_address(1, ADDRESSES[0], window=60)
+    assert store.claim_ton_address(2, ADDRESSES[0], window=60)  # Per chat
+
+    clock.advance(60)
+    assert store.claim_ton_address(1, ADDRESSES[0], window=60)
+
+
+def test_alternating_ton_addresses_are_each_remembered(store, clock):
+    assert store.claim_ton_address(1, ADDRESSES[0], window=60)
+    assert store.claim_ton_address(1, ADDRESSES[1], window=60)
+    clock.advance(30)
+
+    assert not store.claim_ton_address(1, ADDRESSES[0], window=60)
+    assert not store.claim_ton_address(1, ADDRESSES[1], window=60)
+
+
+def test_remembered_ton_addresses_are_capped_per_chat(store):
+    for address in ADDRESSES[:4]:
+        assert store.claim_ton_address(1, address, window=60, max_addresses=3)
+
+    assert store.claim_ton_address(1, ADDRESSES[0], window=60, max_addresses=3)  # Dropped as the oldest
+    assert not store.claim_ton_address(1, ADDRESSES[3], window=60, max_addresses=3)
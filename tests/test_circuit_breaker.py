@@ -0,0 +1,60 @@
+from circuit_breaker import CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, CircuitBreaker
+
+
+def make_breaker(clock):
+    return CircuitBreaker("test", failure_threshold=3, reset_timeout=30, clock=clock)
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = make_breaker(clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # Resets the streak
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+    assert breaker.retry_in() == 30
+
+
+def test_lets_one_probe_through_after_the_reset_timeout(clock):
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock.advance(30)
+    assert breaker.allow()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert not breaker.allow()  # Only the probe
+
+
+def test_successful_probe_closes_the_circuit(clock):
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.advance(30)
+    breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.allow() and breaker.retry_in() == 0.0
+
+
+def test_failed_probe_reopens_for_another_timeout(clock):
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.advance(30)
+    breaker.allow()
+
+    clock.advance(5)
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert breaker.retry_in() == 30
+    clock.advance(29)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.allow()
@@ -0,0 +1,39 @@
+from cmc_id_index import CmcIdIndex
+
+
+def test_the_best_ranked_active_asset_wins_each_symbol():
+    index = CmcIdIndex(overrides={})
+    ids = index.build([
+        {"id": 11419, "symbol": "TON", "rank": 9, "is_active": 1},
+        {"id": 1759, "symbol": "TON", "rank": 2_500, "is_active": 1},
+        {"id": 1, "symbol": "BTC", "rank": 1, "is_active": 1},
+        {"id": 2, "symbol": "BTC", "rank": None, "is_active": 1},  # Unranked loses to any rank
+        {"id": 3, "symbol": "OLD", "rank": 5, "is_active": 0},
+    ], built_at=1_000.0)
+
+    assert ids == {"TON": 11419, "BTC": 1}
+    assert index.built_at == 1_000.0
+
+
+def test_overrides_take_precedence_and_unknown_symbols_stay_unresolved():
+    index = CmcIdIndex(overrides={"GRAM": 32019})
+    index.load({"BTC": 1, "GRAM": 99}, built_at=1_000.0)
+
+    assert index.resolve(["GRAM", "NOT", "BTC"]) == ({"GRAM": 32019, "BTC": 1}, ["NOT"])
+
+
+def test_rebuilds_are_due_after_the_interval_and_retried_sparingly(clock):
+    index = CmcIdIndex(refresh_interval=3_600, retry_interval=600, clock=clock)
+    assert index.needs_refresh()  # Never built
+
+    index.attempted_at = clock()
+    clock.advance(300)
+    assert not index.needs_refresh()  # A rebuild was just started (or failed)
+    clock.advance(300)
+    assert index.needs_refresh()
+
+    index.load({"BTC": 1}, built_at=clock())
+    clock.advance(3_599)
+    assert not index.needs_refresh()
+    clock.advance(1)
+    assert index.needs_refresh()
@@ -0,0 +1,61 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from conversion import convert, convert_many, parse_conversion_query
+from crypto_api import build_fx_table
+
+PRICES = {"TON": {"price": 5.0}, "BTC": {"price": 50_000.0}, "ETH": None}
+
+
+@pytest.fixture
+def fx_table():
+    # USD-based rates, as ExchangeRate-API returns them
+    return build_fx_table({"USD": 1.0, "EUR": 0.5, "RUB": 100.0}, datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+
+def test_convert_many_from_crypto(fx_table):
+    results = dict(convert_many(2, "TON", ["BTC", "USD", "EUR", "RUB"], PRICES, fx_table))
+
+    assert results == {
+        "BTC": "🪙 2.0000 $TON = 🪙 0.000200 $BTC",
+        "USD": "🪙 2.0000 $TON = 💸 10.00 USD",
+        "EUR": "🪙 2.0000 $TON = 💸 5.00 EUR",
+        "RUB": "🪙 2.0000 $TON = 💸 1,000.00 RUB",
+    }
+
+
+def test_convert_many_from_fiat_keeps_target_order(fx_table):
+    results = convert_many(10, "EUR", ["RUB", "TON", "USD"], PRICES, fx_table)
+
+    assert [target for target, _ in results] == ["RUB", "TON", "USD"]
+    assert results[1] == ("TON", "💸 10.00 EUR = 🪙 4.000000 $TON")
+
+
+def test_convert_many_leaves_out_what_cannot_be_priced(fx_table):
+    targets = ["ETH", "SOL", "GBP", "USD"]  # ETH unpriced, SOL missing, GBP not in the table
+
+    assert [target for target, _ in convert_many(1, "TON", targets, PRICES, fx_table)] == ["USD"]
+    assert convert_many(1, "ETH", ["USD", "TON"], PRICES, fx_table) == []
+
+
+def test_convert_many_without_fx_table_converts_crypto_only():
+    assert [target for target, _ in convert_many(1, "TON", ["BTC", "USD"], PRICES, None)] == ["BTC"]
+
+
+def test_convert_many_agrees_with_convert(fx_table):
+    rates = {("USD", "EUR"): 0.5}
+    single, _ = convert(3, "BTC", "EUR", PRICES, rates)
+
+    assert dict(convert_many(3, "BTC", ["EUR"], PRICES, fx_table))["EUR"] == single
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("100 usd to btc", (100.0, "USD", "BTC")),
+    ("BTC EUR", (1.0, "BTC", "EUR")),
+    ("0.5 TON", (0.5, "TON", None)),
+    ("100 dollars", None),
+    ("1 TON to", None),
+])
+def test_parse_conversion_query(query, expected):
+    assert parse_conversion_query(query) == expected
@@ -0,0 +1,352 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+import crypto_api
+import http_client
+from cmc_id_index import CmcIdIndex
+from crypto_api import (
+    CACHE_EXPIRED, CACHE_FRESH, CACHE_STALE, begin_price_lookup, build_fx_table, cache_state, collect_price_lookup,
+    finish_price_fetch, get_crypto_prices, get_currency_rate, lookup_fx_rate
+)
+from key_pool import ApiKeyPool
+from persistent_cache import PersistentCache
+from request_steps import Reply, Send
+
+TON_ADDRESS = "EQ" + "A" * 46
+OTHER_ADDRESS = "EQ" + "B" * 46
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    crypto_api.crypto_price_cache.clear()
+    crypto_api.ton_token_cache.clear()
+    yield
+    crypto_api.crypto_price_cache.clear()
+    crypto_api.ton_token_cache.clear()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Stands in for CoinMarketCap; each fetch is recorded and waits for `release`."""
+    calls = []
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def fetch(symbols):
+        calls.append(list(symbols))
+        started.release()
+        release.wait(5)
+        return {symbol: {"price": float(len(symbol))} for symbol in symbols}
+
+    monkeypatch.setattr(crypto_api, "_fetch_crypto_prices", fetch)
+    return calls, release, started
+
+
+def in_thread(target, *args):
+    results = {}
+    thread = threading.Thread(target=lambda: results.update(target(*args)))
+    thread.start()
+    return thread, results
+
+
+def test_concurrent_callers_share_the_inflight_fetch(upstream):
+    calls, release, started = upstream
+    leader, leader_results = in_thread(get_crypto_prices, ["TON", "BTC"])
+    assert started.acquire(timeout=5)
+    follower, follower_results = in_thread(get_crypto_prices, ["BTC", "ETH"])
+    assert started.acquire(timeout=5)
+
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert calls == [["TON", "BTC"], ["ETH"]]
+    assert follower_results == {"BTC": {"price": 3.0}, "ETH": {"price": 3.0}}
+    assert leader_results == {"TON": {"price": 3.0}, "BTC": {"price": 3.0}}
+    assert crypto_api._inflight_crypto_fetches == {}
+
+
+def test_a_failed_fetch_is_no_longer_in_flight(monkeypatch):
+    def fail(symbols):
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(crypto_api, "_fetch_crypto_prices", fail)
+
+    with pytest.raises(RuntimeError):
+        get_crypto_prices(["TON"])
+    assert crypto_api._inflight_crypto_fetches == {}
+
+
+def test_cached_prices_are_answered_without_a_fetch(upstream):
+    calls, release, _ = upstream
+    release.set()
+    crypto_api.crypto_price_cache.put("TON", {"price": 5.0}, datetime.now(timezone.utc) - timedelta(seconds=10))
+
+    assert get_crypto_prices(["TON"]) == {"TON": {"price": 5.0}}
+    assert get_crypto_prices(["TON"], use_cache=False) == {"TON": {"price": 3.0}}
+    assert calls == [["TON"]]
+
+
+def test_a_second_lookup_joins_the_inflight_fetch_instead_of_fetching():
+    leader = crypto_api.begin_price_lookup(["TON", "BTC"], use_cache=True)
+    follower = crypto_api.begin_price_lookup(["BTC", "ETH"], use_cache=True)
+
+    assert leader.to_fetch == ["TON", "BTC"]
+    assert follower.to_fetch == ["ETH"]
+    assert follower.pending == {"BTC": leader.own_fetch}
+
+    crypto_api.finish_price_fetch(leader, {"TON": {"price": 1.0}, "BTC": {"price": 2.0}})
+    crypto_api.finish_price_fetch(follower, {"ETH": {"price": 3.0}})
+
+    assert crypto_api.collect_price_lookup(follower) == {"BTC": {"price": 2.0}, "ETH": {"price": 3.0}}
+    assert crypto_api._inflight_crypto_fetches == {}
+
+
+def test_waiters_on_a_failed_fetch_are_woken_empty_handed():
+    leader = crypto_api.begin_price_lookup(["TON"], use_cache=True)
+    follower = crypto_api.begin_price_lookup(["TON"], use_cache=True)
+    woken = []
+    leader.own_fetch.add_done_callback(lambda: woken.append(True))
+
+    crypto_api.finish_price_fetch(leader, {})
+
+    assert woken == [True]
+    assert crypto_api.collect_price_lookup(follower) == {}
+
+
+def cache_price(symbol, price, age):
+    crypto_api.crypto_price_cache.put(symbol, {"price": price}, datetime.now(timezone.utc) - timedelta(seconds=age))
+
+
+def test_stale_prices_are_served_with_their_age_and_revalidated():
+    cache_price("TON", 5.0, age=10)
+    cache_price("BTC", 50_000.0, age=7 * 60)
+
+    lookup = begin_price_lookup(["TON", "BTC"], use_cache=True)
+
+    assert lookup.to_fetch == [] and lookup.own_fetch is None
+    assert lookup.results["TON"] == {"price": 5.0}
+    assert lookup.results["BTC"]["cache_age"] == pytest.approx(7 * 60, abs=5)
+    assert lookup.stale_symbols == ["BTC"]
+
+
+def test_expired_prices_are_refetched_and_only_served_if_that_fails():
+    cache_price("TON", 5.0, age=12 * 60)
+
+    lookup = begin_price_lookup(["TON"], use_cache=True)
+    assert lookup.to_fetch == ["TON"]
+    finish_price_fetch(lookup, {"TON": None})
+    assert collect_price_lookup(lookup)["TON"]["price"] == 5.0
+
+    lookup = begin_price_lookup(["TON"], use_cache=True)
+    finish_price_fetch(lookup, {"TON": {"price": 6.0}})
+    assert collect_price_lookup(lookup) == {"TON": {"price": 6.0}}
+
+
+@pytest.mark.parametrize("minutes, expected", [
+    (0, CACHE_FRESH), (4.9, CACHE_FRESH), (5, CACHE_STALE), (9.9, CACHE_STALE),
+    (10, CACHE_EXPIRED), (29.9, CACHE_EXPIRED), (30, None),
+])
+def test_cache_state(minutes, expected):
+    state = cache_state(timedelta(minutes=minutes), crypto_api.CRYPTO_CACHE_DURATION, crypto_api.CRYPTO_CACHE_GRACE,
+                        crypto_api.CRYPTO_CACHE_MAX_STALENESS)
+    assert state == expected
+
+
+def test_the_grace_window_never_extends_past_the_max_staleness():
+    assert cache_state(timedelta(minutes=15), timedelta(minutes=10), timedelta(minutes=10), timedelta(minutes=15)) is None
+    assert cache_state(timedelta(minutes=12), timedelta(minutes=10), timedelta(minutes=10), timedelta(minutes=15)) == CACHE_STALE
+
+
+def test_a_stale_fx_table_is_served_while_one_refresh_runs(monkeypatch):
+    stale = build_fx_table({"USD": 1.0, "EUR": 0.5}, datetime.now(timezone.utc) - timedelta(minutes=90))
+    monkeypatch.setattr(crypto_api, "fx_rate_table", stale)
+    refreshes = []
+    monkeypatch.setattr(crypto_api, "_revalidate_in_background", lambda keys, refresh: refreshes.append(keys))
+
+    assert crypto_api.get_fx_table() is stale
+    assert refreshes == [["fx_table"]]
+
+
+def test_revalidation_claims_each_key_once():
+    assert crypto_api.claim_revalidation(["fx_table", ("crypto", "TON")]) == ["fx_table", ("crypto", "TON")]
+    try:
+        assert crypto_api.claim_revalidation([("crypto", "TON"), ("crypto", "BTC")]) == [("crypto", "BTC")]
+    finally:
+        crypto_api.release_revalidation(["fx_table", ("crypto", "TON"), ("crypto", "BTC")])
+    assert crypto_api._revalidating == set()
+
+
+def test_a_rate_limited_key_is_cooled_down_and_the_next_one_tried(monkeypatch, clock):
+    pool = ApiKeyPool("CMC", ["a", "b"], calls_per_minute=60, clock=clock)
+    monkeypatch.setattr(crypto_api, "cmc_key_pool", pool)
+    monkeypatch.setattr(crypto_api, "CMC_API_KEYS", ["a", "b"])
+    steps = crypto_api.cmc_request_steps("https://cmc.test/quotes", {})
+
+    first = next(steps)
+    assert isinstance(first, Send)
+    second = steps.send(Reply(429, {"Retry-After": "30"}, {}, None))
+    assert second.headers != first.headers
+    with pytest.raises(StopIteration) as stop:
+        steps.send(Reply(200, {}, {"status": {"credit_count": 1}, "data": {}}, None))
+
+    assert stop.value.value == {"status": {"credit_count": 1}, "data": {}}
+    rejected, used = pool.status() if first.headers["X-CMC_PRO_API_KEY"] == "a" else pool.status()[::-1]
+    assert (rejected["cooldown_remaining"], rejected["cooldown_reason"]) == (30.0, "rate limited")
+    assert (used["credits_today"], used["in_flight"]) == (1, 0)
+
+
+def test_fx_table_holds_every_cross_rate():
+    table = build_fx_table({"USD": 1.0, "EUR": 0.5, "RUB": 100.0, "XXX": 0}, datetime(2024, 1, 1, tzinfo=timezone.utc))
+
+    assert set(table.currencies) == {"USD", "EUR", "RUB"}  # Currencies without a rate are left out
+    assert lookup_fx_rate(table, "EUR", "RUB") == pytest.approx(200.0)
+    assert lookup_fx_rate(table, "RUB", "USD") == pytest.approx(0.01)
+    assert lookup_fx_rate(table, "EUR", "EUR") == 1.0
+    assert np.allclose(table.matrix * table.matrix.T, 1.0)
+    assert lookup_fx_rate(table, "EUR", "GBP") is None
+    assert lookup_fx_rate(None, "EUR", "USD") is None
+
+
+def test_fiat_pairs_share_one_table_fetch(monkeypatch):
+    fetches = []
+    monkeypatch.setattr(crypto_api, "fx_rate_table", None)
+    monkeypatch.setattr(crypto_api, "_fetch_fx_rates",
+                        lambda base: fetches.append(base) or {"USD": 1.0, "EUR": 0.5, "RUB": 100.0})
+
+    assert get_currency_rate("EUR", "RUB") == pytest.approx(200.0)
+    assert get_currency_rate("RUB", "EUR") == pytest.approx(0.005)
+    assert fetches == ["USD"]
+
+
+def test_persisted_entries_are_restored_with_their_timestamps(tmp_path, monkeypatch):
+    monkeypatch.setattr(crypto_api, "fx_rate_table", None)
+    monkeypatch.setattr(crypto_api, "persistent_store", None)
+    fetched_at = datetime.now(timezone.utc) - timedelta(minutes=2)
+    expired_at = datetime.now(timezone.utc) - timedelta(hours=2)
+    store = PersistentCache(str(tmp_path / "cache.sqlite3"))
+    store.put("crypto_price", "TON", {"price": 5.0}, fetched_at.timestamp())
+    store.put("crypto_price", "BTC", {"price": 50_000.0}, expired_at.timestamp())
+    store.put("fx_table", "USD", {"USD": 1.0, "EUR": 0.5}, fetched_at.timestamp())
+    store.flush()
+    written_back = []
+    monkeypatch.setattr(store, "put", lambda *args: written_back.append(args))
+
+    crypto_api.enable_persistence(store)
+
+    assert dict(crypto_api.crypto_price_cache.items()) == {"TON": ({"price": 5.0}, fetched_at)}
+    assert crypto_api.fx_rate_table.fetched_at == fetched_at
+    assert lookup_fx_rate(crypto_api.fx_rate_table, "EUR", "USD") == pytest.approx(2.0)
+    assert written_back == []
+
+
+def token_pair(address, price, liquidity=1_000.0, chain="ton"):
+    return {"chainId": chain, "baseToken": {"address": address, "name": "Token", "symbol": "TKN"},
+            "priceUsd": str(price), "liquidity": {"usd": liquidity}, "volume": {"h24": 10.0}, "pairCreatedAt": None}
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def dexscreener(monkeypatch):
+    """Records the requested DexScreener URLs; `responses` maps a URL prefix to the JSON to return."""
+    requests, responses = [], {}
+
+    def get(url, **kwargs):
+        requests.append(url)
+        return FakeResponse(next(body for prefix, body in responses.items() if url.startswith(prefix)))
+
+    monkeypatch.setattr(http_client, "get", get)
+    return requests, responses
+
+
+def test_token_batch_falls_back_to_a_search_for_unlisted_addresses(dexscreener):
+    requests, responses = dexscreener
+    responses["https://api.dexscreener.com/latest/dex/tokens/"] = {"pairs": [token_pair(TON_ADDRESS, 1.5)]}
+    responses["https://api.dexscreener.com/latest/dex/search"] = {"pairs": [token_pair(OTHER_ADDRESS, 2.5)]}
+
+    results = crypto_api.get_ton_tokens_info([TON_ADDRESS, OTHER_ADDRESS, TON_ADDRESS])
+
+    assert len(requests) == 2
+    assert requests[0].endswith(f"{TON_ADDRESS},{OTHER_ADDRESS}")
+    assert "$1.500000" in results[TON_ADDRESS][0]
+    assert "$2.500000" in results[OTHER_ADDRESS][0]
+
+    assert crypto_api.get_ton_tokens_info([TON_ADDRESS, OTHER_ADDRESS]) == results
+    assert len(requests) == 2  # Both cached
+
+
+def test_not_found_results_are_cached_briefly(dexscreener):
+    requests, responses = dexscreener
+    responses["https://api.dexscreener.com/latest/dex/search"] = {"pairs": []}
+
+    text, error = crypto_api.get_ton_token_info(TON_ADDRESS)
+    assert text is None and TON_ADDRESS in error
+    crypto_api.get_ton_token_info(TON_ADDRESS)
+    assert len(requests) == 1
+
+    result, stored_at = crypto_api.ton_token_cache.get(TON_ADDRESS)
+    crypto_api.ton_token_cache.put(TON_ADDRESS, result, stored_at - crypto_api.TON_TOKEN_NEGATIVE_CACHE_DURATION)
+    crypto_api.get_ton_token_info(TON_ADDRESS)
+    assert len(requests) == 2
+
+
+def test_dexscreener_quote_uses_the_most_liquid_pair():
+    pairs = [token_pair(TON_ADDRESS, 1.0, liquidity=10.0), token_pair(TON_ADDRESS, 1.2, liquidity=500.0),
+             token_pair(OTHER_ADDRESS, 9.0, liquidity=10_000.0)]
+
+    quote = crypto_api.dexscreener_quote(TON_ADDRESS, pairs)
+
+    assert quote["price"] == 1.2
+    assert quote["volume_24h"] == 20.0
+    assert quote["source"] == "dexscreener"
+    assert crypto_api.dexscreener_quote("EQ" + "C" * 46, pairs) is None
+
+
+@pytest.fixture
+def id_index(monkeypatch):
+    index = CmcIdIndex(overrides={"TON": 11419})
+    index.load({"BTC": 1, "ETH": 1027}, datetime.now(timezone.utc).timestamp())
+    monkeypatch.setattr(crypto_api, "cmc_id_index", index)
+    return index
+
+
+def test_quote_chunks_request_known_symbols_by_id(id_index, monkeypatch):
+    monkeypatch.setattr(crypto_api, "CMC_QUOTES_CHUNK_SIZE", 2)
+
+    chunks = crypto_api.quote_chunks(["BTC", "NOT", "TON", "ETH", "DOGS"])
+
+    assert chunks == [(["BTC", "TON"], [1, 11419]), (["ETH"], [1027]), (["NOT", "DOGS"], None)]
+    assert crypto_api.quote_params(*chunks[0]) == {"id": "1,11419", "convert": "USD"}
+    assert crypto_api.quote_params(*chunks[2]) == {"symbol": "NOT,DOGS", "convert": "USD"}
+
+
+def test_quote_credits_are_charged_per_started_block_of_each_request(id_index, monkeypatch):
+    monkeypatch.setattr(crypto_api, "CMC_SYMBOLS_PER_CREDIT", 2)
+
+    assert crypto_api.quote_credits(["BTC", "TON", "ETH"]) == 2
+    assert crypto_api.quote_credits(["BTC", "NOT"]) == 2  # One request by ID, one by symbol
+    assert crypto_api.quote_credits([]) == 0
+
+
+def test_store_quote_chunk_reads_id_keyed_responses(id_index):
+    data = {"1": {"quote": {"USD": {"price": 50_000.0}}}, "11419": {"quote": {}}}
+
+    results = crypto_api.store_quote_chunk(["BTC", "TON"], [1, 11419], data)
+
+    assert results == {"BTC": {"price": 50_000.0}, "TON": None}
+    assert crypto_api.crypto_price_cache.get("BTC")[0] == {"price": 50_000.0}
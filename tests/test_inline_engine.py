@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import crypto_api
+from inline_engine import InlineQueryEngine
+from price_refresher import PriceSnapshot
+
+
+class FakeRefresher:
+    def __init__(self, snapshot):
+        self.current = snapshot
+
+    def snapshot(self):
+        return self.current
+
+
+def inline_query(query_id, user_id=1, query="1 TON to USD"):
+    return SimpleNamespace(id=query_id, from_user=SimpleNamespace(id=user_id), query=query)
+
+
+@pytest.fixture
+def refresher(clock):
+    return FakeRefresher(PriceSnapshot(7, {"TON": {"price": 5.0}, "BTC": {"price": 50_000.0}}, clock(),
+                                       {"TON": clock(), "BTC": clock()}))
+
+
+@pytest.fixture
+def engine(refresher, clock):
+    return InlineQueryEngine(refresher, memo_size=2, clock=clock)
+
+
+@pytest.fixture
+def fx_table(monkeypatch):
+    table = crypto_api.build_fx_table({"USD": 1.0, "EUR": 0.5}, datetime.now(timezone.utc))
+    monkeypatch.setattr(crypto_api, "fx_rate_table", table)
+    return table
+
+
+def test_newer_queries_supersede_older_ones_per_user(engine):
+    first, second, other_user = inline_query("1"), inline_query("2"), inline_query("3", user_id=2)
+    for query in (first, second, other_user):
+        assert engine.admit(query)
+
+    assert engine.is_superseded(first)
+    assert not engine.is_superseded(second)
+    assert not engine.is_superseded(other_user)
+    assert not engine.admit(inline_query("4", query=""))
+
+
+def test_finish_only_forgets_the_newest_query(engine):
+    first, second = inline_query("1"), inline_query("2")
+    engine.admit(first)
+    engine.admit(second)
+
+    engine.finish(first)
+    assert engine.is_superseded(first)
+    engine.finish(second)
+    assert not engine.is_superseded(first)  # Nothing newer is pending
+
+
+def test_memo_key_follows_the_snapshot_version_and_fx_table(engine, refresher, fx_table):
+    key, prices, missing, rate_pairs = engine.prepare(1.0, "TON", "EUR")
+
+    assert key == (1.0, "TON", "EUR", 7, fx_table.fetched_at)
+    assert prices == {"TON": {"price": 5.0}} and missing == [] and rate_pairs == [("USD", "EUR")]
+    assert engine.prepare(1.0, "TON", "USD")[0] == (1.0, "TON", "USD", 7, None)
+    assert engine.prepare(1.0, "USD", "EUR")[0] == (1.0, "USD", "EUR", None, fx_table.fetched_at)
+
+    refresher.current = refresher.current._replace(version=8)
+    assert engine.prepare(1.0, "TON", "EUR")[0][3] == 8
+
+
+def test_stale_missing_or_unfresh_answers_are_not_memoized(engine, refresher, clock, monkeypatch, fx_table):
+    clock.advance(6 * 60)
+    key, prices, _, _ = engine.prepare(1.0, "TON", "USD")
+    assert key is None and prices["TON"]["cache_age"] == 6 * 60
+
+    clock.advance(30 * 60)
+    key, prices, missing, _ = engine.prepare(1.0, "TON", "USD")
+    assert key is None and prices == {} and missing == ["TON"]
+
+    clock.now = refresher.current.fetched_at
+    monkeypatch.setattr(crypto_api, "fx_rate_table", fx_table._replace(fetched_at=fx_table.fetched_at - timedelta(hours=2)))
+    assert engine.prepare(1.0, "TON", "EUR")[0] is None
+
+
+def test_memo_evicts_the_least_recently_used_answers(engine):
+    engine.remember("a", "answer a")
+    engine.remember("b", "answer b")
+    assert engine.lookup("a") == "answer a"
+    engine.remember("c", "answer c")
+
+    assert engine.lookup("b") is None
+    assert engine.lookup("a") == "answer a"
+    assert engine.lookup(None) is None
@@ -0,0 +1,86 @@
+from key_pool import ApiKeyPool
+from shared_state import SharedState
+
+
+def test_acquire_prefers_the_least_loaded_key(clock):
+    pool = ApiKeyPool("test", ["a", "b"], calls_per_minute=60, burst=5, clock=clock)
+
+    first, second = pool.acquire(), pool.acquire()
+    assert {first, second} == {0, 1}
+    pool.release(first, credits=3)
+    assert pool.acquire() == first  # Fewer in flight wins over fewer credits
+    pool.release(first)
+    pool.release(second)
+    assert pool.acquire() == second  # Then fewer credits today
+
+
+def test_acquire_fails_fast_until_tokens_refill(clock):
+    pool = ApiKeyPool("test", ["a"], calls_per_minute=60, burst=2, clock=clock)
+
+    assert pool.acquire() == 0 and pool.acquire() == 0
+    assert pool.acquire() is None
+    assert pool.next_available_in() == 1.0
+
+    clock.advance(1)
+    assert pool.acquire() == 0
+
+
+def test_cooldown_takes_the_key_out_of_rotation(clock):
+    pool = ApiKeyPool("test", ["a", "b"], calls_per_minute=60, burst=5, clock=clock)
+    index = pool.acquire()
+    pool.cooldown(index, 30, "rate limited")
+
+    assert all(pool.acquire() != index for _ in range(5))
+    status = pool.status()[index]
+    assert status["cooldown_reason"] == "rate limited" and status["in_flight"] == 0
+
+    clock.advance(30)
+    assert pool.status()[index]["cooldown_remaining"] == 0.0
+    assert pool.acquire() == index
+
+
+def test_idle_only_never_returns_a_key_in_flight(clock):
+    pool = ApiKeyPool("test", ["a", "b"], calls_per_minute=60, burst=5, clock=clock)
+    first = pool.acquire()
+
+    assert pool.has_idle_key()
+    second = pool.acquire(idle_only=True)
+    assert second != first
+    assert not pool.has_idle_key()
+    assert pool.acquire(idle_only=True) is None
+    assert pool.acquire() is not None
+
+
+def test_release_books_credits_per_key(clock):
+    pool = ApiKeyPool("test", ["a", "b"], calls_per_minute=60, clock=clock)
+    index = pool.acquire()
+    pool.release(index, credits=2)
+
+    status = pool.status()[index]
+    assert (status["credits_today"], status["credits_total"], status["requests_total"]) == (2, 2, 1)
+
+
+def test_shared_state_limits_keys_across_pools(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    pools = [ApiKeyPool("test", ["a"], calls_per_minute=1, burst=2) for _ in range(2)]
+    for pool in pools:
+        pool.shared_state = SharedState(path)
+
+    # Each pool has two local tokens, but the key only has two between them
+    assert pools[0].acquire() == 0
+    assert pools[1].acquire() == 0
+    assert pools[0].acquire() is None
+    assert pools[1].acquire() is None
+    # The failed attempts gave their local reservations back
+    assert [pool.status()[0]["requests_total"] for pool in pools] == [1, 1]
+    assert [pool.status()[0]["in_flight"] for pool in pools] == [1, 1]
+
+
+def test_cooldown_is_shared_between_pools(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    pools = [ApiKeyPool("test", ["a"], calls_per_minute=60, burst=5) for _ in range(2)]
+    for pool in pools:
+        pool.shared_state = SharedState(path)
+
+    pools[0].cooldown(pools[0].acquire(), 60, "rate limited")
+    assert pools[1].acquire() is None
@@ -0,0 +1,69 @@
+import pytest
+
+from price_history import SPARKLINE_BARS, PriceHistory
+
+
+def test_window_returns_samples_oldest_first_since_a_time():
+    history = PriceHistory(capacity=10, min_spacing=0)
+    for t in range(5):
+        history.append("TON", 100 + t, 5.0 + t, 1_000.0)
+
+    times, prices, volumes = history.window("TON", since=102)
+    assert times.tolist() == [102, 103, 104]
+    assert prices.tolist() == [7.0, 8.0, 9.0]
+    assert volumes.tolist() == [1_000.0] * 3
+    assert [len(column) for column in history.window("BTC")] == [0, 0, 0]
+
+
+def test_ring_buffer_overwrites_the_oldest_samples():
+    history = PriceHistory(capacity=3, min_spacing=0)
+    for t in range(5):
+        history.append("TON", t, float(t))
+
+    assert history.window("TON")[1].tolist() == [2.0, 3.0, 4.0]
+
+
+def test_close_samples_replace_the_previous_one_and_old_ones_are_ignored():
+    history = PriceHistory(capacity=10, min_spacing=60)
+    history.append("TON", 0, 5.0)
+    history.append("TON", 30, 6.0)   # Within min_spacing: replaces the sample at 0
+    history.append("TON", 20, 9.0)   # Older than the latest: ignored
+    history.append("TON", 100, 7.0)
+
+    times, prices, _ = history.window("TON")
+    assert times.tolist() == [30, 100]
+    assert prices.tolist() == [6.0, 7.0]
+
+
+def test_change_since_uses_the_last_sample_at_or_before_the_time():
+    history = PriceHistory(capacity=10, min_spacing=0)
+    for t, price in ((0, 4.0), (60, 5.0), (120, 6.0)):
+        history.append("TON", t, price)
+
+    assert history.change_since("TON", 60) == pytest.approx(20.0)
+    assert history.change_since("TON", 90) == pytest.approx(20.0)
+    assert history.change_since("TON", -100) == pytest.approx(50.0)  # Shorter history: the first sample
+    assert history.change_since("TON", 120) is None
+    assert history.change_since("BTC", 0) is None
+
+
+def test_stats_summarise_the_window():
+    history = PriceHistory(capacity=10, min_spacing=0)
+    for t, price in ((0, 4.0), (60, 8.0), (120, 6.0)):
+        history.append("TON", t, price)
+
+    stats = history.stats("TON", 0)
+    assert (stats["min"], stats["max"], stats["first"], stats["last"], stats["samples"]) == (4.0, 8.0, 4.0, 6.0, 3)
+    assert stats["vwap"] == pytest.approx(6.0)  # Time-weighted without volume data
+    assert history.stats("TON", 1_000) is None
+
+
+def test_sparkline_spans_the_bars_from_low_to_high():
+    history = PriceHistory(capacity=10, min_spacing=0)
+    for t, price in enumerate((1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0)):
+        history.append("TON", t, price)
+
+    assert history.sparkline("TON", 0, width=8) == SPARKLINE_BARS
+    assert history.sparkline("TON", 0, width=4)[0] == SPARKLINE_BARS[0]
+    assert history.sparkline("TON", 0, width=4)[-1] == SPARKLINE_BARS[-1]
+    assert history.sparkline("TON", 7) == ""  # A single sample
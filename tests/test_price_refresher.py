@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import crypto_api
+import price_refresher
+from price_refresher import PriceRefresher
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Stands in for CoinMarketCap: refreshes return `prices`, where None is a failed fetch."""
+    prices = {"TON": {"price": 5.0}, "BTC": {"price": 50_000.0}}
+    monkeypatch.setattr(price_refresher, "get_crypto_prices",
+                        lambda symbols, use_cache=True: {symbol: prices.get(symbol) for symbol in symbols})
+    return prices
+
+
+@pytest.fixture
+def refresher(upstream, clock):
+    return PriceRefresher(["TON", "BTC"], clock=clock)
+
+
+def test_refresh_publishes_a_new_version(refresher, upstream, clock):
+    first = refresher.refresh_now()
+    upstream["TON"] = {"price": 6.0}
+    second = refresher.refresh_now(["TON"])
+
+    assert second.version == first.version + 1
+    assert second.prices == {"TON": {"price": 6.0}, "BTC": {"price": 50_000.0}}
+    assert first.prices["TON"] == {"price": 5.0}  # Published snapshots are never mutated
+    assert second.quoted_at == {"TON": clock(), "BTC": clock()}
+
+
+def test_failed_refresh_keeps_the_previous_price_marked_with_its_age(refresher, upstream, clock):
+    refresher.refresh_now()
+    upstream["TON"] = None
+    clock.advance(6 * 60)
+    snapshot = refresher.refresh_now()
+
+    assert snapshot.prices["TON"] == {"price": 5.0, "cache_age": 6 * 60}
+    assert snapshot.prices["BTC"] == {"price": 50_000.0}
+
+
+def test_stale_age_is_republished_every_minute(refresher, upstream, clock):
+    refresher.refresh_now()
+    version = refresher.snapshot().version
+
+    clock.advance(4 * 60)
+    refresher._expire_prices()
+    assert refresher.snapshot().version == version  # Still fresh
+
+    clock.advance(60)
+    refresher._expire_prices()
+    assert refresher.snapshot().prices["TON"]["cache_age"] == 5 * 60
+
+    clock.advance(30)
+    refresher._expire_prices()
+    assert refresher.snapshot().version == version + 1  # Same minute
+
+    for minutes in (6, 12, 25):
+        clock.now = 1_000.0 + minutes * 60
+        refresher._expire_prices()
+        assert refresher.snapshot().prices["TON"]["cache_age"] == minutes * 60
+
+
+def test_prices_past_the_max_staleness_are_dropped(refresher, upstream, clock):
+    refresher.refresh_now()
+    clock.advance(30 * 60)
+    refresher._expire_prices()
+
+    assert refresher.snapshot().prices == {"TON": None, "BTC": None}
+    version = refresher.snapshot().version
+    clock.advance(60)
+    refresher._expire_prices()
+    assert refresher.snapshot().version == version  # Nothing left to age
+
+
+def test_fx_table_is_renewed_ahead_of_expiry(refresher, monkeypatch):
+    renewals = []
+    monkeypatch.setattr(price_refresher, "get_fx_table", lambda use_cache=True: renewals.append(use_cache))
+    table = crypto_api.build_fx_table({"USD": 1.0, "EUR": 0.5}, datetime.now(timezone.utc))
+    monkeypatch.setattr(crypto_api, "fx_rate_table", table)
+
+    refresher._renew_fx_table()
+    assert renewals == []
+
+    monkeypatch.setattr(crypto_api, "fx_rate_table", table._replace(fetched_at=table.fetched_at - timedelta(minutes=56)))
+    refresher._renew_fx_table()
+    refresher._renew_fx_table()  # A failed renewal waits min_interval before the next attempt
+    assert renewals == [False]
+
+
+def test_listeners_see_every_published_snapshot(refresher, clock):
+    seen = []
+    refresher.add_listener(seen.append)
+    refresher.refresh_now()
+    clock.advance(5 * 60)
+    refresher._expire_prices()
+
+    assert [snapshot.version for snapshot in seen] == [1, 2]
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+import crypto_api
+from shared_state import SharedState
+
+
+@pytest.fixture
+def states(tmp_path, clock):
+    """Two SharedState instances on one file, standing in for two bot processes."""
+    path = str(tmp_path / "shared.sqlite3")
+    states = [SharedState(path, clock=clock), SharedState(path, clock=clock)]
+    yield states
+    for state in states:
+        state.close()
+
+
+def test_entries_are_visible_to_the_other_instance(states, clock):
+    first, second = states
+    first.put("crypto_price", "TON", {"price": 7.0}, clock())
+
+    assert second.get_many("crypto_price", ["TON", "BTC"], max_age=60) == {"TON": ({"price": 7.0}, clock())}
+    clock.advance(61)
+    assert second.get_many("crypto_price", ["TON"], max_age=60) == {}
+
+
+def test_older_entries_do_not_overwrite_newer_ones(states, clock):
+    first, second = states
+    first.put("crypto_price", "TON", {"price": 7.0}, clock())
+    second.put("crypto_price", "TON", {"price": 6.0}, clock() - 10)
+
+    assert first.get_many("crypto_price", ["TON"], max_age=60)["TON"][0] == {"price": 7.0}
+
+
+def test_a_lease_is_held_by_one_instance_until_released_or_expired(states, clock):
+    first, second = states
+
+    assert first.try_lease("crypto_price:TON", ttl=15)
+    assert first.try_lease("crypto_price:TON", ttl=15)  # Already ours
+    assert not second.try_lease("crypto_price:TON", ttl=15)
+
+    second.release_lease("crypto_price:TON")  # Not the holder: no effect
+    assert not second.try_lease("crypto_price:TON", ttl=15)
+    first.release_lease("crypto_price:TON")
+    assert second.try_lease("crypto_price:TON", ttl=15)
+
+    clock.advance(15)
+    assert first.try_lease("crypto_price:TON", ttl=15)
+
+
+def test_token_buckets_and_cooldowns_are_shared(states, clock):
+    first, second = states
+
+    assert first.take_token("cmc:0", rate_per_second=1, burst=2)
+    assert second.take_token("cmc:0", rate_per_second=1, burst=2)
+    assert not first.take_token("cmc:0", rate_per_second=1, burst=2)
+    clock.advance(1)
+    assert second.take_token("cmc:0", rate_per_second=1, burst=2)
+
+    clock.advance(10)
+    first.set_cooldown("cmc:0", 30, "rate limited")
+    assert not second.take_token("cmc:0", rate_per_second=1, burst=2)
+    clock.advance(30)
+    assert second.take_token("cmc:0", rate_per_second=1, burst=2)
+
+
+def test_shared_fetch_waits_for_the_other_instances_fetch(states, clock, monkeypatch):
+    holder, waiter = states
+    monkeypatch.setattr(crypto_api, "shared_state", waiter)
+    fetched = []
+
+    # The other process is fetching TON; only BTC is fetched here
+    assert holder.try_lease("crypto_price:TON", ttl=15)
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(value=crypto_api._shared_fetch(
+        "crypto_price", ["TON", "BTC"], 60, lambda keys: fetched.append(keys) or {key: {"price": 1.0} for key in keys})))
+    thread.start()
+
+    thread.join(0.3)
+    assert thread.is_alive()  # Polling for TON
+    holder.put("crypto_price", "TON", {"price": 7.0}, clock())
+    holder.release_lease("crypto_price:TON")
+    thread.join(5)
+
+    assert fetched == [["BTC"]]
+    fetched_here, shared = result["value"]
+    assert fetched_here == {"BTC": {"price": 1.0}}
+    assert shared == {"TON": ({"price": 7.0}, clock())}
+    assert holder.try_lease("crypto_price:BTC", ttl=15)  # Released after the fetch
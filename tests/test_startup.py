@@ -0,0 +1,55 @@
+import threading
+import time
+
+from startup import StartupPipeline
+
+
+def test_warm_up_returns_at_the_deadline_and_stragglers_finish_later():
+    release = threading.Event()
+    finished = []
+
+    def slow():
+        release.wait(5)
+        finished.append("slow")
+
+    pipeline = StartupPipeline(warm_deadline=0.2)
+    unfinished = pipeline.warm_up({"fast": lambda: finished.append("fast"), "slow": slow})
+
+    assert unfinished == ["slow"]
+    assert finished == ["fast"]
+    assert "warm_up:fast" in pipeline.timings and "warm_up:slow" not in pipeline.timings
+    assert pipeline.timings["warm_up"] < 1
+
+    release.set()
+    for _ in range(50):
+        if "warm_up:slow" in pipeline.timings:
+            break
+        time.sleep(0.05)
+    assert finished == ["fast", "slow"]
+
+
+def test_failed_tasks_do_not_stop_the_warm_up():
+    def fail():
+        raise RuntimeError("upstream down")
+
+    pipeline = StartupPipeline(warm_deadline=5)
+
+    assert pipeline.warm_up({"broken": fail, "fine": lambda: None}) == []
+    assert {"warm_up:broken", "warm_up:fine"} <= set(pipeline.timings)
+
+
+def test_phases_are_timed_in_order_and_ready_is_set_last():
+    pipeline = StartupPipeline()
+    with pipeline.phase("persistent_cache"):
+        pass
+    try:
+        with pipeline.phase("shared_state"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert not pipeline.ready.is_set()
+
+    pipeline.mark_ready()
+
+    assert list(pipeline.timings) == ["persistent_cache", "shared_state", "ready"]
+    assert pipeline.ready.is_set()
@@ -0,0 +1,161 @@
+from types import SimpleNamespace
+
+import pytest
+from telebot import apihelper
+
+from telegram_outbox import TelegramOutbox
+
+GROUP = -100
+
+
+def too_many_requests(retry_after):
+    return apihelper.ApiTelegramException("sendMessage", None, {
+        "ok": False, "error_code": 429, "description": "Too Many Requests",
+        "parameters": {"retry_after": retry_after}})
+
+
+class FakeBot:
+    """Records Bot API calls; `failures` are raised, in order, before calls succeed."""
+
+    def __init__(self, failures=()):
+        self.calls = []
+        self.failures = list(failures)
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            if self.failures:
+                raise self.failures.pop(0)
+            return SimpleNamespace(message_id=len(self.calls))
+        return call
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def outbox(bot, clock):
+    # No sender threads: tests send due calls one at a time with send_next()
+    return TelegramOutbox(bot, chat_rate=100, group_rate=100, chat_burst=10, clock=clock)
+
+
+def send_next(outbox):
+    """Sends the next call that is due now, as a sender thread would; returns False if none is."""
+    with outbox._condition:
+        if not outbox._ready or outbox._ready[0][0] > outbox.clock():
+            return False
+    chat_id, lane, outgoing = outbox._next_call()
+    outbox._finish(chat_id, lane, outgoing, outbox._send(outgoing))
+    return True
+
+
+def send_all(outbox):
+    while send_next(outbox):
+        pass
+
+
+def texts(bot, chat_id):
+    """The texts sent to a chat, in order."""
+    return [args[1] for method, args, _ in bot.calls if method == "send_message" and args[0] == chat_id]
+
+
+def test_sends_each_chats_calls_in_order(outbox, bot):
+    outbox.send_message(GROUP, "one")
+    outbox.send_message(GROUP, "two")
+    outbox.send_message(1, "private")
+    send_all(outbox)
+
+    assert texts(bot, GROUP) == ["one", "two"]
+    assert texts(bot, 1) == ["private"]
+    assert outbox.pending() == 0
+
+
+def test_queued_edits_of_a_message_are_coalesced(outbox, bot):
+    outbox.edit_message_text("first", GROUP, 7)
+    outbox.edit_message_text("other message", GROUP, 8)
+    outbox.edit_message_text("latest", GROUP, 7, parse_mode="Markdown")
+    send_all(outbox)
+
+    assert [(kwargs["message_id"], kwargs["text"]) for _, _, kwargs in bot.calls] == [(7, "latest"), (8, "other message")]
+    assert bot.calls[0][2]["parse_mode"] == "Markdown"
+
+
+def test_delete_drops_queued_edits_of_the_message(outbox, bot):
+    outbox.edit_message_text("edit", GROUP, 7)
+    outbox.edit_message_text("kept", GROUP, 8)
+    outbox.delete_message(GROUP, 7)
+    send_all(outbox)
+
+    assert [(method, kwargs.get("message_id", args[-1] if args else None)) for method, args, kwargs in bot.calls] == [
+        ("edit_message_text", 8), ("delete_message", 7)]
+
+
+def test_replace_key_supersedes_a_queued_send(outbox, bot):
+    sent = []
+    outbox.send_message(GROUP, "old prices", replace_key="crypto", on_sent=sent.append)
+    outbox.send_message(GROUP, "unrelated")
+    outbox.send_message(GROUP, "new prices", replace_key="crypto", on_sent=sent.append)
+    outbox.send_message(1, "other chat", replace_key="crypto")
+    send_all(outbox)
+
+    assert texts(bot, GROUP) == ["new prices", "unrelated"]
+    assert texts(bot, 1) == ["other chat"]
+    assert len(sent) == 1 and sent[0].message_id == bot.calls.index(("send_message", (GROUP, "new prices"), {})) + 1
+
+
+def test_429_holds_the_chat_for_retry_after(clock):
+    bot = FakeBot([too_many_requests(5)])
+    outbox = TelegramOutbox(bot, chat_rate=100, group_rate=100, chat_burst=10, clock=clock)
+    outbox.send_message(GROUP, "first")
+    outbox.send_message(GROUP, "second")
+    outbox.send_message(1, "other chat")
+
+    send_all(outbox)
+    assert texts(bot, GROUP) == ["first"] and texts(bot, 1) == ["other chat"]  # Only the group is on hold
+    assert outbox.pending() == 2
+
+    clock.advance(4.9)
+    assert not send_next(outbox)
+    clock.advance(0.1)
+    send_all(outbox)
+    assert texts(bot, GROUP) == ["first", "first", "second"]
+    assert outbox.pending() == 0
+
+
+def test_429_retries_are_capped(clock):
+    bot = FakeBot([too_many_requests(600) for _ in range(3)])
+    outbox = TelegramOutbox(bot, chat_rate=100, group_rate=100, chat_burst=10, clock=clock,
+                            max_retries=2, max_retry_after=60)
+    outbox.send_message(GROUP, "hello")
+
+    for _ in range(3):
+        assert send_next(outbox)
+        clock.advance(59)
+        assert not send_next(outbox)  # retry_after is capped at max_retry_after
+        clock.advance(1)
+
+    assert len(bot.calls) == 3  # The first attempt and max_retries retries
+    assert outbox.pending() == 0
+
+
+def test_other_errors_are_not_retried(clock):
+    bot = FakeBot([apihelper.ApiTelegramException("sendMessage", None, {
+        "ok": False, "error_code": 400, "description": "Bad Request: message is not modified"})])
+    outbox = TelegramOutbox(bot, clock=clock)
+    outbox.send_message(GROUP, "hello")
+    send_all(outbox)
+
+    assert len(bot.calls) == 1
+    assert outbox.pending() == 0
+
+
+def test_threads_drain_the_queue_on_stop(bot):
+    outbox = TelegramOutbox(bot, workers=2, chat_rate=100, group_rate=100, chat_burst=10)
+    for index in range(5):
+        outbox.send_message(index, "hello")
+    outbox.start()
+    outbox.stop(timeout=5)
+
+    assert sorted(args[0] for _, args, _ in bot.calls) == list(range(5))
@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ton_address import find_ton_address, has_ton_address
+
+FRIENDLY_ADDRESS = "EQ" + "a1B2-c3_D4" * 4 + "e5F6g7"
+RAW_ADDRESS = "0123456789" * 4 + "abcdEFGH"
+
+
+@pytest.mark.parametrize("text, address", [
+    (f"what about {FRIENDLY_ADDRESS}?", FRIENDLY_ADDRESS),
+    (RAW_ADDRESS, RAW_ADDRESS),
+    (f"{FRIENDLY_ADDRESS} or {RAW_ADDRESS}", FRIENDLY_ADDRESS),  # Only the first one is looked up
+    ("gm, has anyone checked the price of TON today?", None),
+    ("x" * 47, None),  # Shorter than an address
+    (FRIENDLY_ADDRESS + "X", None),  # Part of a longer word
+    ("", None),
+    (None, None),
+])
+def test_find_ton_address(text, address):
+    assert find_ton_address(text) == address
+
+
+def test_has_ton_address_filters_messages():
+    assert has_ton_address(SimpleNamespace(text=f"token: {FRIENDLY_ADDRESS}"))
+    assert not has_ton_address(SimpleNamespace(text="hello"))
+    assert not has_ton_address(SimpleNamespace(text=None))  # e.g. a photo without a caption
@@ -0,0 +1,97 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from webhook_server import WebhookServer
+
+PATH = "/telegram/webhook"
+SECRET = "s3cret"
+
+
+class FakeBot:
+    def __init__(self):
+        self.threaded = True
+        self.update_ids = []
+        self.processed = threading.Semaphore(0)
+
+    def process_new_updates(self, updates):
+        self.update_ids.extend(update.update_id for update in updates)
+        self.processed.release()
+
+
+def start_server(bot, **kwargs):
+    return WebhookServer(bot, host="127.0.0.1", port=0, path=PATH, secret_token=SECRET, **kwargs).start()
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def server(bot):
+    server = start_server(bot, workers=1)
+    yield server
+    server.stop(timeout=5)
+
+
+def post(server, body, path=PATH, secret=SECRET):
+    port = server._server.server_address[1]
+    headers = {"Content-Type": "application/json"}
+    if secret is not None:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=body, headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def update(update_id):
+    return json.dumps({"update_id": update_id}).encode()
+
+
+def test_updates_are_acknowledged_and_processed(server, bot):
+    assert post(server, update(1)) == 200
+    assert bot.processed.acquire(timeout=5)
+    assert bot.update_ids == [1]
+    assert not bot.threaded
+
+
+@pytest.mark.parametrize("secret", [None, "wrong", "sécret"])
+def test_requests_without_the_secret_are_refused(server, bot, secret):
+    assert post(server, update(1), secret=secret) == 403
+    assert bot.update_ids == []
+
+
+def test_bad_requests_are_refused(server):
+    assert post(server, update(1), path="/other") == 404
+    assert post(server, b"not json") == 400
+    assert post(server, b"[1, 2]") == 400
+
+
+def test_redeliveries_are_dropped(server, bot):
+    assert post(server, update(1)) == 200
+    assert post(server, update(1)) == 200
+    assert post(server, update(2)) == 200
+    for _ in range(2):
+        assert bot.processed.acquire(timeout=5)
+
+    assert not bot.processed.acquire(timeout=0.2)
+    assert bot.update_ids == [1, 2]
+
+
+def test_a_full_queue_answers_503_and_accepts_the_redelivery_later(bot):
+    server = start_server(bot, workers=0, queue_size=1)
+    try:
+        assert post(server, update(1)) == 200
+        assert post(server, update(2)) == 503
+
+        server._updates.get_nowait()
+        assert post(server, update(2)) == 200  # Not mistaken for a redelivery of an accepted update
+    finally:
+        server.stop(timeout=5)
@@ -0,0 +1,24 @@
+import re
+
+from constants import TON_ADDRESS_REGEX
+
+# Runs on every text message in every group, so it has to reject ordinary chat cheaply
+TON_ADDRESS_PATTERN = re.compile(TON_ADDRESS_REGEX)
+TON_ADDRESS_LENGTH = 48  # Both address forms are exactly 48 characters
+
+
+def find_ton_address(text):
+    """
+    Returns the first TON contract address in a message, or None.
+
+    Messages shorter than an address (most chat) are rejected on their length alone,
+    and the rest get a single search of the precompiled pattern rather than findall.
+    """
+    if not text or len(text) < TON_ADDRESS_LENGTH:
+        return None
+    match = TON_ADDRESS_PATTERN.search(text)
+    return match.group() if match else None
+
+def has_ton_address(message):
+    """Message handler filter: True if the message text contains a TON contract address."""
+    return find_ton_address(message.text) is not None
@@ -0,0 +1,151 @@
+import hmac
+import json
+import queue
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+import metrics
+from constants import WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE
+
+WEBHOOK_QUEUE_FULL = metrics.counter("cryptoteller_webhook_rejected_total", "Webhook updates refused because the queue was full.")
+WEBHOOK_DUPLICATES = metrics.counter("cryptoteller_webhook_duplicates_total", "Webhook updates dropped as redeliveries.")
+
+# update_ids remembered per process to drop Telegram's redeliveries
+RECENT_UPDATE_IDS = 4096
+
+
+class WebhookServer:
+    """
+    Receives Telegram updates over HTTP and runs them on a bounded worker pool.
+
+    A POST to `path` is parsed, queued and acknowledged with 200 straight away, so
+    Telegram never waits on a handler. When the queue is full the server answers
+    503 and Telegram redelivers the update later. Instances keep no state about
+    each other, so several can run behind a load balancer; GET /healthz is there
+    for its health checks.
+
+    Locally, updates can be POSTed by hand:
+        curl -X POST -H "Content-Type: application/json" -d @update.json http://127.0.0.1:8443/telegram/webhook
+    """
+
+    def __init__(self, bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret_token=None,
+                 workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+
+        self._updates = queue.Queue(maxsize=queue_size)
+        self._recent_update_ids = OrderedDict()
+        self._recent_lock = threading.Lock()
+        self._threads = []
+        self._server = None
+
+    def start(self):
+        """Starts the worker threads and the HTTP server (both daemon threads)."""
+        # Handlers run on our own pool, so telebot must not hand them to its own
+        self.bot.threaded = False
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"webhook-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), self._request_handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="webhook-http", daemon=True).start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stops accepting updates and lets the workers finish the queued ones."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        for _ in self._threads:
+            self._updates.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def submit(self, update_json):
+        """
+        Queues one decoded update without blocking.
+
+        Returns:
+            bool: False if the queue is full and the update should be redelivered.
+        """
+        update_id = update_json.get("update_id")
+        with self._recent_lock:
+            if update_id in self._recent_update_ids:
+                WEBHOOK_DUPLICATES.inc()
+                return True
+            self._recent_update_ids[update_id] = None
+            if len(self._recent_update_ids) > RECENT_UPDATE_IDS:
+                self._recent_update_ids.popitem(last=False)
+        try:
+            self._updates.put_nowait(update_json)
+        except queue.Full:
+            with self._recent_lock:
+                self._recent_update_ids.pop(update_id, None)
+            WEBHOOK_QUEUE_FULL.inc()
+            return False
+        return True
+
+    def _work(self):
+        while True:
+            update_json = self._updates.get()
+            if update_json is None:
+                return
+            try:
+                self.bot.process_new_updates([types.Update.de_json(update_json)])
+            except Exception as e:
+                print(f"Error processing webhook update {update_json.get('update_id')}: {e}")
+
+    def _request_handler(self):
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path == "/healthz":
+                    self._reply(200, b"ok")
+                else:
+                    self._reply(404, b"not found")
+
+            def do_POST(self):
+                if self.path != server.path:
+                    self._reply(404, b"not found")
+                    return
+                # compare_digest raises on non-ASCII str, so compare bytes and let any header just mismatch
+                if server.secret_token and not hmac.compare_digest(
+                        self.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode(), server.secret_token.encode()):
+                    self._reply(403, b"forbidden")
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    update_json = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._reply(400, b"invalid update")
+                    return
+                if not isinstance(update_json, dict):
+                    self._reply(400, b"invalid update")
+                elif server.submit(update_json):
+                    self._reply(200, b"")
+                else:
+                    self._reply(503, b"busy")
+
+            def _reply(self, status, body):
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return RequestHandler